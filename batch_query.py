@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Set
+
+from openai import OpenAI
+
+import chat
+import chat_vm
+from config import settings
+from embedding_scheduler import EmbeddingScheduler
+from llm_router import create_backend_router, format_stats
+from retrieval import rerank_stats, search_many
+from vector_store import get_vector_store
+
+# Perguntas em lote (avaliação, pré-aquecer caches).
+# Entrada JSONL: {"id": "...", "query": "...", "top_k": 3} por linha (id e top_k opcionais)
+# Uso: poetry run batch-query questions.jsonl answers.jsonl [--retrieval-only]
+
+def read_queries(path: str) -> Iterator[Dict]:
+    """Lê as perguntas. Sem "id", o número da linha vira o id."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            entry.setdefault("id", line_number)
+            yield entry
+
+def completed_ids(path: str) -> Set:
+    """Ids que já estão no arquivo de saída (para continuar de onde parou)."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["id"])
+            except (json.JSONDecodeError, KeyError):
+                break  # Última linha incompleta
+    return done
+
+def truncate_partial_line(path: str):
+    """Remove uma última linha incompleta (o processo caiu escrevendo)."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+
+def batched(entries: Iterator[Dict], size: int) -> Iterator[List[Dict]]:
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class BatchQueryRunner:
+    """Embeddings em batches grandes (EmbeddingScheduler), busca multi-vector e
+    geração com concorrência limitada. Cada resultado é gravado assim que fica pronto."""
+
+    def __init__(self, backend: str, generate: bool, default_top_k: int, search_batch_size: int,
+                 generate_workers: int):
+        self.backend = backend
+        self.generate = generate
+        self.default_top_k = default_top_k
+        self.search_batch_size = search_batch_size
+        self.generate_workers = generate_workers
+
+        client = OpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL)
+        self.scheduler = EmbeddingScheduler(
+            client, settings.EMBEDDING_MODEL,
+            max_concurrency=settings.EMBEDDING_CONCURRENCY,
+            max_batch_tokens=settings.EMBEDDING_MAX_BATCH_TOKENS,
+            max_batch_items=settings.EMBEDDING_MAX_BATCH_ITEMS,
+            max_retries=settings.EMBEDDING_MAX_RETRIES,
+            dimensions=settings.EMBEDDING_DIM,
+        )
+        # Mesmo router do chat / chat_vm (failover e hedge entre os endpoints)
+        self.llm_router = create_backend_router(backend) if generate else None
+        if generate and self.llm_router is None:
+            raise RuntimeError(f"no endpoint configured for backend '{backend}'")
+        self.vector_store = get_vector_store()
+        self.vector_store.connect()
+        self.vector_store.load()
+
+        self.stage_seconds = {"embed": 0.0, "search": 0.0, "generate": 0.0}
+        self.counts = {"embed": 0, "search": 0, "generate": 0}
+
+    def _search(self, entries: List[Dict], embeddings: List[List[float]]) -> List[List[Dict]]:
+        """Uma busca multi-vector por grupo de perguntas com o mesmo top_k."""
+        results: List[List[Dict]] = [None] * len(entries)
+        by_top_k: Dict[int, List[int]] = {}
+        for i, entry in enumerate(entries):
+            by_top_k.setdefault(int(entry.get("top_k", self.default_top_k)), []).append(i)
+        for top_k, indexes in by_top_k.items():
+            for start in range(0, len(indexes), self.search_batch_size):
+                group = indexes[start:start + self.search_batch_size]
+                for i, docs in zip(group, search_many(self.vector_store, [embeddings[i] for i in group], top_k)):
+                    results[i] = docs
+        return results
+
+    def _generate(self, entry: Dict, docs: List[Dict]) -> Dict:
+        module = chat_vm if self.backend == "vm" else chat
+        content, reasoning, stats = self.llm_router.stream_chat_completion(
+            **module.generation_params(entry["query"], docs)
+        )
+        return {"answer": content or reasoning, "generation": stats.to_dict()}
+
+    def run_batch(self, entries: List[Dict], output) -> int:
+        start = time.perf_counter()
+        embeddings = self.scheduler.embed([entry["query"] for entry in entries])
+        self.stage_seconds["embed"] += time.perf_counter() - start
+        self.counts["embed"] += len(entries)
+
+        start = time.perf_counter()
+        all_docs = self._search(entries, embeddings)
+        self.stage_seconds["search"] += time.perf_counter() - start
+        self.counts["search"] += len(entries)
+
+        def write(entry: Dict, docs: List[Dict], extra: Dict):
+            result = {
+                "id": entry["id"],
+                "query": entry["query"],
+                "sources": [
+                    {key: doc[key] for key in ("file_name", "page_number", "chunk_id", "score")} for doc in docs
+                ],
+                **extra,
+            }
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+
+        if not self.generate:
+            for entry, docs in zip(entries, all_docs):
+                write(entry, docs, {})
+            return len(entries)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.generate_workers, thread_name_prefix="generate") as executor:
+            futures = {
+                executor.submit(self._generate, entry, docs): (entry, docs)
+                for entry, docs in zip(entries, all_docs) if docs
+            }
+            for entry, docs in zip(entries, all_docs):
+                if not docs:
+                    write(entry, docs, {"answer": None})
+            for future in as_completed(futures):
+                entry, docs = futures[future]
+                try:
+                    write(entry, docs, future.result())
+                except Exception as e:
+                    # Não grava: a pergunta é refeita na próxima execução
+                    print(f"Generation failed for {entry['id']}: {e}")
+                    continue
+                self.counts["generate"] += 1
+        self.stage_seconds["generate"] += time.perf_counter() - start
+        return len(entries)
+
+    def report(self, elapsed: float, total: int):
+        print(f"Done: {total} queries in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f} queries/s)")
+        for stage, seconds in self.stage_seconds.items():
+            if self.counts[stage]:
+                print(f"  {stage:>8}: {self.counts[stage]} queries in {seconds:.1f}s "
+                      f"({self.counts[stage] / seconds if seconds else 0:.1f} queries/s)")
+        if rerank_stats["queries"]:
+            print(f"  rerank ({settings.RERANK_METHOD}): {rerank_stats['total_ms'] / rerank_stats['queries']:.2f} ms/query "
+                  f"(included in search)")
+        print(f"  Embedding API: {self.scheduler.requests} requests, {self.scheduler.rate_limited} rate limited")
+        if self.llm_router is not None and self.counts["generate"]:
+            print("  " + format_stats(self.llm_router.stats()).replace("\n", "\n  "))
+
+def main():
+    """Responde (ou só busca) as perguntas de um JSONL e grava os resultados em outro JSONL."""
+    parser = argparse.ArgumentParser(description="Batch RAG queries from a JSONL file")
+    parser.add_argument("input", help="JSONL with one {\"query\": ...} per line")
+    parser.add_argument("output", help="JSONL results (appended, already answered ids are skipped)")
+    parser.add_argument("--retrieval-only", action="store_true", help="Only search, no LLM answers")
+    parser.add_argument("--backend", choices=["openai", "vm"], default="openai")
+    parser.add_argument("--top-k", type=int, default=settings.RETRIEVAL_TOP_K)
+    parser.add_argument("--batch-size", type=int, default=1000, help="Queries embedded and searched per round")
+    parser.add_argument("--search-batch-size", type=int, default=256, help="Vectors per multi-vector search")
+    parser.add_argument("--generate-workers", type=int, default=8, help="Concurrent LLM requests")
+    args = parser.parse_args()
+
+    truncate_partial_line(args.output)
+    done = completed_ids(args.output)
+    if done:
+        print(f"Resuming: {len(done)} queries already answered in {args.output}")
+
+    runner = BatchQueryRunner(args.backend, not args.retrieval_only, args.top_k,
+                              args.search_batch_size, args.generate_workers)
+    pending = (entry for entry in read_queries(args.input) if entry["id"] not in done)
+
+    start = time.perf_counter()
+    total = 0
+    try:
+        with open(args.output, "a", encoding="utf-8") as output:
+            for batch in batched(pending, args.batch_size):
+                total += runner.run_batch(batch, output)
+                print(f"Processed {total} queries")
+    finally:
+        runner.scheduler.shutdown()
+    runner.report(time.perf_counter() - start, total)
+
+if __name__ == "__main__":
+    main()
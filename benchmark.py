@@ -0,0 +1,262 @@
+import argparse
+import json
+import random
+import resource
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from config import settings
+from fake_openai import start_fake_server
+
+# Benchmark do ingest e das perguntas, sem rede: PDFs sintéticos (PyMuPDF), servidor fake
+# da OpenAI (fake_openai.py) e o vector store embutido (numpy) num diretório temporário.
+# Uso: poetry run benchmark [--save-baseline] [--pdfs 4 --pages 50 --queries 50 --latency 0.02]
+
+WORDS = ("contrato cláusula prazo valor pagamento empresa documento página relatório anual "
+         "receita despesa cliente fornecedor produto serviço entrega garantia multa rescisão "
+         "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor").split()
+
+# Métricas comparadas com o baseline e se é melhor maior ou menor
+REGRESSION_CHECKS = {
+    "ingest.pages_per_sec": "higher",
+    "ingest.chunks_per_sec": "higher",
+    "ingest.embedding_requests": "lower",
+    "query.total.p50_ms": "lower",
+    "query.total.p95_ms": "lower",
+    "query.total.p99_ms": "lower",
+    "query.ttft.p50_ms": "lower",
+    "query.ttft.p95_ms": "lower",
+    # A latência das perguntas repetidas fica abaixo de 1 ms (ruído demais para a tolerância)
+    "answer_cache.hit_rate": "higher",
+    "memory.peak_rss_mb": "lower",
+}
+
+def random_paragraph(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(30, 90))) + "."
+
+def generate_pdfs(directory: Path, n_pdfs: int, pages_per_pdf: int, seed: int) -> int:
+    """PDFs sintéticos (sempre os mesmos para a mesma seed). Retorna o total de páginas."""
+    import fitz  # PyMuPDF
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    for n in range(n_pdfs):
+        doc = fitz.open()
+        for _ in range(pages_per_pdf):
+            page = doc.new_page()
+            text = "\n\n".join(random_paragraph(rng) for _ in range(rng.randint(3, 6)))
+            page.insert_textbox(fitz.Rect(40, 40, 555, 800), text, fontsize=9)
+        doc.save(directory / f"synthetic_{n:03d}.pdf")
+        doc.close()
+    return n_pdfs * pages_per_pdf
+
+def percentiles(seconds: List[float]) -> Dict[str, float]:
+    values = np.asarray(seconds) * 1000
+    return {f"p{q}_ms": round(float(np.percentile(values, q)), 2) for q in (50, 95, 99)}
+
+def peak_rss_mb() -> Dict[str, float]:
+    """Pico de memória (RSS) deste processo e dos processos filhos (extração do ingest)."""
+    # ru_maxrss é em KB no Linux
+    return {
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_rss_children_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+def configure(workdir: Path, base_url: str):
+    """Aponta o projeto para o servidor fake e para arquivos dentro de `workdir`."""
+    settings.OPENAI_BASE_URL = base_url
+    settings.OPENAI_API_KEY = "fake"
+    settings.LOCAL_VM_ADDRESS = base_url
+    settings.VECTOR_STORE = "numpy"
+    settings.NUMPY_STORE_DIR = str(workdir / "vector_store")
+    settings.PDF_DIRECTORY = str(workdir / "pdfs")
+    settings.MANIFEST_PATH = str(workdir / "index_manifest.json")
+    settings.INDEX_TUNING_PATH = str(workdir / "index_tuning.json")
+    settings.EMBEDDING_CACHE_ENABLED = False
+    settings.ANSWER_CACHE_ENABLED = False
+
+def bench_ingest(pages: int) -> Dict:
+    """Roda o ingest real (process_all_pdfs) do zero."""
+    import vectorizer
+    from index_manifest import IndexManifest
+
+    vectorizer.initialize_connections()
+    vectorizer.setup_collection(drop_existing=True)
+    manifest = IndexManifest(settings.MANIFEST_PATH).load()
+
+    start = time.perf_counter()
+    chunks = vectorizer.process_all_pdfs(manifest)
+    vectorizer.vector_store.flush()
+    vectorizer.vector_store.build_index()
+    elapsed = time.perf_counter() - start
+    vectorizer.embedding_scheduler.shutdown()
+
+    return {
+        "pages": pages,
+        "chunks": chunks,
+        "seconds": round(elapsed, 3),
+        "pages_per_sec": round(pages / elapsed, 1),
+        "chunks_per_sec": round(chunks / elapsed, 1),
+        "embedding_requests": vectorizer.embedding_scheduler.requests,
+        "rate_limited": vectorizer.embedding_scheduler.rate_limited,
+    }
+
+def make_queries(n_queries: int, seed: int) -> List[str]:
+    rng = random.Random(seed + 1)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 12))) + "?" for _ in range(n_queries)]
+
+def bench_queries(n_queries: int, seed: int, top_k: int) -> Dict:
+    """Perguntas pelo caminho do chat: embedding, busca e resposta em streaming pelo router
+    (sem imprimir), com o TTFT de cada resposta."""
+    import chat
+
+    if not chat.initialize_connections():
+        raise RuntimeError("Benchmark collection was not created")
+
+    stages = {"embed": [], "search": [], "ttft": [], "generate": [], "total": []}
+    for query in make_queries(n_queries, seed):
+        start = time.perf_counter()
+        embedding = chat.backend.generate_query_embedding(query)
+        embedded = time.perf_counter()
+        docs = chat.backend.search_similar_documents(query, top_k=top_k, query_embedding=embedding)
+        searched = time.perf_counter()
+        _, stats = chat.stream_response(chat.build_messages(query, chat.context_passages(docs)), on_text=None)
+        done = time.perf_counter()
+        stages["embed"].append(embedded - start)
+        stages["search"].append(searched - embedded)
+        if stats.ttft is not None:
+            stages["ttft"].append(stats.ttft)
+        stages["generate"].append(done - searched)
+        stages["total"].append(done - start)
+
+    total_seconds = sum(stages["total"])
+    return {
+        "queries": n_queries,
+        "queries_per_sec": round(n_queries / total_seconds, 1),
+        **{stage: percentiles(seconds) for stage, seconds in stages.items() if seconds},
+    }
+
+def bench_answer_cache(n_queries: int, seed: int, top_k: int) -> Dict:
+    """As mesmas perguntas duas vezes com o ANSWER_CACHE_ENABLED: a primeira passada preenche
+    os caches (embeddings e respostas) e a segunda mede as perguntas repetidas."""
+    import chat
+
+    settings.ANSWER_CACHE_ENABLED = True
+    chat.backend.init_caches()
+    try:
+        queries = make_queries(n_queries, seed)
+        passes = []
+        for _ in range(2):
+            seconds, hits = [], 0
+            for query in queries:
+                start = time.perf_counter()
+                embedding = chat.backend.generate_query_embedding(query)
+                docs = chat.backend.search_similar_documents(query, top_k=top_k, query_embedding=embedding)
+                if chat.backend.answer_cache.lookup(embedding, docs) is not None:
+                    hits += 1
+                else:
+                    answer, _ = chat.stream_response(chat.build_messages(query, chat.context_passages(docs)), on_text=None)
+                    chat.backend.answer_cache.put(query, embedding, docs, answer)
+                seconds.append(time.perf_counter() - start)
+            passes.append(seconds)
+        return {
+            # Fração das perguntas repetidas respondidas pelo cache
+            "hit_rate": round(hits / len(queries), 3) if queries else 0.0,
+            "first": percentiles(passes[0]),
+            "repeat": percentiles(passes[1]),
+        }
+    finally:
+        settings.ANSWER_CACHE_ENABLED = False
+        chat.backend.answer_cache = None
+
+def flatten(results: Dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Métricas que pioraram mais que `tolerance` (fração) em relação ao baseline."""
+    current, previous = flatten(results), flatten(baseline)
+    regressions = []
+    for metric, better in REGRESSION_CHECKS.items():
+        if metric not in current or not previous.get(metric):
+            continue
+        change = (current[metric] - previous[metric]) / previous[metric]
+        worse = change < -tolerance if better == "higher" else change > tolerance
+        marker = "REGRESSION" if worse else "ok"
+        print(f"  {metric:<28}{previous[metric]:>12}{current[metric]:>12}{change:>+10.1%}  {marker}")
+        if worse:
+            regressions.append(metric)
+    return regressions
+
+def main():
+    """Gera os PDFs, roda ingest e perguntas contra o servidor fake e compara com o baseline."""
+    parser = argparse.ArgumentParser(description="Offline ingest and query benchmark")
+    parser.add_argument("--pdfs", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=50, help="Pages per PDF")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=settings.RETRIEVAL_TOP_K)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency", type=float, default=0.02, help="Fake API latency per request (seconds)")
+    parser.add_argument("--rpm", type=int, default=0, help="Fake API requests per minute (0 = unlimited)")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Fake LLM speed (0 = instant)")
+    parser.add_argument("--baseline", default="benchmark_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed change before flagging (0.2 = 20%%)")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    server, base_url = start_fake_server(latency=args.latency, rpm=args.rpm, dim=settings.EMBEDDING_DIM,
+                                         tokens_per_second=args.tokens_per_second)
+    with tempfile.TemporaryDirectory(prefix="rag-benchmark-") as tmp:
+        workdir = Path(tmp)
+        configure(workdir, base_url)
+        pages = generate_pdfs(Path(settings.PDF_DIRECTORY), args.pdfs, args.pages, args.seed)
+
+        print(f"Benchmark: {args.pdfs} PDFs x {args.pages} pages, {args.queries} queries, "
+              f"fake API latency {args.latency * 1000:.0f} ms")
+        ingest = bench_ingest(pages)
+        query = bench_queries(args.queries, args.seed, args.top_k)
+        answer_cache = bench_answer_cache(args.queries, args.seed, args.top_k)
+    server.shutdown()
+
+    results = {
+        "config": {key: getattr(args, key) for key in ("pdfs", "pages", "queries", "top_k", "seed",
+                                                        "latency", "rpm", "tokens_per_second")},
+        "ingest": ingest,
+        "query": query,
+        "answer_cache": answer_cache,
+        "memory": peak_rss_mb(),
+    }
+    print(json.dumps({key: results[key] for key in ("ingest", "query", "answer_cache", "memory")}, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"✅ Baseline saved to {baseline_path}")
+        return
+    if not baseline_path.exists():
+        print(f"No baseline at {baseline_path} (run with --save-baseline to create one)")
+        return
+
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    if baseline.get("config") != results["config"]:
+        print("Warning: baseline was recorded with a different configuration")
+    print(f"\nComparison with {baseline_path} (tolerance {args.tolerance:.0%}):")
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"❌ {len(regressions)} regression(s): {', '.join(regressions)}")
+        raise SystemExit(1)
+    print("✅ No regressions")
+
+if __name__ == "__main__":
+    main()
@@ -1,154 +1,107 @@
-import sys
-from typing import List, Dict
-from openai import OpenAI
-from pymilvus import connections, Collection
+from typing import List, Dict, Tuple
+import chat_session
+from chat_session import ChatBackend
+from startup import BackgroundWarmup, StartupTimer
 from config import settings
+from context_builder import build_context, render_context
+from conversation import Conversation, context_prompt
+from llm_router import create_backend_router
+from streaming import GenerationStats, print_stream
+from tracing import span
 
-# Global variables for connections
-client = None
-collection = None
+def connect_openai():
+    """Client da OpenAI para os embeddings e o router dos endpoints de chat."""
+    backend.connect_embeddings()
+    backend.llm_router = create_backend_router("openai")
+
+def startup_tasks() -> List[List[Tuple]]:
+    """Passos da inicialização. O client da OpenAI e o load da coleção rodam em paralelo."""
+    openai_steps = [("openai client", connect_openai)]
+    if settings.STARTUP_WARMUP_EMBEDDING:
+        openai_steps.append(("embedding warmup", backend.warmup_embeddings))
+    return [openai_steps, [("collection load", backend.load_collection)]]
 
 def initialize_connections():
-    """Incia openAI e milvus"""
-    global client, collection
-    
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
-    
-    # Conexão com milvus
-    connections.connect("default", host=settings.MILVUS_HOST, port=settings.MILVUS_PORT)
-    
-    # Load da coleção
-    try:
-        collection = Collection(settings.COLLECTION_NAME)
-        collection.load()
-        print(f"Connected to collection '{settings.COLLECTION_NAME}'")
-        return True
-    except Exception as e:
-        print(f"Error connecting to collection: {e}")
-        print("Please run the vectorizer first to create the collection")
-        return False
-
-def generate_query_embedding(query: str) -> List[float]:
-    """Faz o embedding da pergunta (query) usando OpenAI. Precisamos do embedding para buscar documentos similares."""
-    response = client.embeddings.create(input=[query],model="text-embedding-3-large")
-    return response.data[0].embedding
-
-def search_similar_documents(query: str, top_k: int = 5) -> List[Dict]:
-    """Pega o embedding da pergunta(query) e faz a busca usando IP (Inner Product)."""
-    query_embedding = generate_query_embedding(query)
-    
-    search_params = {"metric_type": "IP", "params": {"nprobe": 10}}
-    
-    results = collection.search(
-        data=[query_embedding],
-        anns_field="vector",
-        param=search_params,
-        limit=top_k,
-        output_fields=["text", "file_name", "page_number"]
-    )
-    
-    similar_docs = []
-    for hit in results[0]:
-        similar_docs.append({
-            "text": hit.entity.get("text"),
-            "file_name": hit.entity.get("file_name"),
-            "page_number": hit.entity.get("page_number"),
-            "score": hit.score
-        })
-    
-    return similar_docs
+    """Incia openAI e milvus (bloqueando, sem warmup em background)"""
+    return backend.initialize(connect_openai)
+
+def context_passages(context_docs: List[Dict]) -> List[Dict]:
+    """Passagens que cabem no contexto (settings.CONTEXT_MAX_TOKENS)."""
+    return build_context(context_docs, settings.CONTEXT_MAX_TOKENS, settings.CHAT_MODEL)
+
+# Instruções fixas: o system é igual em todas as perguntas
+SYSTEM_PROMPT = """Você é um assistente útil chamado CAIO que responde perguntas baseado no contexto de documentos fornecidos. 
+             Responda sempre em português. Se introduza sempre como CAIO, um assistente de IA que ajuda a responder perguntas sobre documentos PDF.
+    Use o contexto dos documentos que vem junto com a pergunta para responder. Se a resposta não estiver no contexto, diga isso claramente.
+    Caso alguem te pergunte algo sobre como voce pode ajudar, sua base de informações ou coisas parecidas, forneca um resumo do contexto dos documentos cadastrados."""
+
+def build_messages(query: str, passages: List[Dict], history: List[Dict] = None) -> List[Dict]:
+    """Monta as mensagens para o modelo. O que se repete entre as perguntas vem primeiro
+    (instruções fixas no system, depois o histórico da conversa) e o contexto vai com a
+    pergunta na última mensagem: o prefix cache do servidor reaproveita o system e o
+    histórico mesmo quando a busca muda."""
+    # Chunks da mesma página são unidos (sem o texto repetido) até o limite de tokens
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        *(history or []),
+        {"role": "user", "content": context_prompt(query, render_context(passages))}
+    ]
+
+def completion_params(messages: List[Dict]) -> Dict:
+    """Parâmetros do chat.completions (modelo, mensagens e limites)."""
+    return {
+        "model": settings.CHAT_MODEL,
+        "messages": messages,
+        "max_tokens": 30000,
+        "temperature": 0.4,
+    }
+
+def generation_params(query: str, context_docs: List[Dict], history: List[Dict] = None) -> Dict:
+    """completion_params de uma pergunta avulsa (serviço e batch), com o contexto dos documentos."""
+    return completion_params(build_messages(query, context_passages(context_docs), history))
+
+def stream_response(messages: List[Dict], on_text=print_stream) -> Tuple[str, GenerationStats]:
+    """Gera a resposta com streaming: cada pedaço vai para `on_text` assim que chega.
+    Retorna o texto completo e os tempos (TTFT, tokens/s)."""
+    with span("query.generate", model=settings.CHAT_MODEL) as generate_span:
+        content, _, stats = backend.llm_router.stream_chat_completion(
+            on_text=on_text,
+            **completion_params(messages)
+        )
+        generate_span.set(tokens=stats.completion_tokens, endpoint=stats.endpoint,
+                          prompt_tokens=stats.prompt_tokens, cached_tokens=stats.cached_tokens,
+                          ttft_ms=stats.ttft and round(stats.ttft * 1000, 1))
+    return content, stats
+
+def print_response(messages: List[Dict]) -> Tuple[str, GenerationStats]:
+    """Resposta impressa enquanto é gerada (loop do chat_session)."""
+    return stream_response(messages)
 
 def generate_response(query: str, context_docs: List[Dict]) -> str:
     """Função da OPENAI para gerar a resposta baseada nos documentos similares encontrados."""
-    # Contexto
-    context_text = "\n\n".join([
-        f"From {doc['file_name']} (page {doc['page_number']}):\n{doc['text']}"
-        for doc in context_docs
-    ])
-    
-    # USER_Prompt
-    prompt = f"""Você é um assistente de IA útil que responde perguntas baseado em documentos PDF.
-    Use o seguinte contexto dos documentos para responder à pergunta do usuário. Se a resposta não estiver no contexto, diga isso claramente.
-    Caso alguem te pergunte algo sobre como voce pode ajudar, sua base de informações ou coisas parecidas, forneca um resumo do contexto dos documentos cadastrados.
-    Contexto:
-    {context_text}
+    content, _ = stream_response(build_messages(query, context_passages(context_docs)), on_text=None)
+    return content
 
-    Pergunta: {query}
+def new_conversation() -> Conversation:
+    return Conversation(settings.CHAT_MODEL, settings.HISTORY_MAX_TOKENS, settings.CONVERSATION_REUSE_THRESHOLD,
+                        settings.CONVERSATION_MAX_REUSE_TURNS)
 
-    Resposta:"""
+# Busca, caches e clients (compartilhados com o chat_vm.py) com o prompt e a geração deste módulo
+backend = ChatBackend("openai", context_passages, build_messages, print_response, new_conversation)
 
-
-    system = """Você é um assistente útil chamado CAIO que responde perguntas baseado no contexto de documentos fornecidos. 
-             Responda sempre em português. Se introduza sempre como CAIO, um assistente de IA que ajuda a responder perguntas sobre documentos PDF."""
-    
-    
-    response = client.chat.completions.create(
-        model="gpt-4.1-mini",
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=30000,
-        temperature=0.4
-    )
-    
-    return response.choices[0].message.content
-
-def chat_loop():
-    """chat loop."""
-    print("\nPDF Chat Assistant")
-    print("=" * 50)
-    print("Ask questions about your PDF documents. Type 'quit' to exit.")
-    print()
-    
-    while True:
-        try:
-            query = input("You: ").strip()
-            
-            if query.lower() in ['quit', 'exit', 'bye']:
-                print("Goodbye!")
-                break
-            
-            if not query:
-                continue
-            
-            print("Searching for relevant documents...")
-            
-            # Busca de documentos similares
-            similar_docs = search_similar_documents(query, top_k=3)
-            
-            if not similar_docs:
-                print("No relevant documents found for your query.")
-                continue
-            
-            print(f"Found {len(similar_docs)} relevant document(s)")
-            
-            # Resposta
-            print("Generating response...")
-            response = generate_response(query, similar_docs)
-            
-            print(f"\nAssistant: {response}\n")
-            
-            # Print dos documentos similares encontrados
-            print("Sources:")
-            for i, doc in enumerate(similar_docs, 1):
-                print(f"  {i}. {doc['file_name']} (page {doc['page_number']}) - Score: {doc['score']:.3f}")
-            print()
-            
-        except KeyboardInterrupt:
-            print("\nGoodbye!")
-            break
-        except Exception as e:
-            print(f"Error: {e}")
+def chat_loop(warmup: BackgroundWarmup = None):
+    """chat loop. Com `warmup`, a primeira pergunta espera a inicialização em background."""
+    chat_session.chat_loop(backend, "PDF Chat Assistant", warmup=warmup)
 
 def main():
     """Main function"""
-    # Initialize connections
-    if not initialize_connections():
-        sys.exit(1)
+    # Conexões e load da coleção em background, o prompt aparece na hora
+    backend.init_caches()
+    warmup = BackgroundWarmup(startup_tasks(), StartupTimer()).start()
+    warmup.timer.mark_prompt_ready()
     
     # Start chat loop
-    chat_loop()
+    chat_loop(warmup)
 
 if __name__ == "__main__":
     main()
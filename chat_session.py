@@ -0,0 +1,250 @@
+import sys
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from config import settings
+from conversation import Conversation, format_stats as format_conversation_stats, format_turn
+from llm_router import LLMRouter, format_stats
+from query_cache import IndexVersion, QueryEmbeddingCache, SemanticAnswerCache
+from retrieval import scope_command, search_many
+from startup import BackgroundWarmup
+from streaming import GenerationStats
+from tracing import export_metrics, span
+from vector_store import SearchScope, VectorStore, get_vector_store
+
+# Loop do chat, o mesmo no chat.py (OpenAI) e no chat_vm.py (VMs). Cada um passa um ChatBackend
+# com o prompt e a geração dele; a busca e os caches são iguais nos dois e ficam no ChatBackend
+
+class ChatBackend:
+    """O que o loop do chat usa de um backend. context_passages, build_messages, print_response
+    e new_conversation vêm do módulo (chat.py ou chat_vm.py); o embedding da pergunta, a busca,
+    os caches e o load da coleção são os mesmos nos dois.
+    Os clients, o vector store e os caches são preenchidos na inicialização (às vezes em
+    background), então o loop os lê do objeto a cada pergunta."""
+
+    def __init__(self, name: str,
+                 context_passages: Callable[[List[Dict]], List[Dict]],
+                 build_messages: Callable[..., List[Dict]],
+                 print_response: Callable[[List[Dict]], Tuple[Optional[str], GenerationStats]],
+                 new_conversation: Callable[[], Conversation]):
+        self.name = name
+        self.context_passages = context_passages
+        self.build_messages = build_messages
+        self.print_response = print_response
+        self.new_conversation = new_conversation
+        self.embedding_client = None
+        self.llm_router: Optional[LLMRouter] = None
+        self.vector_store: Optional[VectorStore] = None
+        self.query_cache: Optional[QueryEmbeddingCache] = None
+        self.answer_cache: Optional[SemanticAnswerCache] = None
+
+    def init_caches(self):
+        """Caches das perguntas (embeddings e, opcional, respostas)."""
+        self.query_cache = QueryEmbeddingCache(settings.QUERY_EMBEDDING_CACHE_SIZE)
+        if settings.ANSWER_CACHE_ENABLED:
+            self.answer_cache = SemanticAnswerCache(settings.ANSWER_CACHE_THRESHOLD, settings.ANSWER_CACHE_TTL_SECONDS,
+                                                    settings.ANSWER_CACHE_MAX_ENTRIES,
+                                                    IndexVersion(settings.MANIFEST_PATH))
+
+    def connect_embeddings(self):
+        """Client da OpenAI para os embeddings (o import do openai é pesado, fica fora do caminho até o prompt)."""
+        from openai import OpenAI
+        self.embedding_client = OpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL)
+
+    def load_collection(self):
+        """Conexão com milvus (ou vector store embutido) e load da coleção."""
+        vector_store = get_vector_store()
+        vector_store.connect()
+        if not vector_store.exists():
+            raise RuntimeError(f"collection '{settings.COLLECTION_NAME}' not found")
+        vector_store.load()
+        self.vector_store = vector_store
+
+    def warmup_embeddings(self):
+        """Uma request de embedding antes da primeira pergunta (abre a conexão HTTPS com a API)."""
+        self.embedding_client.embeddings.create(input=["warmup"], model=settings.EMBEDDING_MODEL,
+                                                dimensions=settings.EMBEDDING_DIM)
+
+    def initialize(self, connect: Callable[[], None]) -> bool:
+        """Caches, clients (`connect` do módulo) e load da coleção, bloqueando (sem warmup em background)."""
+        self.init_caches()
+        connect()
+        try:
+            self.load_collection()
+            print(f"Connected to collection '{settings.COLLECTION_NAME}'")
+            return True
+        except Exception as e:
+            print(f"Error connecting to collection: {e}")
+            print("Please run the vectorizer first to create the collection")
+            return False
+
+    def generate_query_embedding(self, query: str) -> List[float]:
+        """Faz o embedding da pergunta (query) usando OpenAI. Precisamos do embedding para buscar documentos similares.
+        Perguntas repetidas vêm do cache, sem chamar a API."""
+        with span("query.embed") as embed_span:
+            embedding = self.query_cache.get(query) if self.query_cache is not None else None
+            embed_span.set(cache_hit=embedding is not None)
+            if embedding is None:
+                response = self.embedding_client.embeddings.create(input=[query], model=settings.EMBEDDING_MODEL,
+                                                                   dimensions=settings.EMBEDDING_DIM)
+                embedding = response.data[0].embedding
+                embed_span.set(tokens=response.usage.prompt_tokens)
+                if self.query_cache is not None:
+                    self.query_cache.put(query, embedding)
+        return embedding
+
+    def search_similar_documents(self, query: str, top_k: int = 5, query_embedding: List[float] = None,
+                                 timings: Dict = None, scope: SearchScope = None) -> List[Dict]:
+        """Pega o embedding da pergunta(query) e faz a busca usando IP (Inner Product)."""
+        if query_embedding is None:
+            query_embedding = self.generate_query_embedding(query)
+        return search_many(self.vector_store, [query_embedding], top_k, timings, scope)[0]
+
+def wait_for_startup(warmup: BackgroundWarmup) -> bool:
+    """Antes de cada pergunta: espera o que ainda falta da inicialização (só a primeira costuma esperar)."""
+    if not warmup.wait():
+        print(f"Error during startup ({warmup.failed_step}): {warmup.error}")
+        print("Please run the vectorizer first to create the collection")
+        return False
+    return True
+
+def print_sources(passages: List[Dict]):
+    print("Sources:")
+    for i, passage in enumerate(passages, 1):
+        print(f"  {i}. {passage['file_name']} (page {passage['page_number']}) - Score: {passage['score']:.3f}"
+              + (f" ({len(passage['chunk_ids'])} chunks)" if len(passage['chunk_ids']) > 1 else ""))
+        if passage["references"]:
+            shown = ", ".join(f"{file_name} p.{page_number}" for file_name, page_number in passage["references"][:3])
+            more = len(passage["references"]) - 3
+            print(f"     also in: {shown}" + (f" (+{more} more)" if more > 0 else ""))
+    print()
+
+def answer_question(backend: ChatBackend, query: str, scope: SearchScope,
+                    conversation: Optional[Conversation]) -> Optional[Dict]:
+    """Uma pergunta: busca (ou chunks reutilizados da conversa), resposta e fontes.
+    Retorna os números do turno na conversa (None sem conversa ou sem resposta)."""
+    with span("query", backend=backend.name) as query_span:
+        query_embedding = backend.generate_query_embedding(query)
+        timings = {}
+
+        # Continuação da conversa: reutiliza os chunks da última busca
+        similar_docs = conversation.reusable_docs(query_embedding, scope) if conversation is not None else None
+        context_reused = similar_docs is not None
+        if context_reused:
+            print(f"Reusing the {len(similar_docs)} document(s) of the previous search "
+                  f"(similarity {conversation.similarity:.2f})")
+        else:
+            print("Searching for relevant documents...")
+
+            # Busca de documentos similares
+            similar_docs = backend.search_similar_documents(query, top_k=settings.RETRIEVAL_TOP_K,
+                                                            query_embedding=query_embedding, timings=timings,
+                                                            scope=scope)
+
+            if not similar_docs:
+                print("No relevant documents found for your query" + (f" in {scope}." if scope.active else "."))
+                return None
+            if conversation is not None:
+                conversation.set_retrieval(query_embedding, similar_docs, scope)
+
+            print(f"Found {len(similar_docs)} relevant document(s)"
+                  + (f" (reranked with {settings.RERANK_METHOD} in {timings['rerank_ms']:.1f} ms)"
+                     if "rerank_ms" in timings else ""))
+            if scope.active:
+                print(f"Search in {scope}: {timings['search_ms']:.1f} ms"
+                      + (f" (unscoped: {timings['unscoped_search_ms']:.1f} ms)"
+                         if "unscoped_search_ms" in timings else ""))
+
+        # Perguntas anteriores da conversa (a resposta depende delas, então não usa o cache de respostas)
+        history = conversation.history() if conversation is not None else []
+
+        # Contexto e mensagens montados uma vez: vão para o modelo, para a conversa e para as fontes
+        passages = backend.context_passages(similar_docs)
+        messages = backend.build_messages(query, passages, history)
+
+        # Mesma pergunta (ou parecida) com os mesmos chunks: reutiliza a resposta
+        answer_cache = backend.answer_cache
+        cached = (answer_cache.lookup(query_embedding, similar_docs)
+                  if answer_cache is not None and not history else None)
+        query_span.set(items=len(similar_docs), answer_cached=cached is not None, scoped=scope.active,
+                       context_reused=context_reused, history_turns=len(history) // 2)
+        stats = None
+        if cached is not None:
+            response = cached.answer
+            print(f"\nAssistant (cached): {response}\n")
+        else:
+            # Resposta (impressa enquanto é gerada); None se o backend não respondeu
+            print("\nAssistant: ", end="", flush=True)
+            response, stats = backend.print_response(messages)
+            print(f"\n\n({stats})")
+            if answer_cache is not None and response and not history:
+                answer_cache.put(query, query_embedding, similar_docs, response)
+
+        turn_stats = None
+        if conversation is not None and response:
+            turn_stats = conversation.add_turn(query, response, messages, stats)
+            if stats is not None:
+                print(f"({format_turn(turn_stats, conversation.similarity)})")
+        if stats is not None:
+            print()
+
+        print_sources(passages)
+    return turn_stats
+
+def chat_loop(backend: ChatBackend, title: str, notes: Sequence[str] = (),
+              warmup: BackgroundWarmup = None):
+    """Loop do chat. Com `warmup`, a primeira pergunta espera a inicialização em background."""
+    print(f"\n{title}")
+    print("=" * 50)
+    print("Ask questions about your PDF documents. Type 'quit' to exit, '/stats' for LLM endpoint stats.")
+    print("'/scope <files or patterns>' and '/filter <Milvus expression>' limit the search ('clear' removes them).")
+    if settings.CONVERSATION_ENABLED:
+        print("Follow-up questions use the conversation history; '/reset' starts a new conversation.")
+    for note in notes:
+        print(note)
+    print()
+
+    scope = SearchScope()
+    conversation = backend.new_conversation() if settings.CONVERSATION_ENABLED else None
+    while True:
+        try:
+            # Atualiza o arquivo do Prometheus com a última pergunta enquanto o usuário digita
+            export_metrics()
+            query = input("You: ").strip()
+
+            if query.lower() in ['quit', 'exit', 'bye']:
+                print("Goodbye!")
+                break
+
+            if not query:
+                continue
+
+            if warmup is not None and not wait_for_startup(warmup):
+                sys.exit(1)
+
+            # Métricas dos endpoints do LLM (TTFT, erros, hedges)
+            if query.lower() == "/stats":
+                print(format_stats(backend.llm_router.stats()))
+                if conversation is not None:
+                    print(format_conversation_stats(conversation.stats()))
+                print()
+                continue
+
+            # Nova conversa (sem histórico e sem os chunks da última busca)
+            if query.lower() == "/reset":
+                if conversation is not None:
+                    conversation.reset()
+                print("✅ New conversation\n")
+                continue
+
+            # Escopo da busca (arquivos / filtro)
+            if query.split(" ", 1)[0] in ("/scope", "/filter"):
+                scope = scope_command(query, scope)
+                continue
+
+            answer_question(backend, query, scope, conversation)
+
+        except KeyboardInterrupt:
+            print("\nGoodbye!")
+            break
+        except Exception as e:
+            print(f"Error: {e}")
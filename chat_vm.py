@@ -1,189 +1,157 @@
-import sys
-from typing import List, Dict
-from openai import OpenAI
-from pymilvus import connections, Collection
+from typing import List, Dict, Optional, Tuple
+import chat_session
+from chat_session import ChatBackend
+from startup import BackgroundWarmup, StartupTimer
 from config import settings
+from context_builder import build_context, render_context
+from conversation import Conversation, context_prompt
+from llm_router import backend_endpoints, create_router
+from streaming import GenerationStats, print_stream
+from tracing import span
 
-# Global variables for connections
-openai_client = None
-vm_client = None
-collection = None
+def vm_endpoints() -> List[Dict]:
+    """Endpoints do modelo: VM_ENDPOINTS ou a VM local e a VM do runpod (as que estiverem configuradas)."""
+    return backend_endpoints("vm")
 
-def initialize_connections():
-    """Inicia OPENAI, Milvus e VM nesta bomba"""
-    global openai_client, vm_client, collection
-    
+def connect_clients():
+    """Client da OpenAI (embeddings) e router das VMs (o import do openai é pesado, fica fora do caminho até o prompt)."""
     # OpenAI
-    openai_client = OpenAI(api_key=settings.OPENAI_API_KEY)
-    
-    # VM client para rodar seu modelo na VM do runpod
-    vm_client = OpenAI(api_key=settings.OPENAI_API_KEY,
-        #base_url=settings.VM_ADDRESS,  # VM no runpod.io, tire o comentario se quiser usar 
-        base_url= settings.LOCAL_VM_ADDRESS,  # Local VM, tire o comentario se quiser usar uma VM local
-    )
-    
-    # Milvus
-    connections.connect("default", host=settings.MILVUS_HOST, port=settings.MILVUS_PORT)
+    backend.connect_embeddings()
     
-    # Pega a coleção
+    # Router entre as VMs que rodam o modelo (failover, escolha pela latência)
+    endpoints = vm_endpoints()
+    if not endpoints:
+        raise RuntimeError("no VM configured (set LOCAL_VM_ADDRESS, VM_ADDRESS or VM_ENDPOINTS)")
+    backend.llm_router = create_router(endpoints, settings.VM_MODEL)
+
+def startup_tasks() -> List[List[Tuple]]:
+    """Passos da inicialização. Os clients e o load da coleção rodam em paralelo."""
+    client_steps = [("openai clients", connect_clients)]
+    if settings.STARTUP_WARMUP_EMBEDDING:
+        client_steps.append(("embedding warmup", backend.warmup_embeddings))
+    return [client_steps, [("collection load", backend.load_collection)]]
+
+def initialize_connections():
+    """Inicia OPENAI, Milvus e VM nesta bomba (bloqueando, sem warmup em background)"""
+    return backend.initialize(connect_clients)
+
+def context_passages(context_docs: List[Dict]) -> List[Dict]:
+    """Passagens que cabem no contexto (settings.VM_CONTEXT_MAX_TOKENS)."""
+    return build_context(context_docs, settings.VM_CONTEXT_MAX_TOKENS, settings.VM_MODEL)
+
+# Prompt super simples, apenas para funcionar mesmo (fixo: o system é igual em todas as perguntas)
+SYSTEM_PROMPT = """Você é um assistente útil chamado CAIO que responde perguntas baseado no contexto de documentos fornecidos. Responda sempre em português.
+        Baseado no contexto dos documentos que vem junto com a pergunta, responda às perguntas do usuário em português."""
+
+def build_messages(query: str, passages: List[Dict], history: List[Dict] = None) -> List[Dict]:
+    """Monta as mensagens para o modelo da VM. Instruções fixas no system, depois o histórico
+    e, na última mensagem, o contexto com a pergunta: o RadixAttention do SGLang (ou o prefix
+    caching do vLLM) reaproveita o KV cache do system e do histórico entre as perguntas."""
+    # Chunks da mesma página são unidos (sem o texto repetido) até o limite de tokens
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        *(history or []),
+        {"role": "user", "content": context_prompt(query, render_context(passages))}
+    ]
+
+def completion_params(messages: List[Dict]) -> Dict:
+    """Parâmetros do chat.completions para o modelo da VM."""
+    return {
+        "model": settings.VM_MODEL,
+        "messages": messages,
+        #"extra_body": {"chat_template_kwargs": {"thinking": True}}, # Esse é para o granite
+        "max_tokens": 25000,
+        "temperature": 0.3,
+    }
+
+def generation_params(query: str, context_docs: List[Dict], history: List[Dict] = None) -> Dict:
+    """completion_params de uma pergunta avulsa (serviço e batch), com o contexto dos documentos."""
+    return completion_params(build_messages(query, context_passages(context_docs), history))
+
+def stream_response(messages: List[Dict], on_text=print_stream,
+                    on_reasoning=print_stream) -> Tuple[str, GenerationStats]:
+    """Gera a resposta no modelo da VM com streaming. O content vai para `on_text` e o
+    reasoning_content para `on_reasoning` conforme chegam. Retorna o texto e os tempos (TTFT, tokens/s)."""
     try:
-        collection = Collection(settings.COLLECTION_NAME)
-        collection.load()
-        print(f"Connected to collection '{settings.COLLECTION_NAME}'")
-        return True
+        # Vamos usar o modelo de uma VM, seja no runpod.io ou em qualquer outra VM que você tenha configurado
+        with span("query.generate", model=settings.VM_MODEL) as generate_span:
+            content, reasoning, stats = backend.llm_router.stream_chat_completion(
+                on_text=on_text,
+                on_reasoning=on_reasoning,
+                **completion_params(messages)
+            )
+            generate_span.set(tokens=stats.completion_tokens, reasoning_tokens=stats.reasoning_tokens,
+                              endpoint=stats.endpoint, prompt_tokens=stats.prompt_tokens,
+                              cached_tokens=stats.cached_tokens,
+                              ttft_ms=stats.ttft and round(stats.ttft * 1000, 1))
     except Exception as e:
-        print(f"Error connecting to collection: {e}")
-        print("Please run the vectorizer first to create the collection")
-        return False
-
-def generate_query_embedding(query: str) -> List[float]:
-    """Faz a geração do embedding da consulta (Pergunta ou Query) usando OpenAI
-    Resumidamente o embedding é uma representação numérica do texto
-    que pode ser usado para comparar similaridade entre textos."""
-    response = openai_client.embeddings.create(
-        input=[query],
-        model="text-embedding-3-large"
-    )
-    return response.data[0].embedding
-
-def search_similar_documents(query: str, top_k: int = 5) -> List[Dict]:
-    """Usa IP (Inner Product) para buscar documentos similares no Milvus
-    com base no embedding da consulta."""
-    query_embedding = generate_query_embedding(query)
-    
-    search_params = {"metric_type": "IP", "params": {"nprobe": 10}}
-    
-    results = collection.search(
-        data=[query_embedding],
-        anns_field="vector",
-        param=search_params,
-        limit=top_k,
-        output_fields=["text", "file_name", "page_number"]
-    )
-    
-    similar_docs = []
-    for hit in results[0]:
-        similar_docs.append({
-            "text": hit.entity.get("text"),
-            "file_name": hit.entity.get("file_name"),
-            "page_number": hit.entity.get("page_number"),
-            "score": hit.score
-        })
+        print(f"ERROR in generate_response: {e}")
+        return f"Erro ao gerar resposta: {str(e)}", GenerationStats()
     
-    return similar_docs
+    # Handle both content and reasoning_content fields
+    if content:
+        return content, stats
+    if reasoning:
+        # SGLang with reasoning parser puts response in reasoning_content
+        return reasoning, stats
+    return "Desculpe, não consegui gerar uma resposta. O modelo retornou conteúdo vazio.", stats
 
 def generate_response(query: str, context_docs: List[Dict]) -> str:
     """Verifica se o modelo VM está rodando e gera uma resposta
     usando o modelo VM com base nos documentos contextuais.
     Mesma forma do generate_response do chat normal, mas esse nos usamos o modelo alocado em uma VM."""
-    # Context
-    context_text = "\n\n".join([
-        f"From {doc['file_name']} (page {doc['page_number']}):\n{doc['text']}"
-        for doc in context_docs
-    ])
-    
-    # Prompt super simples, apenas para funcionar mesmo
-    prompt = f"""Baseado no seguinte contexto dos documentos, responda à pergunta do usuário em português.
-        Contexto:
-        {context_text}
-        Pergunta: {query}
-        Resposta:"""
-    
-    system = "Você é um assistente útil chamado CAIO que responde perguntas baseado no contexto de documentos fornecidos. Responda sempre em português."
-    
-    try:
-        # Vamos usar o modelo de uma VM, seja no runpod.io ou em qualquer outra VM que você tenha configurado
-        response = vm_client.chat.completions.create(
-            model=settings.VM_MODEL,
-            messages=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": prompt}
-            ],
-            #extra_body={"chat_template_kwargs": {"thinking": True}}, # Esse é para o granite
-            max_tokens=25000,
-            temperature=0.3,
-            stream=False
-        )
-        
-        # Check if response and choices exist
-        if response and hasattr(response, 'choices') and response.choices:
-            choice = response.choices[0]
-            message = choice.message
-            
-            # Handle both content and reasoning_content fields
-            if hasattr(message, 'content') and message.content:
-                return message.content
-            elif hasattr(message, 'reasoning_content') and message.reasoning_content:
-                # SGLang with reasoning parser puts response in reasoning_content
-                return message.reasoning_content
-            else:
-                return "Desculpe, não consegui gerar uma resposta. O modelo retornou conteúdo vazio."
-        else:
-            return "Erro: Resposta inválida do modelo."
-            
-    except Exception as e:
-        print(f"ERROR in generate_response: {e}")
-        return f"Erro ao gerar resposta: {str(e)}"
+    response, _ = stream_response(build_messages(query, context_passages(context_docs)),
+                                  on_text=None, on_reasoning=None)
+    return response
+
+def new_conversation() -> Conversation:
+    return Conversation(settings.VM_MODEL, settings.VM_HISTORY_MAX_TOKENS, settings.CONVERSATION_REUSE_THRESHOLD,
+                        settings.CONVERSATION_MAX_REUSE_TURNS)
+
+class StreamPrinter:
+    """Imprime o reasoning e a resposta conforme chegam, separando os dois."""
+
+    def __init__(self):
+        self.in_reasoning = False
 
+    def reasoning(self, text: str):
+        if not self.in_reasoning:
+            print("[reasoning] ", end="")
+            self.in_reasoning = True
+        print_stream(text)
 
-def chat_loop():
+    def content(self, text: str):
+        if self.in_reasoning:
+            print("\n\n", end="")
+            self.in_reasoning = False
+        print_stream(text)
+
+def print_response(messages: List[Dict]) -> Tuple[Optional[str], GenerationStats]:
+    """Resposta impressa enquanto é gerada (loop do chat_session). Erros da VM voltam como
+    None: não vão para o cache de respostas nem para o histórico."""
+    printer = StreamPrinter()
+    response, stats = stream_response(messages, on_text=printer.content, on_reasoning=printer.reasoning)
+    return (response if stats.ttft is not None else None), stats
+
+# Busca, caches e clients (compartilhados com o chat.py) com o prompt e a geração deste módulo
+backend = ChatBackend("vm", context_passages, build_messages, print_response, new_conversation)
+
+def chat_loop(warmup: BackgroundWarmup = None):
     """Loop de chat para interagir com o usuário e responder perguntas
-    sobre os documentos PDF usando o modelo VM."""
-    print("\nPDF Chat Assistant (VM Model)")
-    print("=" * 50)
-    print("Ask questions about your PDF documents. Type 'quit' to exit.")
-    print("Using VM model: {}".format(settings.VM_MODEL))
-    #print("VM Address: {}".format(settings.VM_ADDRESS))
-    print()
-    
-    while True:
-        try:
-            query = input("You: ").strip()
-            
-            if query.lower() in ['quit', 'exit', 'bye']:
-                print("Goodbye!")
-                break
-            
-            if not query:
-                continue
-            
-            print("Searching for relevant documents...")
-            
-            # Busca de documentos similares
-            similar_docs = search_similar_documents(query, top_k=3)
-            
-            if not similar_docs:
-                print("No relevant documents found for your query.")
-                continue
-            
-            print(f"Found {len(similar_docs)} relevant document(s)")
-            
-            # Resposta
-            print("Generating response with VM model...")
-            response = generate_response(query, similar_docs)
-            
-            print(f"\nAssistant: {response}\n")
-            
-            # Print dos documentos similares encontrados
-            print("Sources:")
-            for i, doc in enumerate(similar_docs, 1):
-                print(f"  {i}. {doc['file_name']} (page {doc['page_number']}) - Score: {doc['score']:.3f}")
-            print()
-            
-        except KeyboardInterrupt:
-            print("\nGoodbye!")
-            break
-        except Exception as e:
-            print(f"Error in chat loop: {e}")
+    sobre os documentos PDF usando o modelo VM. Com `warmup`, a primeira pergunta
+    espera a inicialização em background."""
+    chat_session.chat_loop(backend, "PDF Chat Assistant (VM Model)",
+                           notes=["Using VM model: {}".format(settings.VM_MODEL)], warmup=warmup)
 
 def main():
     """Main function"""
-    # Initialize connections
-    if not initialize_connections():
-        sys.exit(1)
+    # Conexões e load da coleção em background, o prompt aparece na hora
+    backend.init_caches()
+    warmup = BackgroundWarmup(startup_tasks(), StartupTimer()).start()
+    warmup.timer.mark_prompt_ready()
     
     # Start chat loop
-    chat_loop()
+    chat_loop(warmup)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,362 @@
+import argparse
+import hashlib
+import json
+import mmap
+import re
+import shutil
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import settings
+
+# Uma linha do índice: hash do chunk_id, onde começa o bloco no chunks.bin, tamanho do bloco
+# (comprimido) e a posição / tamanho do texto dentro do bloco descomprimido
+INDEX_DTYPE = np.dtype([("key", "<u8"), ("block_offset", "<u8"), ("block_size", "<u4"),
+                        ("offset", "<u4"), ("length", "<u4")])
+
+# Blocos descomprimidos mantidos em memória (LRU)
+BLOCK_CACHE_SIZE = 256
+
+def chunk_key(chunk_id: str) -> int:
+    """Chave de 64 bits do chunk_id (o chunk_id vem do hash da página, então o mesmo
+    chunk_id tem sempre o mesmo texto)."""
+    return int.from_bytes(hashlib.md5(chunk_id.encode("utf-8")).digest()[:8], "little")
+
+def get_codec(compression: str):
+    """(compress, decompress) do codec ((None, None) sem compressão)."""
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("CHUNK_STORE_COMPRESSION=zstd needs the zstandard package "
+                              "(poetry install --extras zstd, or use zlib)")
+        compressor, decompressor = zstandard.ZstdCompressor(level=3), zstandard.ZstdDecompressor()
+        return compressor.compress, decompressor.decompress
+    if compression == "zlib":
+        return (lambda data: zlib.compress(data, 6)), zlib.decompress
+    if compression == "none":
+        return None, None
+    raise ValueError(f"Unknown chunk store compression: {compression}")
+
+class ChunkStore:
+    """Texto dos chunks fora do vector store, num arquivo local append-only:
+    chunks.bin tem os textos em blocos (comprimidos com zstd/zlib ou não) e chunks.idx
+    uma linha de tamanho fixo por chunk_id. Os dois são memory-mapped: sem compressão
+    a leitura de um texto não copia o bloco, com compressão só o bloco do texto é
+    descomprimido (e fica num cache LRU). As chaves ficam ordenadas em memória
+    (_sorted_keys / _order) e as linhas novas são intercaladas nelas, sem reordenar tudo.
+
+    Vários processos podem ler enquanto o vectorizer escreve: um chunk_id que não está
+    no índice carregado faz o índice ser relido."""
+
+    def __init__(self, path: str = None, compression: str = None, block_bytes: int = None):
+        self.path = Path(path or settings.CHUNK_STORE_DIR)
+        self.compression = compression or settings.CHUNK_STORE_COMPRESSION
+        self.block_bytes = block_bytes or settings.CHUNK_STORE_BLOCK_KB * 1024
+        self._lock = threading.RLock()
+        self._blocks: OrderedDict = OrderedDict()
+        self._data = None
+        self._data_size = 0
+        self._index = np.zeros(0, dtype=INDEX_DTYPE)
+        self._order = np.zeros(0, dtype=np.int64)
+        self._sorted_keys = np.zeros(0, dtype=np.uint64)
+
+    @property
+    def data_path(self) -> Path:
+        return self.path / "chunks.bin"
+
+    @property
+    def index_path(self) -> Path:
+        return self.path / "chunks.idx"
+
+    @property
+    def info_path(self) -> Path:
+        return self.path / "info.json"
+
+    def open(self) -> "ChunkStore":
+        """Abre (ou cria) o store. O codec vai no info.json na criação; um store existente
+        escrito com outro codec (ou sem o info.json) é erro, em vez de ler os blocos errado."""
+        with self._lock:
+            if self.info_path.exists():
+                with open(self.info_path, "r", encoding="utf-8") as f:
+                    stored = json.load(f).get("compression")
+                if stored != self.compression:
+                    raise ValueError(f"Chunk store {self.path} was written with compression '{stored}', "
+                                     f"but '{self.compression}' is configured (set CHUNK_STORE_COMPRESSION="
+                                     f"{stored} or rebuild it with `vectorize --full`)")
+            elif self.data_path.exists() and self.data_path.stat().st_size:
+                raise ValueError(f"Chunk store {self.path} has no {self.info_path.name}, the compression "
+                                 f"is unknown (rebuild it with `vectorize --full`)")
+            # Antes de criar os arquivos: zstd sem o zstandard falha aqui
+            self._compress, self._decompress = get_codec(self.compression)
+            if not self.info_path.exists():
+                self.path.mkdir(parents=True, exist_ok=True)
+                self.data_path.touch()
+                self.index_path.touch()
+                with open(self.info_path, "w", encoding="utf-8") as f:
+                    json.dump({"compression": self.compression}, f)
+            self._refresh()
+        return self
+
+    def clear(self) -> "ChunkStore":
+        """Apaga tudo (re-index completo), inclusive um store escrito com outro codec."""
+        with self._lock:
+            self._close_data()
+            shutil.rmtree(self.path, ignore_errors=True)
+            self._index = np.zeros(0, dtype=INDEX_DTYPE)
+            self._order = np.zeros(0, dtype=np.int64)
+            self._sorted_keys = np.zeros(0, dtype=np.uint64)
+            self._blocks.clear()
+            self.compression = settings.CHUNK_STORE_COMPRESSION
+            return self.open()
+
+    def _close_data(self):
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+            self._data_size = 0
+
+    def _refresh(self):
+        """Relê o que foi acrescentado no índice e remapeia o chunks.bin se ele cresceu.
+        Linhas do índice que apontam para além do fim do chunks.bin (escrita interrompida) são ignoradas."""
+        data_size = self.data_path.stat().st_size
+        if data_size != self._data_size:
+            self._close_data()
+            if data_size:
+                with open(self.data_path, "rb") as f:
+                    self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._data_size = data_size
+
+        n_rows = self.index_path.stat().st_size // INDEX_DTYPE.itemsize
+        if n_rows > len(self._index):
+            with open(self.index_path, "rb") as f:
+                f.seek(len(self._index) * INDEX_DTYPE.itemsize)
+                new = np.frombuffer(f.read((n_rows - len(self._index)) * INDEX_DTYPE.itemsize), dtype=INDEX_DTYPE)
+            new = new[new["block_offset"] + new["block_size"] <= self._data_size]
+            self._merge(new)
+
+    def _merge(self, new: np.ndarray):
+        """Acrescenta linhas ao índice e intercala as chaves delas nas já ordenadas
+        (O(n) de cópia em vez de um argsort do índice inteiro a cada put_many)."""
+        if not len(new):
+            return
+        new_order = np.argsort(new["key"], kind="stable")
+        new_keys = new["key"][new_order]
+        # side="right": uma chave repetida fica depois das antigas, e a busca acha a primeira gravada
+        positions = np.searchsorted(self._sorted_keys, new_keys, side="right")
+        self._sorted_keys = np.insert(self._sorted_keys, positions, new_keys)
+        self._order = np.insert(self._order, positions, new_order + len(self._index))
+        self._index = np.concatenate([self._index, new])
+
+    def _find(self, keys: np.ndarray) -> np.ndarray:
+        """Linha do índice de cada chave (-1 se não existe)."""
+        if not len(self._sorted_keys):
+            return np.full(len(keys), -1, dtype=np.int64)
+        positions = np.searchsorted(self._sorted_keys, keys)
+        positions = np.minimum(positions, len(self._sorted_keys) - 1)
+        return np.where(self._sorted_keys[positions] == keys, self._order[positions], -1)
+
+    def put_many(self, rows: List[Dict]):
+        """Grava o texto dos rows (chunk_id, text) que ainda não estão no store."""
+        with self._lock:
+            keys = np.array([chunk_key(row["chunk_id"]) for row in rows], dtype=np.uint64)
+            missing = self._find(keys) < 0
+            texts: Dict[int, bytes] = {}
+            for key, row, is_missing in zip(keys.tolist(), rows, missing):
+                if is_missing:
+                    texts.setdefault(key, row["text"].encode("utf-8"))
+            if not texts:
+                return
+
+            # Textos agrupados em blocos de ~block_bytes
+            blocks, current, current_size = [], [], 0
+            for key, data in texts.items():
+                if current and current_size + len(data) > self.block_bytes:
+                    blocks.append(current)
+                    current, current_size = [], 0
+                current.append((key, data))
+                current_size += len(data)
+            blocks.append(current)
+
+            offset = self.data_path.stat().st_size
+            entries = []
+            with open(self.data_path, "ab") as f:
+                for block in blocks:
+                    raw = b"".join(data for _, data in block)
+                    stored = self._compress(raw) if self._compress is not None else raw
+                    f.write(stored)
+                    position = 0
+                    for key, data in block:
+                        entries.append((key, offset, len(stored), position, len(data)))
+                        position += len(data)
+                    offset += len(stored)
+            # O índice é escrito depois dos dados: uma linha no índice sempre tem o texto no disco
+            with open(self.index_path, "ab") as f:
+                f.write(np.array(entries, dtype=INDEX_DTYPE).tobytes())
+            self._refresh()
+
+    def _block(self, block_offset: int, block_size: int) -> bytes:
+        block = self._blocks.get(block_offset)
+        if block is None:
+            block = self._decompress(self._data[block_offset:block_offset + block_size])
+            self._blocks[block_offset] = block
+            if len(self._blocks) > BLOCK_CACHE_SIZE:
+                self._blocks.popitem(last=False)
+        else:
+            self._blocks.move_to_end(block_offset)
+        return block
+
+    def get_many(self, chunk_ids: List[str]) -> List[Optional[str]]:
+        """Texto de cada chunk_id (None se não está no store)."""
+        keys = np.array([chunk_key(chunk_id) for chunk_id in chunk_ids], dtype=np.uint64)
+        with self._lock:
+            rows = self._find(keys)
+            if (rows < 0).any():
+                # Pode ter sido escrito por outro processo (vectorizer) depois que abrimos
+                self._refresh()
+                rows = self._find(keys)
+            texts = []
+            for row in rows:
+                if row < 0:
+                    texts.append(None)
+                    continue
+                entry = self._index[row]
+                block_offset, offset, length = int(entry["block_offset"]), int(entry["offset"]), int(entry["length"])
+                if self._decompress is None:
+                    start = block_offset + offset
+                    texts.append(str(memoryview(self._data)[start:start + length], "utf-8"))
+                else:
+                    block = self._block(block_offset, int(entry["block_size"]))
+                    texts.append(str(memoryview(block)[offset:offset + length], "utf-8"))
+            return texts
+
+    def count(self) -> int:
+        return len(self._index)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._refresh()
+            raw_bytes = int(self._index["length"].sum()) if len(self._index) else 0
+            return {
+                "chunks": len(self._index),
+                "compression": self.compression,
+                "text_mb": raw_bytes / 1024 / 1024,
+                "disk_mb": (self._data_size + self.index_path.stat().st_size) / 1024 / 1024,
+                "index_mb": self._index.nbytes / 1024 / 1024,
+            }
+
+    def close(self):
+        with self._lock:
+            self._close_data()
+
+def milvus_rss_mb(metrics_url: str) -> Optional[float]:
+    """RSS do Milvus pelo endpoint de métricas (Prometheus) dele, ou None se não responder."""
+    import urllib.request
+    try:
+        with urllib.request.urlopen(metrics_url, timeout=5) as response:
+            text = response.read().decode("utf-8")
+    except Exception:
+        return None
+    values = [float(match) for match in re.findall(r"^process_resident_memory_bytes(?:\{[^}]*\})?\s+(\S+)$",
+                                                   text, flags=re.MULTILINE)]
+    return sum(values) / 1024 / 1024 if values else None
+
+def record_rss(path: str, text_in_store: bool, rss_mb: float, chunks: int) -> Dict:
+    """Guarda o RSS do Milvus da coleção atual (com ou sem o campo text) junto com o da
+    medição anterior do outro formato. Retorna as duas medições conhecidas."""
+    report_path = Path(path)
+    report = json.loads(report_path.read_text(encoding="utf-8")) if report_path.exists() else {}
+    report["with_text" if text_in_store else "without_text"] = {
+        "rss_mb": round(rss_mb, 1), "chunks": chunks, "measured_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    report_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    return report
+
+def measure_search(vector_store, queries: np.ndarray, top_k: int, output_fields: List[str],
+                   chunk_store: ChunkStore = None) -> Dict:
+    """Latência (p50/p95) e bytes de texto por busca, com o texto vindo do vector store
+    ou (com chunk_store) resolvido no store local pelo chunk_id."""
+    latencies, text_bytes = [], 0
+    for query in queries:
+        start = time.perf_counter()
+        hits = vector_store.search([query.tolist()], top_k, output_fields=output_fields)[0]
+        if chunk_store is not None:
+            texts = chunk_store.get_many([hit["chunk_id"] for hit in hits])
+        else:
+            texts = [hit["text"] for hit in hits]
+        latencies.append(time.perf_counter() - start)
+        text_bytes += sum(len(text.encode("utf-8")) for text in texts if text)
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "text_kb_per_query": round(text_bytes / max(len(queries), 1) / 1024, 2),
+    }
+
+def main():
+    """Tamanho do chunk store, RSS do Milvus e latência da busca com o texto vindo
+    do vector store x do chunk store local."""
+    from tune_index import sample_queries
+    from vector_store import get_vector_store
+
+    parser = argparse.ArgumentParser(description="Chunk store size, Milvus RSS and search latency comparison")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=settings.RETRIEVAL_TOP_K)
+    parser.add_argument("--backfill", action="store_true",
+                        help="Copy the chunk text from the current collection into the chunk store first")
+    args = parser.parse_args()
+
+    vector_store = get_vector_store()
+    vector_store.connect()
+    vector_store.load()
+    chunk_store = ChunkStore().open()
+
+    if args.backfill:
+        copied = 0
+        for rows in vector_store.iter_texts():
+            chunk_store.put_many(rows)
+            copied += len(rows)
+        print(f"✅ Copied the text of {copied} chunks into {chunk_store.path}")
+
+    stats = chunk_store.stats()
+    print(f"Chunk store: {stats['chunks']} chunks, {stats['text_mb']:.1f} MB of text -> {stats['disk_mb']:.1f} MB "
+          f"on disk ({stats['compression']}), {stats['index_mb']:.1f} MB index in memory")
+    if settings.VECTOR_STORE == "milvus":
+        rss = milvus_rss_mb(settings.MILVUS_METRICS_URL)
+        layout = "with the text field" if vector_store.text_in_store() else "without the text field"
+        print(f"Milvus RSS: {f'{rss:.0f} MB' if rss is not None else 'unavailable'} ({layout}, "
+              f"{settings.MILVUS_METRICS_URL})")
+        if rss is not None:
+            # A outra medição é de uma execução anterior do report, antes (ou depois) do --full
+            report = record_rss(settings.CHUNK_STORE_REPORT_PATH, vector_store.text_in_store(), rss,
+                                vector_store.count())
+            if "with_text" in report and "without_text" in report:
+                with_text, without_text = report["with_text"], report["without_text"]
+                print(f"Milvus RSS with the text field: {with_text['rss_mb']:.0f} MB ({with_text['chunks']} chunks, "
+                      f"{with_text['measured_at']}), without: {without_text['rss_mb']:.0f} MB "
+                      f"({without_text['chunks']} chunks, {without_text['measured_at']}) -> "
+                      f"{with_text['rss_mb'] - without_text['rss_mb']:+.0f} MB for the text")
+
+    queries = sample_queries(vector_store, args.queries)
+    if not len(queries):
+        print("Collection is empty, run the vectorizer first")
+        return
+    fields = ["file_name", "page_number", "chunk_id"]
+    results = {}
+    if vector_store.text_in_store():
+        results["text from vector store"] = measure_search(vector_store, queries, args.top_k, fields + ["text"])
+    if stats["chunks"]:
+        results["text from chunk store"] = measure_search(vector_store, queries, args.top_k, fields, chunk_store)
+    print(f"\nSearch with text ({len(queries)} queries, top_k {args.top_k}):")
+    for name, result in results.items():
+        print(f"  {name:<24} p50 {result['p50_ms']:>8.2f} ms   p95 {result['p95_ms']:>8.2f} ms   "
+              f"{result['text_kb_per_query']:.1f} KB text/query")
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import json
 import os
 from dotenv import load_dotenv
 
@@ -6,24 +7,174 @@ load_dotenv()
 class Settings:
     # OpenAI
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")  # ex: um servidor fake local (fake_openai.py)
+    CHAT_MODEL = "gpt-4.1-mini"
     
     # VM
     VM_MODEL = "ibm-granite/granite-3.3-8b-instruct"
     VM_ADDRESS = os.getenv("VM_ADDRESS")
     LOCAL_VM_ADDRESS = os.getenv("LOCAL_VM_ADDRESS")
     
+    # Router de LLM: lista (JSON) de endpoints OpenAI-compatible, ex:
+    # [{"name": "vm1", "base_url": "http://10.0.0.1:30000/v1", "model": "...", "api_key": "..."}]
+    # Vazio = OpenAI (OPENAI_BASE_URL) no chat e LOCAL_VM_ADDRESS + VM_ADDRESS no chat_vm
+    CHAT_ENDPOINTS = json.loads(os.getenv("CHAT_ENDPOINTS", "[]"))
+    VM_ENDPOINTS = json.loads(os.getenv("VM_ENDPOINTS", "[]"))
+    LLM_HEALTH_INTERVAL_SECONDS = 10  # GET /models em cada endpoint (só com mais de um)
+    LLM_HEALTH_TIMEOUT_SECONDS = 2
+    LLM_FAILURE_THRESHOLD = 2  # Falhas seguidas para tirar um endpoint do rodízio
+    LLM_MAX_ATTEMPTS = 3  # Endpoints tentados por resposta (failover)
+    # Hedge: se o primeiro token não chegou até o p95 do TTFT, manda o mesmo request para outro endpoint
+    LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+    LLM_HEDGE_MIN_DELAY_MS = 200
+    
     # Milvus (local)
     MILVUS_HOST = "localhost"
     MILVUS_PORT = "19530"
     MILVUS_URI = f"http://{MILVUS_HOST}:{MILVUS_PORT}"
     
+    # Índice: IVF_FLAT, IVF_SQ8, IVF_PQ, HNSW, DISKANN, FLAT ou AUTOINDEX
+    # Sem "nlist" em MILVUS_INDEX_PARAMS, o nlist do IVF é calculado pelo tamanho da coleção
+    MILVUS_INDEX_TYPE = os.getenv("MILVUS_INDEX_TYPE", "IVF_FLAT")
+    MILVUS_INDEX_PARAMS = {}
+    # Parâmetros de busca escolhidos pelo `poetry run tune-index` (nprobe / ef / search_list)
+    INDEX_TUNING_PATH = "index_tuning.json"
+    # Partition key da coleção ("file_name" ou "" para desligar): buscas com escopo de arquivos
+    # só olham as partições deles. Vale na criação da coleção (vectorizer --full)
+    MILVUS_PARTITION_KEY = os.getenv("MILVUS_PARTITION_KEY", "file_name")
+    MILVUS_NUM_PARTITIONS = 64
+    # Métricas (Prometheus) do Milvus, para o RSS no `chunk-store-report`
+    MILVUS_METRICS_URL = os.getenv("MILVUS_METRICS_URL", f"http://{MILVUS_HOST}:9091/metrics")
+    
+    # Texto dos chunks fora do Milvus: a coleção guarda só o vetor e os metadados e o texto fica
+    # num arquivo local append-only e memory-mapped. "none" lê o texto direto do mmap, sem cópia;
+    # "zlib" e "zstd" comprimem em blocos (zstd precisa do extra: poetry install --extras zstd).
+    # Vale na criação da coleção (vectorize --full)
+    CHUNK_STORE_ENABLED = os.getenv("CHUNK_STORE_ENABLED", "false").lower() == "true"
+    CHUNK_STORE_DIR = "chunk_store"
+    CHUNK_STORE_COMPRESSION = os.getenv("CHUNK_STORE_COMPRESSION", "none")
+    CHUNK_STORE_BLOCK_KB = 16
+    # RSS do Milvus medido pelo chunk-store-report com e sem o campo text na coleção
+    CHUNK_STORE_REPORT_PATH = "chunk_store_report.json"
+    
+    # Vector store: "milvus" ou "numpy" (embutido, sem precisar do container do Milvus)
+    VECTOR_STORE = os.getenv("VECTOR_STORE", "milvus")
+    NUMPY_STORE_DIR = "vector_store"
+    NUMPY_STORE_DTYPE = "float32"  # ou "float16" para usar metade da memória
+    NUMPY_IVF_NLIST = 0  # 0 = busca exata, > 0 = número de partições IVF, -1 = automático pelo tamanho
+    NUMPY_IVF_NPROBE = 8
+    
     # Collection 
     COLLECTION_NAME = "pdf_documents"
-    EMBEDDING_DIM = 3072  # text-embedding-3-large dimension
+    EMBEDDING_MODEL = "text-embedding-3-large"
+    EMBEDDING_MODEL_DIM = 3072  # text-embedding-3-large dimension
+    # Menos dimensões = menos memória (parâmetro `dimensions` da API, ex: 1024 ou 256)
+    EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", EMBEDDING_MODEL_DIM))
+    
+    # Armazenamento compacto dos vetores: "none", "float16", "int8" ou "binary"
+    # (int8 e binary só no vector store numpy, com rescoring pelos vetores completos no disco)
+    VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+    RESCORE_CANDIDATES = 100
+    
+    # Cache de embeddings em disco (hash do chunk + modelo)
+    EMBEDDING_CACHE_ENABLED = True
+    EMBEDDING_CACHE_PATH = "embedding_cache.sqlite"
+    EMBEDDING_CACHE_MAX_MB = 2048
+    
+    # Chat: chunks buscados por pergunta e limite de tokens do contexto no prompt
+    # (chunks da mesma página são unidos, os mais relevantes entram primeiro)
+    RETRIEVAL_TOP_K = 8
+    CONTEXT_MAX_TOKENS = 4000
+    VM_CONTEXT_MAX_TOKENS = 2000  # Modelos da VM costumam ter contexto menor
+    
+    # Reranking depois da busca: "none", "mmr" (diversidade pelos vetores) ou "file_cap"
+    # (no máximo RERANK_MAX_PER_FILE chunks por arquivo), escolhendo entre RERANK_CANDIDATES
+    RERANK_METHOD = os.getenv("RERANK_METHOD", "none")
+    RERANK_CANDIDATES = 20
+    MMR_LAMBDA = 0.5  # 1 = só relevância, 0 = só diversidade
+    RERANK_MAX_PER_FILE = 2
+    
+    # Chat: com um escopo (/scope, /filter) também mede a busca sem escopo para comparar a latência.
+    # É uma busca a mais por pergunta, então só para medir (SCOPE_COMPARE_UNSCOPED=true)
+    SCOPE_COMPARE_UNSCOPED = os.getenv("SCOPE_COMPARE_UNSCOPED", "false").lower() == "true"
+    
+    # Chat: cache (LRU) dos embeddings das perguntas
+    QUERY_EMBEDDING_CACHE_SIZE = 1024
+    
+    # Chat: cache de respostas para perguntas parecidas que recuperam os mesmos chunks
+    ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+    ANSWER_CACHE_THRESHOLD = 0.95  # Similaridade mínima entre as perguntas
+    ANSWER_CACHE_TTL_SECONDS = 24 * 3600
+    ANSWER_CACHE_MAX_ENTRIES = 1000
+    
+    # Chat: conversa com várias perguntas. O histórico (perguntas e respostas) vai no prompt até
+    # HISTORY_MAX_TOKENS, e uma continuação com similaridade >= CONVERSATION_REUSE_THRESHOLD com a
+    # pergunta da última busca reutiliza os chunks dela (até CONVERSATION_MAX_REUSE_TURNS seguidas)
+    CONVERSATION_ENABLED = os.getenv("CONVERSATION_ENABLED", "true").lower() == "true"
+    HISTORY_MAX_TOKENS = 2000
+    VM_HISTORY_MAX_TOKENS = 1000
+    CONVERSATION_REUSE_THRESHOLD = 0.75
+    CONVERSATION_MAX_REUSE_TURNS = 3
+
+    # Serviço HTTP (rag_service.py)
+    SERVICE_HOST = "0.0.0.0"
+    SERVICE_PORT = 8000
+    SERVICE_CHAT_BACKEND = "openai"  # ou "vm" (VM_ENDPOINTS / LOCAL_VM_ADDRESS)
+    SERVICE_MAX_TOP_K = 100
+    SERVICE_BATCH_WAIT_MS = 5  # Espera máxima para juntar perguntas de requests diferentes
+    SERVICE_EMBED_BATCH_SIZE = 64
+    SERVICE_SEARCH_BATCH_SIZE = 64
+    SERVICE_SEARCH_WORKERS = 4
+    SERVICE_LLM_CONCURRENCY = 16  # Gerações em paralelo no LLM
+    SERVICE_LLM_MAX_WAITING = 64  # Acima disso os requests recebem 503
+    SERVICE_HTTP_CONNECTIONS = 64  # Pool de conexões HTTP com a OpenAI (embeddings)
+    
+    # Scheduler de embeddings (requests em paralelo, batches por tokens)
+    EMBEDDING_CONCURRENCY = 4
+    EMBEDDING_MAX_BATCH_TOKENS = 100_000  # A API aceita até 300k tokens por request
+    EMBEDDING_MAX_BATCH_ITEMS = 2048
+    EMBEDDING_MAX_RETRIES = 8
+    
+    # Tracing: spans de cada etapa (ingest e perguntas) num log JSON + arquivo para o Prometheus
+    TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+    TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", "traces.jsonl")
+    # Arquivo para o textfile collector do node_exporter ({program} = vectorizer, chat, ...; um arquivo por programa)
+    METRICS_PATH = os.getenv("METRICS_PATH", "metrics_{program}.prom")
+    TRACE_MAX_SAMPLES = 10000  # Durações guardadas por etapa para os quantis
+    
+    # Inicialização do chat: uma request de embedding em background para a primeira pergunta não pagar a conexão
+    STARTUP_WARMUP_EMBEDDING = os.getenv("STARTUP_WARMUP_EMBEDDING", "true").lower() == "true"
     
     # PDF 
     PDF_DIRECTORY = "pdfs"
     CHUNK_SIZE = 600
     CHUNK_OVERLAP = 150
+    # "chars" (CHUNK_SIZE/CHUNK_OVERLAP) ou "tokens" (CHUNK_*_TOKENS, contados com o tiktoken)
+    CHUNK_UNIT = os.getenv("CHUNK_UNIT", "chars")
+    CHUNK_SIZE_TOKENS = 150
+    CHUNK_OVERLAP_TOKENS = 40
+    
+    # Indexação incremental (hash dos PDFs e chunks já inseridos)
+    MANIFEST_PATH = "index_manifest.json"
+    
+    # Deduplicação antes dos embeddings: chunks iguais (hash) ou quase iguais (MinHash/LSH, Jaccard
+    # estimado >= DEDUP_THRESHOLD) em todo o corpus são guardados uma vez, com referências às outras
+    # ocorrências. Rode `vectorize --full` depois de ligar/desligar
+    DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "false").lower() == "true"
+    DEDUP_INDEX_PATH = "dedup_index.sqlite"
+    DEDUP_THRESHOLD = 0.85
+    DEDUP_NUM_PERM = 128
+    DEDUP_BANDS = 16  # 16 bandas de 8: pares com Jaccard ~0.7 já viram candidatos
+    DEDUP_SHINGLE_WORDS = 3
+    
+    # Chunks por batch de embeddings + insert (a memória fica limitada a um batch por vez)
+    INSERT_BATCH_SIZE = 500
+    
+    # Pipeline de ingest (extração, embeddings e inserção em paralelo)
+    PIPELINE_ENABLED = True
+    PIPELINE_EXTRACT_WORKERS = os.cpu_count() or 4
+    PIPELINE_EMBED_WORKERS = 4
+    PIPELINE_QUEUE_SIZE = 8
+    PIPELINE_PAGES_PER_TASK = 50
 
 settings = Settings()
@@ -0,0 +1,82 @@
+from typing import Dict, List, Optional
+
+from utils import count_tokens
+
+# Sobreposição mínima (caracteres) para considerar que dois chunks continuam um ao outro
+MIN_OVERLAP_CHARS = 20
+
+# Separador entre trechos não contíguos da mesma página
+GAP_SEPARATOR = "\n[...]\n"
+
+def chunk_index(chunk_id: str) -> Optional[int]:
+    """Posição do chunk na página (o chunk_id é "<hash da página>_<índice>")."""
+    _, _, index = str(chunk_id).rpartition("_")
+    return int(index) if index.isdigit() else None
+
+def overlap_length(first: str, second: str) -> int:
+    """Tamanho do maior sufixo de `first` que é prefixo de `second`."""
+    for size in range(min(len(first), len(second)), MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:size]):
+            return size
+    return 0
+
+def merge_page_chunks(docs: List[Dict]) -> str:
+    """Junta os chunks de uma mesma página na ordem original, sem repetir o texto
+    sobreposto (CHUNK_OVERLAP) e sem trechos que já estão contidos em outros."""
+    ordered = sorted(docs, key=lambda doc: (chunk_index(doc["chunk_id"]) is None, chunk_index(doc["chunk_id"]) or 0))
+    segments: List[str] = []
+    for doc in ordered:
+        text = doc["text"].strip()
+        if any(text in segment for segment in segments):
+            continue
+        if segments:
+            size = overlap_length(segments[-1], text)
+            if size:
+                segments[-1] += text[size:]
+                continue
+        segments.append(text)
+    return GAP_SEPARATOR.join(segments)
+
+def format_passage(passage: Dict) -> str:
+    return f"From {passage['file_name']} (page {passage['page_number']}):\n{passage['text']}"
+
+def build_context(docs: List[Dict], max_tokens: int, model: str) -> List[Dict]:
+    """Monta as passagens do prompt: chunks da mesma página (file_name + page_number)
+    são unidos e os mais relevantes entram primeiro até `max_tokens` (tiktoken).
+    Retorna as passagens (file_name, page_number, text, chunk_ids, score, references) em ordem de relevância."""
+    groups: Dict[tuple, List[Dict]] = {}
+    page_tokens: Dict[tuple, int] = {}
+    used_tokens = 0
+
+    for doc in sorted(docs, key=lambda doc: doc.get("score", 0.0), reverse=True):
+        key = (doc["file_name"], doc["page_number"])
+        candidate = groups.get(key, []) + [doc]
+        passage = {"file_name": key[0], "page_number": key[1], "text": merge_page_chunks(candidate)}
+        tokens = count_tokens([format_passage(passage)], model)[0]
+        # Um chunk que não cabe é pulado, os próximos (menores ou da mesma página) ainda podem caber
+        if used_tokens - page_tokens.get(key, 0) + tokens > max_tokens:
+            continue
+        used_tokens += tokens - page_tokens.get(key, 0)
+        page_tokens[key] = tokens
+        groups[key] = candidate
+
+    passages = [
+        {
+            "file_name": file_name,
+            "page_number": page_number,
+            "text": merge_page_chunks(page_docs),
+            "chunk_ids": [doc["chunk_id"] for doc in page_docs],
+            "score": max(doc.get("score", 0.0) for doc in page_docs),
+            # Outras ocorrências dos chunks (deduplicação), sem repetir a página
+            "references": list(dict.fromkeys(
+                (ref[0], ref[1]) for doc in page_docs for ref in doc.get("references", ())
+                if (ref[0], ref[1]) != (file_name, page_number)
+            )),
+        }
+        for (file_name, page_number), page_docs in groups.items()
+    ]
+    return sorted(passages, key=lambda passage: passage["score"], reverse=True)
+
+def render_context(passages: List[Dict]) -> str:
+    """Texto do contexto no formato usado nos prompts."""
+    return "\n\n".join(format_passage(passage) for passage in passages)
@@ -0,0 +1,173 @@
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from utils import count_tokens
+
+class Turn:
+    def __init__(self, question: str, answer: str, tokens: int):
+        self.question = question
+        self.answer = answer
+        self.tokens = tokens
+
+    def messages(self) -> List[Dict]:
+        return turn_messages(self.question, self.answer)
+
+def question_prompt(question: str) -> str:
+    """Mensagem do usuário com a pergunta (a mesma no turno atual e no histórico)."""
+    return f"Pergunta: {question}\n\nResposta:"
+
+def context_prompt(question: str, context_text: str) -> str:
+    """Última mensagem do usuário: o contexto da busca e a pergunta. No histórico a pergunta
+    fica sem o contexto (question_prompt), então o prefixo do prompt não muda com a busca."""
+    return f"Contexto:\n{context_text}\n\n{question_prompt(question)}"
+
+def turn_messages(question: str, answer: str) -> List[Dict]:
+    return [{"role": "user", "content": question_prompt(question)}, {"role": "assistant", "content": answer}]
+
+def serialize(messages: List[Dict]) -> str:
+    """Texto das mensagens em ordem, para comparar o prefixo entre dois prompts."""
+    return "".join(f"<{message['role']}>\n{message['content']}\n" for message in messages)
+
+def common_prefix_length(first: str, second: str) -> int:
+    size = min(len(first), len(second))
+    mismatch = np.flatnonzero(np.frombuffer(first[:size].encode("utf-32-le"), dtype=np.uint32)
+                              != np.frombuffer(second[:size].encode("utf-32-le"), dtype=np.uint32))
+    return int(mismatch[0]) if len(mismatch) else size
+
+class Conversation:
+    """Estado de uma conversa no chat: histórico das perguntas e respostas (até
+    `history_max_tokens`) e os chunks da última busca.
+
+    Uma pergunta de continuação cujo embedding tem similaridade >= `reuse_threshold` com o
+    da pergunta que fez a busca reutiliza os mesmos chunks, sem buscar de novo (no máximo
+    `max_reuse_turns` seguidas). O prompt é system (instruções fixas) + histórico + contexto e
+    pergunta na última mensagem, então o system e o histórico do prompt anterior são prefixo do
+    novo e o prefix cache do servidor (SGLang/vLLM/OpenAI) só processa a última pergunta e resposta
+    e o contexto.
+
+    Quando o histórico passa do limite, as perguntas mais antigas saem até ele ficar na
+    metade: o prefixo muda de vez em quando, não a cada pergunta."""
+
+    def __init__(self, model: str, history_max_tokens: int = 2000, reuse_threshold: float = 0.75,
+                 max_reuse_turns: int = 3):
+        self.model = model
+        self.history_max_tokens = history_max_tokens
+        self.reuse_threshold = reuse_threshold
+        self.max_reuse_turns = max_reuse_turns
+        self.reset()
+
+    def reset(self):
+        """Nova conversa: esquece o histórico, os chunks e as estatísticas."""
+        self.turns: List[Turn] = []
+        self.docs: List[Dict] = []
+        self.anchor: Optional[np.ndarray] = None
+        self.scope_key: Optional[str] = None
+        self.reused_turns = 0
+        self.similarity: Optional[float] = None
+        self.previous_prompt = ""
+        self.total_turns = 0
+        self.retrievals_reused = 0
+        self.history_trims = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.reported_turns = 0
+        self.shared_prefix_tokens = 0
+
+    def reusable_docs(self, embedding: Sequence[float], scope) -> Optional[List[Dict]]:
+        """Chunks da última busca se a pergunta é continuação dela (mesmo escopo), ou None."""
+        self.similarity = None
+        if not self.docs or self.anchor is None or str(scope) != self.scope_key:
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        self.similarity = float(self.anchor @ query / (np.linalg.norm(query) or 1.0))
+        if self.similarity < self.reuse_threshold or self.reused_turns >= self.max_reuse_turns:
+            return None
+        self.reused_turns += 1
+        self.retrievals_reused += 1
+        return self.docs
+
+    def set_retrieval(self, embedding: Sequence[float], docs: List[Dict], scope):
+        """Guarda a busca nova; as próximas perguntas são comparadas com esta."""
+        anchor = np.asarray(embedding, dtype=np.float32)
+        self.anchor = anchor / (np.linalg.norm(anchor) or 1.0)
+        self.docs = docs
+        self.scope_key = str(scope)
+        self.reused_turns = 0
+
+    def history(self) -> List[Dict]:
+        """Mensagens (user/assistant) das perguntas anteriores que cabem no histórico."""
+        return [message for turn in self.turns for message in turn.messages()]
+
+    def history_tokens(self) -> int:
+        return sum(turn.tokens for turn in self.turns)
+
+    def shared_prefix(self, messages: List[Dict]) -> int:
+        """Tokens (estimados) do início do prompt iguais ao prompt + resposta anteriores:
+        o que um prefix cache pode reaproveitar."""
+        prompt = serialize(messages)
+        size = common_prefix_length(prompt, self.previous_prompt)
+        return count_tokens([prompt[:size]], self.model)[0] if size else 0
+
+    def add_turn(self, question: str, answer: str, messages: List[Dict], stats=None) -> Dict:
+        """Registra a pergunta respondida com o prompt enviado (`messages`) e os tokens
+        informados pelo servidor (`stats`, GenerationStats). Retorna os números do turno."""
+        turn_stats = {
+            "shared_prefix_tokens": self.shared_prefix(messages),
+            "prompt_tokens": getattr(stats, "prompt_tokens", None),
+            "cached_tokens": getattr(stats, "cached_tokens", None),
+            "context_reused": self.reused_turns > 0,
+        }
+        self.total_turns += 1
+        self.shared_prefix_tokens += turn_stats["shared_prefix_tokens"]
+        if turn_stats["prompt_tokens"]:
+            self.prompt_tokens += turn_stats["prompt_tokens"]
+            if turn_stats["cached_tokens"] is not None:
+                self.cached_tokens += turn_stats["cached_tokens"]
+                self.reported_turns += 1
+        self.previous_prompt = serialize(messages + [{"role": "assistant", "content": answer}])
+
+        tokens = count_tokens([message["content"] for message in turn_messages(question, answer)], self.model)
+        self.turns.append(Turn(question, answer, sum(tokens)))
+        if self.history_tokens() > self.history_max_tokens:
+            while self.turns and self.history_tokens() > self.history_max_tokens // 2:
+                self.turns.pop(0)
+            self.history_trims += 1
+        return turn_stats
+
+    def stats(self) -> Dict:
+        return {
+            "turns": self.total_turns,
+            "history_turns": len(self.turns),
+            "history_tokens": self.history_tokens(),
+            "history_trims": self.history_trims,
+            "retrievals_reused": self.retrievals_reused,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens if self.reported_turns else None,
+            "prefix_cache_hit_rate": self.cached_tokens / self.prompt_tokens
+            if self.reported_turns and self.prompt_tokens else None,
+            "shared_prefix_tokens": self.shared_prefix_tokens,
+        }
+
+def format_turn(turn_stats: Dict, similarity: Optional[float] = None) -> str:
+    """Linha com os tokens do prompt e o prefix cache de um turno."""
+    parts = []
+    if turn_stats["prompt_tokens"]:
+        parts.append(f"prompt {turn_stats['prompt_tokens']} tokens")
+        if turn_stats["cached_tokens"] is not None:
+            rate = turn_stats["cached_tokens"] / turn_stats["prompt_tokens"]
+            parts.append(f"{turn_stats['cached_tokens']} from prefix cache ({rate:.0%})")
+    parts.append(f"~{turn_stats['shared_prefix_tokens']} tokens shared with the last prompt")
+    if turn_stats["context_reused"]:
+        parts.append("context reused" + (f" (similarity {similarity:.2f})" if similarity is not None else ""))
+    return " | ".join(parts)
+
+def format_stats(stats: Dict) -> str:
+    """Resumo legível da conversa."""
+    rate = stats["prefix_cache_hit_rate"]
+    return (f"Conversation: {stats['turns']} turns, {stats['retrievals_reused']} answered with the previous "
+            f"search, history {stats['history_tokens']} tokens in {stats['history_turns']} turns "
+            f"({stats['history_trims']} trims)\n"
+            f"  prompt tokens {stats['prompt_tokens']}, prefix cache "
+            + (f"{stats['cached_tokens']} tokens ({rate:.0%} hit rate)" if rate is not None else "not reported by the server")
+            + f", ~{stats['shared_prefix_tokens']} tokens shared between consecutive prompts")
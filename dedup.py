@@ -0,0 +1,286 @@
+import sqlite3
+import threading
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils import count_tokens, generate_doc_id
+
+# Primo de Mersenne (2^61 - 1) das permutações do MinHash; os valores ficam em 32 bits
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+# Limite de variáveis por query no SQLite
+LOOKUP_BATCH_SIZE = 300
+
+# Uma ocorrência de chunk: (file_name, page_number, chunk_id)
+Occurrence = Tuple[str, int, str]
+
+def normalize(text: str) -> str:
+    """Texto comparado: minúsculo e com espaços normalizados."""
+    return " ".join(text.lower().split())
+
+def shingles(text: str, size: int) -> List[str]:
+    """Sequências de `size` palavras (o conjunto comparado pelo Jaccard)."""
+    words = normalize(text).split()
+    if len(words) <= size:
+        return [" ".join(words)]
+    return [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+class MinHasher:
+    """Assinatura MinHash: o menor hash de cada permutação sobre os shingles.
+    A fração de posições iguais entre duas assinaturas estima o Jaccard dos textos."""
+
+    def __init__(self, num_perm: int = 128, shingle_words: int = 3, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self.shingle_words = shingle_words
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.array([zlib.crc32(shingle.encode("utf-8")) for shingle in set(shingles(text, self.shingle_words))],
+                          dtype=np.uint64)
+        # A multiplicação em uint64 pode dar overflow, como no datasketch; só importa ser determinística
+        values = (np.outer(self.a, hashes) + self.b[:, None]) % np.uint64(MERSENNE_PRIME) & np.uint64(MAX_HASH)
+        return values.min(axis=1).astype(np.uint32)
+
+def similarity(first: np.ndarray, second: np.ndarray) -> float:
+    """Jaccard estimado entre duas assinaturas."""
+    return float(np.mean(first == second))
+
+class ChunkDeduplicator:
+    """Índice (SQLite) dos chunks guardados no vector store, para não gerar embedding nem
+    inserir de novo cabeçalhos, rodapés e páginas repetidas entre documentos/revisões.
+
+    Um chunk com o mesmo texto (hash) ou quase o mesmo (MinHash/LSH, Jaccard estimado >=
+    threshold) de um chunk já guardado vira só uma referência (file_name, page_number,
+    chunk_id) para ele. Se o chunk guardado sai do índice (arquivo removido ou alterado),
+    a primeira referência é promovida: o texto é inserido de novo com os metadados dela."""
+
+    def __init__(self, path: str, threshold: float = 0.85, num_perm: int = 128, bands: int = 16,
+                 shingle_words: int = 3, dim: int = 3072, model: str = "text-embedding-3-large"):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.path = path
+        self.threshold = threshold
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.hasher = MinHasher(num_perm, shingle_words)
+        self.vector_bytes = dim * 4  # float32
+        self.model = model
+        self.stats_run = {"chunks": 0, "exact": 0, "near": 0, "tokens_saved": 0, "bytes_saved": 0}
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS canonical (
+                id INTEGER PRIMARY KEY,
+                file_name TEXT NOT NULL,
+                page_number INTEGER NOT NULL,
+                chunk_id TEXT NOT NULL,
+                text TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                signature BLOB NOT NULL,
+                UNIQUE (file_name, page_number, chunk_id)
+            );
+            CREATE TABLE IF NOT EXISTS refs (
+                file_name TEXT NOT NULL,
+                page_number INTEGER NOT NULL,
+                chunk_id TEXT NOT NULL,
+                canonical_id INTEGER NOT NULL,
+                similarity REAL NOT NULL,
+                PRIMARY KEY (file_name, page_number, chunk_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_refs_canonical ON refs (canonical_id);
+        """)
+        self._conn.commit()
+        self._load()
+
+    def _load(self):
+        """Índices em memória: hash exato -> id, buckets do LSH e assinaturas."""
+        self.exact: Dict[str, int] = {}
+        self.signatures: Dict[int, np.ndarray] = {}
+        self.buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(self.bands)]
+        self.occurrences: Dict[Occurrence, int] = {}
+        for canonical_id, file_name, page_number, chunk_id, text_hash, blob in self._conn.execute(
+            "SELECT id, file_name, page_number, chunk_id, text_hash, signature FROM canonical"
+        ):
+            self._index(canonical_id, (file_name, page_number, chunk_id), text_hash,
+                        np.frombuffer(blob, dtype=np.uint32))
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        r = self.rows_per_band
+        return [signature[band * r:(band + 1) * r].tobytes() for band in range(self.bands)]
+
+    def _index(self, canonical_id: int, occurrence: Occurrence, text_hash: str, signature: np.ndarray):
+        self.exact.setdefault(text_hash, canonical_id)
+        self.signatures[canonical_id] = signature
+        self.occurrences[occurrence] = canonical_id
+        for band, key in enumerate(self._band_keys(signature)):
+            self.buckets[band].setdefault(key, []).append(canonical_id)
+
+    def _unindex(self, canonical_id: int, occurrence: Occurrence, text_hash: str):
+        signature = self.signatures.pop(canonical_id)
+        self.occurrences.pop(occurrence, None)
+        if self.exact.get(text_hash) == canonical_id:
+            del self.exact[text_hash]
+        for band, key in enumerate(self._band_keys(signature)):
+            ids = self.buckets[band].get(key, [])
+            if canonical_id in ids:
+                ids.remove(canonical_id)
+            if not ids:
+                self.buckets[band].pop(key, None)
+
+    def _near_duplicate(self, signature: np.ndarray) -> Tuple[Optional[int], float]:
+        """Chunk guardado mais parecido entre os candidatos do LSH (mesmo bucket em alguma banda)."""
+        candidates = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            candidates.update(self.buckets[band].get(key, ()))
+        best_id, best = None, 0.0
+        for canonical_id in candidates:
+            score = similarity(signature, self.signatures[canonical_id])
+            if score > best:
+                best_id, best = canonical_id, score
+        return (best_id, best) if best >= self.threshold else (None, best)
+
+    def filter(self, chunks: List[Dict]) -> List[Dict]:
+        """Retorna só os chunks que precisam de embedding e inserção; os repetidos
+        ficam registrados como referências para o chunk já guardado."""
+        unique, duplicates = [], []
+        with self._lock:
+            for chunk in chunks:
+                occurrence = (chunk["file_name"], chunk["page_number"], chunk["chunk_id"])
+                self.stats_run["chunks"] += 1
+                if occurrence in self.occurrences:
+                    # Já é o chunk guardado (execução anterior caiu antes do insert)
+                    unique.append(chunk)
+                    continue
+
+                text_hash = generate_doc_id(normalize(chunk["text"]))
+                canonical_id, score = self.exact.get(text_hash), 1.0
+                signature = None
+                if canonical_id is None:
+                    signature = self.hasher.signature(chunk["text"])
+                    canonical_id, score = self._near_duplicate(signature)
+
+                if canonical_id is not None:
+                    self._conn.execute("INSERT OR REPLACE INTO refs VALUES (?, ?, ?, ?, ?)",
+                                       (*occurrence, canonical_id, score))
+                    self.stats_run["exact" if signature is None else "near"] += 1
+                    duplicates.append(chunk)
+                    continue
+
+                cursor = self._conn.execute(
+                    "INSERT INTO canonical (file_name, page_number, chunk_id, text, text_hash, signature) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (*occurrence, chunk["text"], text_hash, signature.tobytes())
+                )
+                self._index(cursor.lastrowid, occurrence, text_hash, signature)
+                unique.append(chunk)
+            self._conn.commit()
+
+        if duplicates:
+            texts = [chunk["text"] for chunk in duplicates]
+            self.stats_run["tokens_saved"] += sum(count_tokens(texts, self.model))
+            self.stats_run["bytes_saved"] += sum(len(text.encode("utf-8")) + self.vector_bytes for text in texts)
+        return unique
+
+    def remove(self, file_name: str, chunk_keys: Optional[List[Tuple[str, int]]] = None) -> List[Dict]:
+        """Tira do índice as ocorrências de um arquivo (ou só os chunk_keys (chunk_id, page_number)).
+        Retorna os chunks promovidos, que precisam ser inseridos no vector store;
+        chame commit() depois de inserir."""
+        with self._lock:
+            if chunk_keys is None:
+                occurrences = [occurrence for occurrence in self.occurrences if occurrence[0] == file_name]
+                self._conn.execute("DELETE FROM refs WHERE file_name = ?", (file_name,))
+            else:
+                occurrences = [(file_name, page_number, chunk_id) for chunk_id, page_number in chunk_keys]
+                self._conn.executemany("DELETE FROM refs WHERE file_name = ? AND page_number = ? AND chunk_id = ?",
+                                       occurrences)
+
+            promoted = []
+            for occurrence in occurrences:
+                canonical_id = self.occurrences.get(occurrence)
+                if canonical_id is None:
+                    continue
+                text, text_hash = self._conn.execute(
+                    "SELECT text, text_hash FROM canonical WHERE id = ?", (canonical_id,)
+                ).fetchone()
+                ref = self._conn.execute(
+                    "SELECT file_name, page_number, chunk_id FROM refs WHERE canonical_id = ? "
+                    "ORDER BY file_name, page_number, chunk_id LIMIT 1", (canonical_id,)
+                ).fetchone()
+                if ref is None:
+                    self._conn.execute("DELETE FROM canonical WHERE id = ?", (canonical_id,))
+                    self._unindex(canonical_id, occurrence, text_hash)
+                    continue
+
+                # A referência vira o chunk guardado (mesmo id, as outras referências continuam valendo)
+                self._conn.execute("DELETE FROM refs WHERE file_name = ? AND page_number = ? AND chunk_id = ?", ref)
+                self._conn.execute("UPDATE canonical SET file_name = ?, page_number = ?, chunk_id = ? WHERE id = ?",
+                                   (*ref, canonical_id))
+                del self.occurrences[occurrence]
+                self.occurrences[ref] = canonical_id
+                promoted.append({"text": text, "file_name": ref[0], "page_number": ref[1], "chunk_id": ref[2]})
+            return promoted
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM refs")
+            self._conn.execute("DELETE FROM canonical")
+            self._conn.commit()
+            self._load()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            references = self._conn.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+        duplicates = self.stats_run["exact"] + self.stats_run["near"]
+        return {
+            **self.stats_run,
+            "embedding_inputs_saved": duplicates,
+            "unique_chunks": len(self.signatures),
+            "references": references,
+            "index_vector_mb_saved": references * self.vector_bytes / 1024 / 1024,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def load_references(path: str, occurrences: List[Occurrence]) -> Dict[Occurrence, List[Occurrence]]:
+    """Outras ocorrências (file_name, page_number, chunk_id) dos chunks guardados (para as fontes do chat)."""
+    if not occurrences or not Path(path).exists():
+        return {}
+    references: Dict[Occurrence, List[Occurrence]] = {}
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        for i in range(0, len(occurrences), LOOKUP_BATCH_SIZE):
+            batch = occurrences[i:i + LOOKUP_BATCH_SIZE]
+            values = ",".join("(?, ?, ?)" for _ in batch)
+            rows = conn.execute(
+                "SELECT c.file_name, c.page_number, c.chunk_id, r.file_name, r.page_number, r.chunk_id "
+                "FROM refs r JOIN canonical c ON r.canonical_id = c.id "
+                f"WHERE (c.file_name, c.page_number, c.chunk_id) IN (VALUES {values}) "
+                "ORDER BY r.file_name, r.page_number",
+                [value for occurrence in batch for value in occurrence]
+            ).fetchall()
+            for row in rows:
+                references.setdefault(tuple(row[:3]), []).append(tuple(row[3:]))
+    finally:
+        conn.close()
+    return references
+
+def format_stats(stats: Dict) -> str:
+    """Resumo do que a deduplicação economizou."""
+    duplicates = stats["exact"] + stats["near"]
+    return (f"Dedup: {stats['chunks']} chunks checked, {duplicates} duplicates ({stats['exact']} exact, "
+            f"{stats['near']} near) -> {stats['embedding_inputs_saved']} embedding inputs "
+            f"(~{stats['tokens_saved']} tokens) and {stats['bytes_saved'] / 1024 / 1024:.1f} MB of index saved; "
+            f"index holds {stats['unique_chunks']} unique chunks and {stats['references']} references "
+            f"({stats['index_vector_mb_saved']:.1f} MB of vectors not stored)")
@@ -0,0 +1,142 @@
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List
+
+from utils import generate_doc_id
+
+# Limite de variáveis por query no SQLite
+LOOKUP_BATCH_SIZE = 500
+
+class EmbeddingCache:
+    """Cache em disco (SQLite) dos embeddings, endereçado pelo hash do texto do chunk
+    e pelo nome do modelo. Os vetores são guardados como float32 e os menos usados
+    recentemente são removidos quando o cache passa do tamanho máximo. O total de bytes
+    é lido uma vez ao abrir e mantido a cada inserção e evicção."""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                text_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (text_hash, model)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings (last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(length(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    def get_many(self, texts: List[str], model: str) -> Dict[str, List[float]]:
+        """Busca em lote os embeddings já conhecidos. Retorna {texto: embedding} só para os hits."""
+        hash_to_texts = {}
+        for text in texts:
+            hash_to_texts.setdefault(generate_doc_id(text), []).append(text)
+        
+        found = {}
+        hashes = list(hash_to_texts)
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+                batch = hashes[i:i + LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch]
+                ).fetchall()
+                for text_hash, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    for text in hash_to_texts[text_hash]:
+                        found[text] = vector.tolist()
+                
+                if rows:
+                    self._conn.executemany(
+                        "UPDATE embeddings SET last_access = ? WHERE text_hash = ? AND model = ?",
+                        [(now, text_hash, model) for text_hash, _ in rows]
+                    )
+            self._conn.commit()
+            
+            hits = sum(1 for text in texts if text in found)
+            self.hits += hits
+            self.misses += len(texts) - hits
+        return found
+
+    def put_many(self, texts: List[str], embeddings: List[List[float]], model: str):
+        """Guarda os embeddings gerados e aplica a evicção por tamanho."""
+        now = time.time()
+        # Textos repetidos no lote: só a última linha fica (como no INSERT OR REPLACE)
+        by_hash = {}
+        for text, embedding in zip(texts, embeddings):
+            text_hash = generate_doc_id(text)
+            by_hash[text_hash] = (text_hash, model, array("f", embedding).tobytes(), now)
+        rows = list(by_hash.values())
+        with self._lock:
+            # Linhas substituídas saem do total
+            hashes = [row[0] for row in rows]
+            for i in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+                batch = hashes[i:i + LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                self._total_bytes -= self._conn.execute(
+                    f"SELECT COALESCE(SUM(length(vector)), 0) FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch]
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (text_hash, model, vector, last_access) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+            self._total_bytes += sum(len(row[2]) for row in rows)
+            self._evict()
+
+    def _evict(self):
+        """Remove os embeddings acessados há mais tempo até o cache caber no limite."""
+        if self._total_bytes <= self.max_bytes:
+            return
+        
+        to_free = self._total_bytes - self.max_bytes
+        freed = 0
+        evicted = []
+        cursor = self._conn.execute(
+            "SELECT rowid, length(vector) FROM embeddings ORDER BY last_access ASC"
+        )
+        for rowid, size in cursor:
+            evicted.append((rowid,))
+            freed += size
+            if freed >= to_free:
+                break
+        
+        self._conn.executemany("DELETE FROM embeddings WHERE rowid = ?", evicted)
+        self._conn.commit()
+        self._total_bytes -= freed
+        self.evictions += len(evicted)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            size = self._total_bytes
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "size_mb": size / (1024 * 1024),
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
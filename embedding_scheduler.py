@@ -0,0 +1,197 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional
+
+import openai
+
+from tracing import span
+from utils import count_tokens
+
+class EmbeddingError(Exception):
+    """Alguns batches falharam mesmo depois das tentativas. Os embeddings que deram certo
+    ficam em `embeddings` (None nos índices que falharam, listados em `failed`)."""
+
+    def __init__(self, failed: List[int], embeddings: List[Optional[List[float]]], last_error: Exception):
+        super().__init__(f"Failed to embed {len(failed)} of {len(embeddings)} texts: {last_error}")
+        self.failed = failed
+        self.embeddings = embeddings
+        self.last_error = last_error
+
+class AdaptiveLimiter:
+    """Limite de requests em paralelo que se adapta à quota da API (AIMD):
+    cai pela metade a cada 429 e sobe de um em um depois de uma sequência de sucessos.
+    Também guarda uma pausa global quando a API manda um retry-after."""
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.in_flight = 0
+        self.successes = 0
+        self.paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                elif self.in_flight >= self.limit:
+                    self._cond.wait()
+                else:
+                    self.in_flight += 1
+                    return
+
+    def release(self, rate_limited: bool = False, retry_after: float = 0.0):
+        with self._cond:
+            self.in_flight -= 1
+            if rate_limited:
+                self.limit = max(1, self.limit // 2)
+                self.successes = 0
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            else:
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self.successes = 0
+            self._cond.notify_all()
+
+def get_retry_after(error: openai.APIStatusError) -> Optional[float]:
+    """Lê os headers retry-after-ms / retry-after da resposta (em segundos)."""
+    headers = error.response.headers if error.response is not None else {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+class EmbeddingScheduler:
+    """Gera embeddings com vários requests em paralelo. Os batches são montados pela
+    contagem de tokens (tiktoken) e o ritmo vem da quota da API: 429s e erros
+    temporários fazem backoff e o limite de paralelismo se ajusta sozinho."""
+
+    def __init__(self, client: openai.OpenAI, model: str, max_concurrency: int = 4,
+                 max_batch_tokens: int = 100_000, max_batch_items: int = 2048,
+                 max_retries: int = 8, dimensions: Optional[int] = None):
+        # O backoff é feito aqui, não no client
+        self.client = client.with_options(max_retries=0)
+        self.model = model
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.max_retries = max_retries
+        self.dimensions = dimensions
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embed")
+        # Contadores atualizados pelas threads do executor (o benchmark compara o total de requests)
+        self.requests = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+
+    def pack_batches(self, texts: List[str]) -> List[List[int]]:
+        """Agrupa os índices dos textos em batches até max_batch_tokens / max_batch_items."""
+        token_counts = count_tokens(texts, self.model)
+
+        batches = []
+        current, current_tokens = [], 0
+        for i, n_tokens in enumerate(token_counts):
+            if current and (current_tokens + n_tokens > self.max_batch_tokens
+                            or len(current) >= self.max_batch_items):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += n_tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _request(self, batch: List[str]) -> List[List[float]]:
+        kwargs = {"input": batch, "model": self.model}
+        if self.dimensions:
+            kwargs["dimensions"] = self.dimensions
+        with span("embeddings.request", items=len(batch)) as request_span:
+            response = self.client.embeddings.create(**kwargs)
+            if response.usage is not None:
+                request_span.set(tokens=response.usage.prompt_tokens)
+        return [data.embedding for data in sorted(response.data, key=lambda d: d.index)]
+
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        """Envia um batch com retries. 429 e erros temporários esperam (retry-after ou
+        backoff exponencial com jitter); um 400 em batch com vários textos divide o batch
+        em dois para isolar o texto problemático."""
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                with self._lock:
+                    self.requests += 1
+                embeddings = self._request(batch)
+            except openai.RateLimitError as e:
+                with self._lock:
+                    self.rate_limited += 1
+                delay = get_retry_after(e) or min(60.0, 2 ** attempt) * (0.5 + random.random())
+                self.limiter.release(rate_limited=True, retry_after=delay)
+                error = e
+            except (openai.APIConnectionError, openai.InternalServerError) as e:
+                self.limiter.release()
+                delay = min(60.0, 2 ** attempt) * (0.5 + random.random())
+                error = e
+            except openai.BadRequestError:
+                self.limiter.release()
+                if len(batch) == 1:
+                    raise
+                middle = len(batch) // 2
+                return self._embed_batch(batch[:middle]) + self._embed_batch(batch[middle:])
+            except Exception:
+                self.limiter.release()
+                raise
+            else:
+                self.limiter.release()
+                return embeddings
+
+            attempt += 1
+            if attempt > self.max_retries:
+                raise error
+            time.sleep(delay)
+
+    def embed(self, texts: List[str],
+              on_batch: Callable[[List[str], List[List[float]]], None] = None) -> List[List[float]]:
+        """Gera os embeddings de todos os textos, na mesma ordem. `on_batch` é chamado
+        a cada batch concluído. Se algum batch falhar de vez, os outros terminam e
+        um EmbeddingError é levantado com os resultados parciais."""
+        batches = self.pack_batches(texts)
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        failed = []
+        last_error = None
+
+        futures = {
+            self.executor.submit(self._embed_batch, [texts[i] for i in batch]): batch
+            for batch in batches
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            batch = futures[future]
+            try:
+                batch_embeddings = future.result()
+            except Exception as e:
+                print(f"Embedding batch failed ({len(batch)} texts): {e}")
+                failed.extend(batch)
+                last_error = e
+                continue
+
+            for i, embedding in zip(batch, batch_embeddings):
+                embeddings[i] = embedding
+            if on_batch is not None:
+                on_batch([texts[i] for i in batch], batch_embeddings)
+            print(f"Generated embeddings for batch {done}/{len(batches)} "
+                  f"({len(batch)} texts, concurrency {self.limiter.limit})")
+
+        if failed:
+            raise EmbeddingError(sorted(failed), embeddings, last_error)
+        return embeddings
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,231 @@
+import argparse
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+import numpy as np
+
+# Servidor fake compatível com a API da OpenAI, para testar o ingest sem rede e sem gastar.
+# Uso: python fake_openai.py --port 8001 --rpm 600 --latency 0.2
+#      OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=fake poetry run vectorize
+
+class FakeOpenAIState:
+    """Configuração e contadores do servidor fake."""
+
+    def __init__(self, latency: float = 0.0, rpm: int = 0, dim: int = 3072,
+                 tokens_per_second: float = 0.0, answer_tokens: int = 50, error_rate: float = 0.0,
+                 burst: int = 0):
+        self.latency = latency
+        self.rpm = rpm
+        # Tamanho do token bucket (0 = rpm, um minuto de requests de uma vez)
+        self.burst = burst or rpm
+        self.dim = dim
+        # Chat: velocidade de geração (0 = instantâneo) e tamanho das respostas
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        # Fração dos requests que recebem 500 (para testar failover)
+        self.error_rate = error_rate
+        # Prefix cache simulado: prompts + respostas recentes, em palavras
+        self.prefix_cache = deque(maxlen=64)
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.cancelled = 0  # Streams fechados pelo cliente no meio da resposta
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+
+    def take_request(self) -> float:
+        """Token bucket por minuto. Retorna 0 se o request pode passar, ou quantos
+        segundos o cliente deve esperar (vai no retry-after do 429)."""
+        with self._lock:
+            self.requests += 1
+            if not self.rpm:
+                return 0.0
+            now = time.monotonic()
+            self._tokens = min(self.burst or self.rpm, self._tokens + (now - self._last_refill) * self.rpm / 60)
+            self._last_refill = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            self.rate_limited += 1
+            return (1 - self._tokens) * 60 / self.rpm
+
+    def cached_tokens(self, words: list, answer: list) -> int:
+        """Maior prefixo de `words` já visto (como num RadixAttention) e guarda prompt + resposta.
+        Os marcadores de role não contam como tokens."""
+        with self._lock:
+            best = 0
+            for seen in self.prefix_cache:
+                size = 0
+                for a, b in zip(words, seen):
+                    if a != b:
+                        break
+                    size += 1
+                best = max(best, size)
+            self.prefix_cache.append(words + ["\0assistant"] + [token.strip() for token in answer])
+        return sum(1 for word in words[:best] if not word.startswith("\0"))
+
+def fake_answer(messages: list, n_tokens: int) -> list:
+    """Resposta determinística (lista de tokens) a partir das mensagens."""
+    seed = int(hashlib.md5(json.dumps(messages).encode("utf-8")).hexdigest()[:16], 16)
+    words = ["resposta", "documento", "página", "contexto", "segundo", "o", "a", "de", "que", "com"]
+    choices = np.random.default_rng(seed).integers(0, len(words), n_tokens)
+    return [words[i] + " " for i in choices]
+
+def fake_embedding(text: str, dim: int) -> np.ndarray:
+    """Vetor determinístico e normalizado a partir do hash do texto."""
+    seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:16], 16)
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    state: FakeOpenAIState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: dict = None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        # GET /models: usado como health check pelo router de LLM
+        if self.path.endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "fake", "object": "model", "owned_by": "fake"}]})
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        retry_after = self.state.take_request()
+        if retry_after:
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                            headers={"retry-after-ms": str(int(retry_after * 1000))})
+            return
+
+        if self.state.latency:
+            time.sleep(self.state.latency)
+
+        if self.state.error_rate and random.random() < self.state.error_rate:
+            self.state.errors += 1
+            self._send_json(500, {"error": {"message": "Fake server error", "type": "server_error"}})
+            return
+
+        if self.path.endswith("/embeddings"):
+            self._embeddings(body)
+        elif self.path.endswith("/chat/completions"):
+            self._chat_completions(body)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def _embeddings(self, body: dict):
+        inputs = body["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dim = body.get("dimensions") or self.state.dim
+        use_base64 = body.get("encoding_format") == "base64"
+
+        data = []
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(text, dim)
+            embedding = base64.b64encode(vector.tobytes()).decode("ascii") if use_base64 else vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+
+        tokens = sum(len(text.split()) for text in inputs)
+        self._send_json(200, {
+            "object": "list",
+            "data": data,
+            "model": body.get("model"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _chat_completions(self, body: dict):
+        tokens = fake_answer(body.get("messages", []), min(self.state.answer_tokens, body.get("max_tokens") or 10**9))
+        words = [word for m in body.get("messages", []) for word in [f"\0{m.get('role')}", *str(m.get("content", "")).split()]]
+        prompt_tokens = sum(1 for word in words if not word.startswith("\0"))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                 "total_tokens": prompt_tokens + len(tokens),
+                 "prompt_tokens_details": {"cached_tokens": self.state.cached_tokens(words, tokens)}}
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": body.get("model")}
+        delay = 1 / self.state.tokens_per_second if self.state.tokens_per_second else 0
+
+        if not body.get("stream"):
+            time.sleep(delay * len(tokens))
+            self._send_json(200, {**base, "object": "chat.completion", "usage": usage, "choices": [{
+                "index": 0, "finish_reason": "stop",
+                "message": {"role": "assistant", "content": "".join(tokens)},
+            }]})
+            return
+
+        # Streaming (SSE), um token por evento
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        def send(payload: dict):
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            for token in tokens:
+                time.sleep(delay)
+                send({**base, "object": "chat.completion.chunk", "choices": [{
+                    "index": 0, "finish_reason": None, "delta": {"content": token},
+                }]})
+            send({**base, "object": "chat.completion.chunk", "choices": [{
+                "index": 0, "finish_reason": "stop", "delta": {},
+            }]})
+            if (body.get("stream_options") or {}).get("include_usage"):
+                send({**base, "object": "chat.completion.chunk", "choices": [], "usage": usage})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # O cliente fechou o stream (ex: request de hedge que perdeu)
+            self.state.cancelled += 1
+            self.close_connection = True
+
+def start_fake_server(port: int = 0, **options) -> Tuple[ThreadingHTTPServer, str]:
+    """Sobe o servidor fake numa thread. Retorna o servidor e a base_url para o client."""
+    handler = type("Handler", (FakeOpenAIHandler,), {"state": FakeOpenAIState(**options)})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible server")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute before 429 (0 = unlimited)")
+    parser.add_argument("--burst", type=int, default=0, help="Requests allowed at once (0 = rpm)")
+    parser.add_argument("--dim", type=int, default=3072, help="Default embedding dimension")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Chat generation speed (0 = instant)")
+    parser.add_argument("--answer-tokens", type=int, default=50, help="Tokens in each chat answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 500")
+    args = parser.parse_args()
+
+    server, base_url = start_fake_server(args.port, latency=args.latency, rpm=args.rpm, burst=args.burst, dim=args.dim,
+                                         tokens_per_second=args.tokens_per_second,
+                                         answer_tokens=args.answer_tokens, error_rate=args.error_rate)
+    print(f"Fake OpenAI server running at {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
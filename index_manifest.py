@@ -0,0 +1,108 @@
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+# Um chunk no Milvus é identificado pelo par (chunk_id, page_number)
+ChunkKey = Tuple[str, int]
+
+class IndexManifest:
+    """Manifesto persistido em JSON com o hash de cada PDF indexado e os chunks
+    que foram inseridos no Milvus. Usado pelo modo incremental do vectorizer.
+
+    Enquanto um PDF está sendo processado, cada batch inserido é registrado num
+    journal (<manifesto>.journal). Se o processo cair no meio de um arquivo, esses
+    chunks contam como já inseridos na próxima execução, que continua de onde parou.
+
+    Cada save() grava uma nova `version`, que o chat usa para descartar caches
+    de respostas quando o índice muda. `settings` guarda os parâmetros que geraram
+    os chunks e os vetores (tamanho dos chunks, modelo, dimensão, quantização)."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.journal_path = self.path.with_suffix(self.path.suffix + ".journal")
+        self.files: Dict[str, Dict] = {}
+        self.pending: Dict[str, Set[ChunkKey]] = {}
+        self.version: Optional[str] = None
+        self.settings: Dict = {}
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def load(self) -> "IndexManifest":
+        """Carrega o manifesto e o journal do disco (se existirem)."""
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.files = data.get("files", {})
+            self.version = data.get("version")
+            self.settings = data.get("settings", {})
+        
+        self.pending = {}
+        if self.journal_path.exists():
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # Última linha incompleta (o processo caiu escrevendo)
+                    self.pending.setdefault(entry["file_name"], set()).update(
+                        (chunk_id, page_number) for chunk_id, page_number in entry["chunks"]
+                    )
+        return self
+
+    def save(self):
+        """Salva o manifesto de forma atômica (escreve num temporário e renomeia)
+        e reescreve o journal só com os arquivos que ainda estão pendentes."""
+        self.version = uuid.uuid4().hex
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "settings": self.settings, "files": self.files}, f)
+        os.replace(tmp_path, self.path)
+        
+        tmp_path = self.journal_path.with_suffix(self.journal_path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for file_name, chunk_keys in self.pending.items():
+                f.write(json.dumps({"file_name": file_name, "chunks": sorted(chunk_keys)}) + "\n")
+        os.replace(tmp_path, self.journal_path)
+
+    def clear(self):
+        self.files = {}
+        self.pending = {}
+
+    def indexed_files(self) -> List[str]:
+        """Arquivos com chunks no Milvus, completos ou pela metade."""
+        return list(dict.fromkeys([*self.files, *self.pending]))
+
+    def get_hash(self, file_name: str) -> Optional[str]:
+        entry = self.files.get(file_name)
+        return entry["file_hash"] if entry else None
+
+    def get_chunk_keys(self, file_name: str) -> Set[ChunkKey]:
+        """Chunks deste arquivo que estão no Milvus (manifesto + journal)."""
+        keys = set(self.pending.get(file_name, ()))
+        entry = self.files.get(file_name)
+        if entry:
+            keys.update((chunk_id, page_number) for chunk_id, page_number in entry["chunks"])
+        return keys
+
+    def record_inserted(self, file_name: str, chunk_keys: List[ChunkKey]):
+        """Checkpoint: registra no journal um batch de chunks já inserido no Milvus."""
+        chunk_keys = list(chunk_keys)
+        self.pending.setdefault(file_name, set()).update(chunk_keys)
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"file_name": file_name, "chunks": chunk_keys}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def update(self, file_name: str, file_hash: str, chunk_keys: List[ChunkKey]):
+        self.pending.pop(file_name, None)
+        self.files[file_name] = {
+            "file_hash": file_hash,
+            "chunks": [[chunk_id, page_number] for chunk_id, page_number in sorted(chunk_keys)],
+        }
+
+    def remove(self, file_name: str):
+        self.pending.pop(file_name, None)
+        self.files.pop(file_name, None)
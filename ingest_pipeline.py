@@ -0,0 +1,267 @@
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from index_manifest import IndexManifest
+from utils import count_pdf_pages, generate_file_hash
+
+# Marca o fim de uma fila
+_DONE = object()
+
+class FileState:
+    """Estado de um PDF dentro do pipeline. O arquivo só é finalizado (stale chunks
+    removidos e manifesto atualizado) quando todas as páginas foram extraídas e
+    todos os seus chunks foram inseridos."""
+
+    def __init__(self, pdf_path: str, file_hash: Optional[str], old_keys: set):
+        self.pdf_path = pdf_path
+        self.file_name = Path(pdf_path).name
+        self.file_hash = file_hash
+        self.old_keys = old_keys
+        self.new_keys = set()
+        self.pending_tasks = 0
+        self.pending_rows = 0
+        self.inserted = 0
+        self.finalized = False
+
+class IngestPipeline:
+    """Pipeline de ingest em estágios com filas limitadas:
+    extração + chunking (process pool, por intervalo de páginas) -> embeddings (threads)
+    -> inserção em batches (uma thread). Com dedup_fn, os chunks repetidos saem antes dos
+    embeddings (no coletor, uma thread só). Assim a CPU trabalha enquanto a rede espera
+    e o tempo total fica perto do estágio mais lento."""
+
+    def __init__(self, chunk_fn: Callable, embed_fn: Callable, insert_fn: Callable,
+                 delete_fn: Callable, manifest: IndexManifest = None, dedup_fn: Optional[Callable] = None,
+                 extract_workers: int = 4, embed_workers: int = 4,
+                 insert_batch_size: int = 500, queue_size: int = 8, pages_per_task: int = 50):
+        self.chunk_fn = chunk_fn
+        self.embed_fn = embed_fn
+        self.insert_fn = insert_fn
+        self.delete_fn = delete_fn
+        self.dedup_fn = dedup_fn
+        self.manifest = manifest
+        self.extract_workers = extract_workers
+        self.embed_workers = embed_workers
+        self.insert_batch_size = insert_batch_size
+        self.pages_per_task = pages_per_task
+
+        self.extract_queue = queue.Queue(maxsize=max(queue_size, extract_workers))
+        self.embed_queue = queue.Queue(maxsize=queue_size)
+        self.insert_queue = queue.Queue(maxsize=queue_size)
+
+        self.error = None
+        self.total_inserted = 0
+        self.total_pages = 0
+        self.stage_seconds = {"embed": 0.0, "insert": 0.0}
+        self._lock = threading.Lock()
+
+    def _fail(self, error: Exception):
+        with self._lock:
+            if self.error is None:
+                print(f"Pipeline error: {error}")
+                self.error = error
+
+    def _open_file(self, pdf_path: str) -> Optional[FileState]:
+        """Verifica o manifesto. Retorna None se o PDF não mudou desde a última indexação."""
+        if self.manifest is None:
+            return FileState(pdf_path, None, set())
+
+        file_name = Path(pdf_path).name
+        file_hash = generate_file_hash(pdf_path)
+        if self.manifest.get_hash(file_name) == file_hash and file_name not in self.manifest.pending:
+            print(f"Unchanged, skipping {pdf_path}")
+            return None
+        return FileState(pdf_path, file_hash, self.manifest.get_chunk_keys(file_name))
+
+    def _maybe_finalize(self, state: FileState):
+        """Remove os chunks antigos e atualiza o manifesto quando o arquivo terminou."""
+        with self._lock:
+            if state.finalized or state.pending_tasks or state.pending_rows or self.error:
+                return
+            state.finalized = True
+
+            stale_keys = state.old_keys - state.new_keys
+            if stale_keys:
+                self.delete_fn(state.file_name, stale_keys)
+            if self.manifest is not None:
+                self.manifest.update(state.file_name, state.file_hash, state.new_keys)
+                self.manifest.save()
+            print(f"Successfully processed {state.pdf_path} - {state.inserted} chunks inserted"
+                  + (f", {len(stale_keys)} stale removed" if stale_keys else ""))
+
+    def _collect(self):
+        """Recebe os chunks extraídos (na ordem de submissão) e manda para os embeddings
+        só os que ainda não estão no Milvus."""
+        while True:
+            item = self.extract_queue.get()
+            if item is _DONE:
+                break
+            future, state = item
+            try:
+                chunks = future.result()
+            except Exception as e:
+                self._fail(e)
+                continue
+            if self.error:
+                continue
+
+            state.new_keys.update((chunk["chunk_id"], chunk["page_number"]) for chunk in chunks)
+            to_insert = [
+                chunk for chunk in chunks
+                if (chunk["chunk_id"], chunk["page_number"]) not in state.old_keys
+            ]
+            if self.dedup_fn is not None and to_insert:
+                try:
+                    to_insert = self.dedup_fn(to_insert)
+                except Exception as e:
+                    self._fail(e)
+                    continue
+            with self._lock:
+                state.pending_rows += len(to_insert)
+                state.pending_tasks -= 1
+            if to_insert:
+                self.embed_queue.put((state, to_insert))
+            else:
+                self._maybe_finalize(state)
+
+        for _ in range(self.embed_workers):
+            self.embed_queue.put(_DONE)
+
+    def _next_embed_items(self) -> Optional[List]:
+        """Pega um item da fila e junta os que já estiverem esperando (até
+        insert_batch_size chunks), para mandar menos requests de embeddings."""
+        item = self.embed_queue.get()
+        if item is _DONE:
+            return None
+        items = [item]
+        n_chunks = len(item[1])
+        while n_chunks < self.insert_batch_size:
+            try:
+                item = self.embed_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _DONE:
+                # Devolve o fim da fila para a próxima volta
+                self.embed_queue.put(_DONE)
+                break
+            items.append(item)
+            n_chunks += len(item[1])
+        return items
+
+    def _embed(self):
+        while True:
+            items = self._next_embed_items()
+            if items is None:
+                break
+            if self.error:
+                continue
+            try:
+                start = time.perf_counter()
+                embeddings = iter(self.embed_fn([chunk["text"] for _, chunks in items for chunk in chunks]))
+                with self._lock:
+                    self.stage_seconds["embed"] += time.perf_counter() - start
+            except Exception as e:
+                self._fail(e)
+                continue
+            for state, chunks in items:
+                rows = [{**chunk, "vector": next(embeddings)} for chunk in chunks]
+                self.insert_queue.put((state, rows))
+
+    def _flush(self, buffer: List):
+        rows = [row for _, batch in buffer for row in batch]
+        if not rows or self.error:
+            return
+        try:
+            start = time.perf_counter()
+            self.insert_fn(rows)
+            self.stage_seconds["insert"] += time.perf_counter() - start
+        except Exception as e:
+            self._fail(e)
+            return
+
+        print(f"Inserted {len(rows)} chunks into the vector store")
+        self.total_inserted += len(rows)
+        for state, batch in buffer:
+            with self._lock:
+                state.pending_rows -= len(batch)
+                state.inserted += len(batch)
+                # Checkpoint, se cair no meio do arquivo a próxima execução não insere de novo
+                if self.manifest is not None:
+                    self.manifest.record_inserted(
+                        state.file_name, [(row["chunk_id"], row["page_number"]) for row in batch]
+                    )
+            self._maybe_finalize(state)
+
+    def _insert(self):
+        """Junta as linhas de vários arquivos e insere em batches de insert_batch_size."""
+        buffer, buffered = [], 0
+        while True:
+            try:
+                item = self.insert_queue.get(timeout=1.0)
+            except queue.Empty:
+                # Nada chegando, insere o que tiver para não segurar arquivos pequenos
+                self._flush(buffer)
+                buffer, buffered = [], 0
+                continue
+            if item is _DONE:
+                break
+            buffer.append(item)
+            buffered += len(item[1])
+            if buffered >= self.insert_batch_size:
+                self._flush(buffer)
+                buffer, buffered = [], 0
+        self._flush(buffer)
+
+    def run(self, pdf_paths: List[str]) -> int:
+        """Processa os PDFs e retorna o número de chunks inseridos."""
+        start = time.perf_counter()
+        collector = threading.Thread(target=self._collect, name="collect")
+        embedders = [threading.Thread(target=self._embed, name=f"embed-{i}") for i in range(self.embed_workers)]
+        inserter = threading.Thread(target=self._insert, name="insert")
+        for thread in [collector, *embedders, inserter]:
+            thread.start()
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.extract_workers) as pool:
+                for pdf_path in pdf_paths:
+                    if self.error:
+                        break
+                    state = self._open_file(pdf_path)
+                    if state is None:
+                        continue
+
+                    print(f"Processing PDF: {pdf_path}")
+                    n_pages = count_pdf_pages(pdf_path)
+                    self.total_pages += n_pages
+                    ranges = [(first, min(first + self.pages_per_task, n_pages))
+                              for first in range(0, n_pages, self.pages_per_task)]
+                    state.pending_tasks = len(ranges)
+                    if not ranges:
+                        self._maybe_finalize(state)
+
+                    # A fila limitada segura a submissão quando os próximos estágios estão atrasados
+                    for first, last in ranges:
+                        future = pool.submit(self.chunk_fn, pdf_path, first, last)
+                        self.extract_queue.put((future, state))
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self.extract_queue.put(_DONE)
+            collector.join()
+            for thread in embedders:
+                thread.join()
+            self.insert_queue.put(_DONE)
+            inserter.join()
+
+        if self.error:
+            raise self.error
+
+        elapsed = time.perf_counter() - start
+        print(f"Pipeline: {self.total_pages} pages, {self.total_inserted} chunks in {elapsed:.1f}s "
+              f"({self.total_pages / elapsed if elapsed else 0:.1f} pages/s) - "
+              f"embed busy {self.stage_seconds['embed']:.1f}s, insert busy {self.stage_seconds['insert']:.1f}s")
+        return self.total_inserted
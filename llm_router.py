@@ -0,0 +1,326 @@
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from streaming import GenerationStats, StreamCollector
+
+# Amostras de TTFT guardadas por endpoint (para a escolha e o atraso do hedge)
+LATENCY_SAMPLES = 200
+
+# Mínimo de amostras para usar o p95 medido no atraso do hedge
+MIN_HEDGE_SAMPLES = 20
+
+class Endpoint:
+    """Um servidor OpenAI-compatible (OpenAI, SGLang, vLLM...) e as métricas dele."""
+
+    def __init__(self, name: str, base_url: str = None, api_key: str = None, model: str = None,
+                 max_retries: int = 0, timeout: float = 600.0):
+        # O import do openai fica fora do caminho até o prompt do chat
+        from openai import OpenAI
+        self.name = name
+        self.base_url = base_url
+        self.model = model
+        self.client = OpenAI(api_key=api_key or "none", base_url=base_url, max_retries=max_retries, timeout=timeout)
+        self.healthy = True
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.hedges_won = 0
+        self.ttfts = deque(maxlen=LATENCY_SAMPLES)
+        self.last_error: Optional[str] = None
+
+    def ttft_quantile(self, q: float) -> Optional[float]:
+        return float(np.quantile(list(self.ttfts), q)) if self.ttfts else None
+
+    def stats(self) -> Dict:
+        p50, p95 = self.ttft_quantile(0.5), self.ttft_quantile(0.95)
+        return {
+            "base_url": self.base_url,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "hedges_won": self.hedges_won,
+            "ttft_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "ttft_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "last_error": self.last_error,
+        }
+
+class Attempt:
+    """Um request em andamento: abre o stream numa thread e espera o primeiro pedaço de texto."""
+
+    def __init__(self, router: "LLMRouter", endpoint: Endpoint, kwargs: Dict, results: queue.Queue,
+                 decision: Dict, hedge: bool):
+        self.router = router
+        self.endpoint = endpoint
+        self.kwargs = {**kwargs, "model": endpoint.model or kwargs.get("model")}
+        self.results = results
+        self.decision = decision
+        self.hedge = hedge
+        self.stream = None
+        self.chunks: List = []
+        self.start = time.perf_counter()
+        threading.Thread(target=self._run, daemon=True, name=f"llm-{endpoint.name}").start()
+
+    def _first_chunks(self):
+        """Lê o stream até o primeiro pedaço com texto (ou até o fim)."""
+        self.stream = self.endpoint.client.chat.completions.create(
+            stream=True, stream_options={"include_usage": True}, **self.kwargs
+        )
+        self.iterator = iter(self.stream)
+        for chunk in self.iterator:
+            self.chunks.append(chunk)
+            delta = chunk.choices[0].delta if chunk.choices else None
+            if delta is not None and (delta.content or getattr(delta, "reasoning_content", None)):
+                return
+
+    def _run(self):
+        try:
+            self._first_chunks()
+        except Exception as e:
+            self.router._record_failure(self.endpoint, e)
+            self.router._release(self.endpoint)
+            self.results.put((self, e))
+            return
+        self.router._record_success(self.endpoint, time.perf_counter() - self.start)
+        # O primeiro a responder ganha; os outros fecham a conexão (o servidor para de gerar)
+        with self.router._lock:
+            won = self.decision.get("winner") is None
+            if won:
+                self.decision["winner"] = self
+        if won:
+            self.results.put((self, None))
+        else:
+            self.close()
+            self.router._release(self.endpoint)
+
+    def close(self):
+        try:
+            self.stream.close()
+        except Exception:
+            pass
+
+class LLMRouter:
+    """Escolhe entre vários endpoints pelo TTFT medido e pela carga (requests em andamento),
+    tira do rodízio os que falham (health check em background traz de volta) e, com
+    `hedge`, manda um segundo request para outro endpoint se o primeiro não respondeu
+    até o p95 do TTFT. Só o início da resposta é disputado: depois do primeiro token o
+    stream segue no endpoint que ganhou."""
+
+    def __init__(self, endpoints: List[Endpoint], hedge: bool = False, hedge_min_delay: float = 0.2,
+                 max_attempts: int = 3, failure_threshold: int = 2, health_interval: float = 10.0,
+                 health_timeout: float = 2.0):
+        if not endpoints:
+            raise ValueError("LLMRouter needs at least one endpoint")
+        self.endpoints = endpoints
+        self.hedge = hedge and len(endpoints) > 1
+        self.hedge_min_delay = hedge_min_delay
+        self.max_attempts = max_attempts
+        self.failure_threshold = failure_threshold
+        self.health_timeout = health_timeout
+        self.hedges_sent = 0
+        self.failovers = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        if len(endpoints) > 1 and health_interval > 0:
+            threading.Thread(target=self._health_loop, args=(health_interval,), daemon=True,
+                             name="llm-health").start()
+
+    def _score(self, endpoint: Endpoint) -> float:
+        # Sem amostras o endpoint é experimentado logo; falhas recentes empurram para o fim da fila
+        latency = endpoint.ttft_quantile(0.5) or 0.0
+        return (latency + 0.01) * (1 + endpoint.in_flight) * (1 + 10 * endpoint.consecutive_failures)
+
+    def pick(self, exclude: List[Endpoint] = ()) -> Optional[Endpoint]:
+        """Endpoint saudável com menor score; se todos estão fora, o que falhou menos."""
+        with self._lock:
+            candidates = [e for e in self.endpoints if e not in exclude]
+            if not candidates:
+                return None
+            healthy = [e for e in candidates if e.healthy]
+            if healthy:
+                endpoint = min(healthy, key=self._score)
+            else:
+                endpoint = min(candidates, key=lambda e: e.consecutive_failures)
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def _release(self, endpoint: Endpoint):
+        with self._lock:
+            endpoint.in_flight -= 1
+
+    def _record_success(self, endpoint: Endpoint, ttft: float):
+        with self._lock:
+            endpoint.ttfts.append(ttft)
+            endpoint.consecutive_failures = 0
+            endpoint.healthy = True
+
+    def _record_failure(self, endpoint: Endpoint, error: Exception):
+        with self._lock:
+            endpoint.errors += 1
+            endpoint.consecutive_failures += 1
+            endpoint.last_error = f"{type(error).__name__}: {error}"
+            if endpoint.consecutive_failures >= self.failure_threshold:
+                endpoint.healthy = False
+
+    def hedge_delay(self, endpoint: Endpoint) -> float:
+        """Quanto esperar o primeiro token antes de mandar o request de hedge."""
+        with self._lock:
+            p95 = endpoint.ttft_quantile(0.95) if len(endpoint.ttfts) >= MIN_HEDGE_SAMPLES else None
+        return max(self.hedge_min_delay, p95 if p95 is not None else 1.0)
+
+    def stream_chat_completion(self, on_text: Callable[[str], None] = None,
+                               on_reasoning: Callable[[str], None] = None,
+                               **kwargs) -> Tuple[str, str, GenerationStats]:
+        """Chama chat.completions com stream=True e repassa cada pedaço de texto para `on_text`
+        (e o reasoning_content, de servidores como SGLang/vLLM, para `on_reasoning`) assim que chega.
+        Retorna (content, reasoning, stats); stats.endpoint diz quem respondeu.
+        Falhas antes do primeiro token vão para o próximo endpoint (até max_attempts)."""
+        collector = StreamCollector(on_text, on_reasoning)
+        results: queue.Queue = queue.Queue()
+        decision: Dict = {"winner": None}
+        tried: List[Endpoint] = []
+        pending = 0
+        last_error = None
+
+        def launch(hedge: bool) -> bool:
+            nonlocal pending
+            endpoint = self.pick(exclude=tried)
+            if endpoint is None:
+                return False
+            tried.append(endpoint)
+            pending += 1
+            Attempt(self, endpoint, kwargs, results, decision, hedge)
+            return True
+
+        launch(hedge=False)
+        hedged = False
+        winner = None
+        while winner is None:
+            can_hedge = self.hedge and not hedged and len(tried) < min(self.max_attempts, len(self.endpoints))
+            try:
+                attempt, error = results.get(timeout=self.hedge_delay(tried[-1]) if can_hedge else None)
+            except queue.Empty:
+                hedged = True
+                if launch(hedge=True):
+                    with self._lock:
+                        self.hedges_sent += 1
+                continue
+            pending -= 1
+            if error is None:
+                winner = attempt
+                break
+            last_error = error
+            if pending == 0:
+                # Failover: nenhum request em andamento, tenta o próximo endpoint
+                if len(tried) >= self.max_attempts or not launch(hedge=False):
+                    raise last_error
+                with self._lock:
+                    self.failovers += 1
+
+        if winner.hedge:
+            with self._lock:
+                winner.endpoint.hedges_won += 1
+        collector.start = winner.start
+        try:
+            for chunk in winner.chunks:
+                collector.add(chunk)
+            for chunk in winner.iterator:
+                collector.add(chunk)
+        except Exception as e:
+            # Falha no meio da resposta: o texto já foi mostrado, não dá para trocar de endpoint
+            self._record_failure(winner.endpoint, e)
+            raise
+        finally:
+            self._release(winner.endpoint)
+        content, reasoning, stats = collector.finish(winner.kwargs["model"] or "")
+        stats.endpoint = winner.endpoint.name
+        return content, reasoning, stats
+
+    def check_health(self):
+        """GET /models em cada endpoint; quem responde volta para o rodízio."""
+        for endpoint in self.endpoints:
+            try:
+                endpoint.client.with_options(timeout=self.health_timeout).models.list()
+            except Exception as e:
+                with self._lock:
+                    endpoint.healthy = False
+                    endpoint.last_error = f"health check: {type(e).__name__}: {e}"
+                continue
+            with self._lock:
+                endpoint.healthy = True
+                endpoint.consecutive_failures = 0
+
+    def _health_loop(self, interval: float):
+        while not self._stop.wait(interval):
+            self.check_health()
+
+    def stats(self) -> Dict:
+        # Sob o lock: as threads dos requests mudam os contadores e as amostras de TTFT
+        with self._lock:
+            return {
+                "hedges_sent": self.hedges_sent,
+                "failovers": self.failovers,
+                "endpoints": {endpoint.name: endpoint.stats() for endpoint in self.endpoints},
+            }
+
+    def close(self):
+        self._stop.set()
+
+def backend_endpoints(backend: str) -> List[Dict]:
+    """Endpoints de um backend: "openai" (CHAT_ENDPOINTS ou OPENAI_BASE_URL) ou "vm"
+    (VM_ENDPOINTS ou a VM local e a VM do runpod, as que estiverem configuradas)."""
+    from config import settings
+    if backend == "vm":
+        if settings.VM_ENDPOINTS:
+            return settings.VM_ENDPOINTS
+        endpoints = [{"name": "local-vm", "base_url": settings.LOCAL_VM_ADDRESS},
+                     {"name": "runpod-vm", "base_url": settings.VM_ADDRESS}]
+        return [endpoint for endpoint in endpoints if endpoint["base_url"]]
+    return settings.CHAT_ENDPOINTS or [{"name": "openai", "base_url": settings.OPENAI_BASE_URL}]
+
+def create_backend_router(backend: str) -> Optional[LLMRouter]:
+    """Router do backend ("openai" ou "vm") com o modelo dele; None se não há endpoint configurado."""
+    from config import settings
+    endpoints = backend_endpoints(backend)
+    if not endpoints:
+        return None
+    return create_router(endpoints, settings.VM_MODEL if backend == "vm" else settings.CHAT_MODEL)
+
+def create_router(endpoints: List[Dict], default_model: str = None) -> LLMRouter:
+    """Router a partir da configuração: [{"name", "base_url", "api_key"?, "model"?}, ...]."""
+    from config import settings
+    # Com vários endpoints as novas tentativas vão para outro endpoint; com um só, ficam no client
+    max_retries = 0 if len(endpoints) > 1 else 2
+    return LLMRouter(
+        [
+            Endpoint(config.get("name") or config["base_url"], config.get("base_url"),
+                     api_key=config.get("api_key") or settings.OPENAI_API_KEY,
+                     model=config.get("model") or default_model, max_retries=max_retries)
+            for config in endpoints
+        ],
+        hedge=settings.LLM_HEDGE_ENABLED,
+        hedge_min_delay=settings.LLM_HEDGE_MIN_DELAY_MS / 1000,
+        max_attempts=settings.LLM_MAX_ATTEMPTS,
+        failure_threshold=settings.LLM_FAILURE_THRESHOLD,
+        health_interval=settings.LLM_HEALTH_INTERVAL_SECONDS,
+        health_timeout=settings.LLM_HEALTH_TIMEOUT_SECONDS,
+    )
+
+def format_stats(stats: Dict) -> str:
+    """Resumo legível das métricas por endpoint."""
+    lines = [f"LLM router: {stats['hedges_sent']} hedged requests, {stats['failovers']} failovers"]
+    for name, endpoint in stats["endpoints"].items():
+        status = "up" if endpoint["healthy"] else "DOWN"
+        p50 = endpoint["ttft_p50_ms"]
+        p95 = endpoint["ttft_p95_ms"]
+        lines.append(f"  {name} ({status}): {endpoint['requests']} requests, {endpoint['errors']} errors, "
+                     f"{endpoint['hedges_won']} hedges won, TTFT p50 {p50 if p50 is not None else '-'} ms "
+                     f"/ p95 {p95 if p95 is not None else '-'} ms")
+    return "\n".join(lines)
@@ -0,0 +1,158 @@
+import argparse
+import time
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+from config import settings
+
+# Formatos de armazenamento compacto dos vetores
+QUANTIZATIONS = ["none", "float16", "int8", "binary"]
+
+# Número de bits 1 em cada byte (para a distância de Hamming)
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+
+def truncate(vectors: np.ndarray, dim: int) -> np.ndarray:
+    """Corta os vetores em `dim` dimensões e normaliza de novo. É o mesmo que pedir
+    `dimensions=dim` para os modelos text-embedding-3."""
+    vectors = np.asarray(vectors[:, :dim], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def quantize(vectors: np.ndarray, method: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Converte os vetores para o formato compacto. Retorna (codes, scales);
+    scales só existe no int8 (um fator por vetor)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if method == "float16":
+        return vectors.astype(np.float16), None
+    if method == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        codes = np.round(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    if method == "binary":
+        return np.packbits(vectors > 0, axis=1), None
+    raise ValueError(f"Unknown quantization: {method}")
+
+def code_bytes(dim: int, method: str) -> int:
+    """Bytes por vetor no formato compacto."""
+    return {
+        "none": dim * 4,
+        "float16": dim * 2,
+        "int8": dim + 4,
+        "binary": (dim + 7) // 8,
+    }[method]
+
+def coarse_scores(codes: np.ndarray, scales: Optional[np.ndarray], queries: np.ndarray,
+                  method: str) -> np.ndarray:
+    """Scores aproximados (n, n_queries) entre os vetores compactos e as queries float32.
+    Para binary o score é o número de bits iguais (quanto maior, mais similar)."""
+    if method == "float16":
+        return np.asarray(codes, dtype=np.float32) @ queries.T
+    if method == "int8":
+        return (np.asarray(codes, dtype=np.float32) @ queries.T) * np.asarray(scales)[:, None]
+    if method == "binary":
+        query_codes = np.packbits(queries > 0, axis=1)
+        n_bits = queries.shape[1]
+        # numpy >= 2.0 tem popcount nativo, senão usa a tabela
+        popcount = getattr(np, "bitwise_count", lambda x: POPCOUNT[x])
+        return np.stack([
+            n_bits - popcount(np.bitwise_xor(codes, query_code)).sum(axis=1, dtype=np.float32)
+            for query_code in query_codes
+        ], axis=1)
+    raise ValueError(f"Unknown quantization: {method}")
+
+def exact_top_k(base: np.ndarray, queries: np.ndarray, top_k: int) -> np.ndarray:
+    """Índices dos top_k por inner product exato (n_queries, top_k)."""
+    scores = queries @ base.T
+    best = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1)
+    return np.take_along_axis(best, order, axis=1)
+
+def evaluate(base: np.ndarray, queries: np.ndarray, truth: np.ndarray, dim: int, method: str,
+             top_k: int, rescore: int) -> Tuple[float, float]:
+    """Recall@k de uma configuração (dimensão + formato), com rescoring opcional
+    dos `rescore` melhores candidatos usando os vetores completos. Retorna (recall, ms/query)."""
+    base_dim, queries_dim = truncate(base, dim), truncate(queries, dim)
+    start = time.perf_counter()
+    if method == "none":
+        scores = queries_dim @ base_dim.T
+    else:
+        codes, scales = quantize(base_dim, method)
+        scores = coarse_scores(codes, scales, queries_dim, method).T
+
+    shortlist = top_k if not rescore else max(rescore, top_k)
+    candidates = np.argpartition(-scores, shortlist - 1, axis=1)[:, :shortlist]
+    if rescore:
+        # Segundo estágio: score exato dos candidatos com os vetores completos (float32, dimensão cheia)
+        full_scores = np.stack([base[rows] @ query for rows, query in zip(candidates, queries)])
+        best = np.argpartition(-full_scores, top_k - 1, axis=1)[:, :top_k]
+        found = np.take_along_axis(candidates, best, axis=1)
+    else:
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        found = np.take_along_axis(candidates, np.argsort(-candidate_scores, axis=1)[:, :top_k], axis=1)
+    elapsed = (time.perf_counter() - start) * 1000 / len(queries)
+
+    recall = np.mean([len(set(f) & set(t)) / top_k for f, t in zip(found, truth)])
+    return recall, elapsed
+
+def collect_vectors(vector_store, limit: int) -> np.ndarray:
+    """Lê até `limit` vetores (float32) do vector store."""
+    blocks, total = [], 0
+    for _, block in vector_store.iter_vectors():
+        blocks.append(np.asarray(block, dtype=np.float32))
+        total += len(block)
+        if total >= limit:
+            break
+    if not blocks:
+        return np.zeros((0, settings.EMBEDDING_DIM), dtype=np.float32)
+    return np.concatenate(blocks)[:limit]
+
+def recall_memory_report(vectors: np.ndarray, dims: Iterable[int], methods: Iterable[str],
+                         n_queries: int = 200, top_k: int = 10, rescore: int = 100):
+    """Imprime recall@k x memória para cada dimensão e formato, comparado com a
+    busca exata nos vetores completos. As queries são vetores da coleção que ficam fora da base."""
+    rng = np.random.default_rng(0)
+    order = rng.permutation(len(vectors))
+    queries, base = vectors[order[:n_queries]], vectors[order[n_queries:]]
+    truth = exact_top_k(base, queries, top_k)
+    full_bytes = code_bytes(vectors.shape[1], "none")
+
+    print(f"Base: {len(base)} vectors, {len(queries)} queries, dim {vectors.shape[1]}, recall@{top_k}")
+    print(f"{'dim':>6} {'format':>8} {'bytes/vec':>10} {'reduction':>10} "
+          f"{'recall':>8} {'ms/q':>7} {'recall+rescore':>15} {'ms/q':>7}")
+    for dim in dims:
+        if dim > vectors.shape[1]:
+            continue
+        for method in methods:
+            n_bytes = code_bytes(dim, method)
+            recall, ms = evaluate(base, queries, truth, dim, method, top_k, rescore=0)
+            recall_rescored, ms_rescored = evaluate(base, queries, truth, dim, method, top_k, rescore)
+            print(f"{dim:>6} {method:>8} {n_bytes:>10} {full_bytes / n_bytes:>9.1f}x "
+                  f"{recall:>8.3f} {ms:>7.2f} {recall_rescored:>15.3f} {ms_rescored:>7.2f}")
+    print(f"Rescoring reads the {rescore} best candidates per query from the full vectors on disk.")
+
+def main():
+    """Relatório de recall x memória com os vetores já indexados."""
+    from vector_store import get_vector_store
+
+    parser = argparse.ArgumentParser(description="Recall vs memory report for reduced/quantized embeddings")
+    parser.add_argument("--limit", type=int, default=20000, help="Vectors sampled from the collection")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--rescore", type=int, default=100, help="Candidates rescored with full vectors")
+    parser.add_argument("--dims", type=int, nargs="+", default=[3072, 1536, 1024, 512, 256])
+    args = parser.parse_args()
+
+    vector_store = get_vector_store()
+    vector_store.connect()
+    vector_store.load()
+    vectors = collect_vectors(vector_store, args.limit + args.queries)
+    if len(vectors) <= args.queries + args.top_k:
+        print("Not enough vectors in the collection, run the vectorizer first")
+        return
+
+    recall_memory_report(vectors, args.dims, QUANTIZATIONS, args.queries, args.top_k, args.rescore)
+
+if __name__ == "__main__":
+    main()
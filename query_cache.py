@@ -0,0 +1,153 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Um chunk retornado pela busca é identificado por (file_name, page_number, chunk_id)
+SourceKey = Tuple[str, int, str]
+
+def normalize_query(query: str) -> str:
+    """Pergunta normalizada para a chave do cache (só espaços, o texto continua exato)."""
+    return " ".join(query.split())
+
+def source_keys(docs: List[Dict]) -> Tuple[SourceKey, ...]:
+    """Chunks retornados pela busca, na ordem."""
+    return tuple((doc["file_name"], doc["page_number"], doc["chunk_id"]) for doc in docs)
+
+class IndexVersion:
+    """Lê a versão do índice gravada pelo vectorizer no manifesto. O arquivo só é
+    relido quando muda no disco."""
+
+    def __init__(self, manifest_path: str):
+        self.path = Path(manifest_path)
+        self._stamp = None
+        self._version = None
+
+    def get(self) -> Optional[str]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp != self._stamp:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._version = json.load(f).get("version")
+            self._stamp = stamp
+        return self._version
+
+class QueryEmbeddingCache:
+    """LRU em memória dos embeddings das perguntas (match exato do texto)."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query: str) -> Optional[List[float]]:
+        key = normalize_query(query)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, query: str, embedding: List[float]):
+        with self._lock:
+            self._entries[normalize_query(query)] = embedding
+            self._entries.move_to_end(normalize_query(query))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+class CachedAnswer:
+    def __init__(self, query: str, embedding: np.ndarray, sources: Tuple[SourceKey, ...],
+                 answer: str, docs: List[Dict], version: Optional[str]):
+        self.query = query
+        self.embedding = embedding
+        self.sources = sources
+        self.answer = answer
+        self.docs = docs
+        self.version = version
+        self.created_at = time.time()
+
+class SemanticAnswerCache:
+    """Cache de respostas por similaridade da pergunta. Uma resposta guardada é reutilizada
+    quando o embedding da nova pergunta tem similaridade (IP) >= threshold com o da pergunta
+    original e a busca retornou exatamente os mesmos chunks. Entradas expiram depois de
+    ttl segundos, as menos usadas saem quando passa de max_entries, e tudo é descartado
+    quando a versão do índice muda (vectorizer rodou de novo)."""
+
+    def __init__(self, threshold: float = 0.95, ttl: float = 86400, max_entries: int = 1000,
+                 index_version: IndexVersion = None):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.index_version = index_version
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self._next_id = 0
+        self._version = index_version.get() if index_version else None
+        self._lock = threading.Lock()
+
+    def _check_version(self):
+        if self.index_version is None:
+            return
+        version = self.index_version.get()
+        if version != self._version:
+            if self._entries:
+                print(f"Index changed, dropping {len(self._entries)} cached answers")
+            self._entries.clear()
+            self._version = version
+
+    def _expire(self):
+        deadline = time.time() - self.ttl
+        for key in [key for key, entry in self._entries.items() if entry.created_at < deadline]:
+            del self._entries[key]
+
+    def lookup(self, embedding: Sequence[float], docs: List[Dict]) -> Optional[CachedAnswer]:
+        """Resposta guardada para uma pergunta parecida que usou os mesmos chunks, ou None."""
+        sources = source_keys(docs)
+        query_embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._check_version()
+            self._expire()
+            candidates = [(key, entry) for key, entry in self._entries.items() if entry.sources == sources]
+            if candidates:
+                scores = np.stack([entry.embedding for _, entry in candidates]) @ query_embedding
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    key, entry = candidates[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+            self.misses += 1
+            return None
+
+    def put(self, query: str, embedding: Sequence[float], docs: List[Dict], answer: str):
+        with self._lock:
+            self._check_version()
+            self._entries[self._next_id] = CachedAnswer(
+                query, np.asarray(embedding, dtype=np.float32), source_keys(docs), answer, docs, self._version
+            )
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+        }
@@ -0,0 +1,414 @@
+import argparse
+import asyncio
+import functools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+import chat
+import chat_vm
+from config import settings
+from llm_router import LLMRouter, create_backend_router
+from query_cache import IndexVersion, QueryEmbeddingCache, SemanticAnswerCache
+from retrieval import rerank_stats, search_many
+from streaming import GenerationStats
+from vector_store import VectorStore, get_vector_store
+
+# Serviço HTTP (asyncio) para várias perguntas em paralelo no mesmo processo.
+# Uso: poetry run serve --port 8000
+#      curl -X POST localhost:8000/query -d '{"query": "..."}'
+
+class Overloaded(Exception):
+    """Fila do LLM cheia, o request é recusado (503) em vez de esperar sem limite."""
+
+class MicroBatcher:
+    """Junta itens de requests concorrentes e processa tudo numa chamada só.
+    Um batch sai quando chega em max_batch_size itens ou depois de max_wait_ms
+    do primeiro item, o que vier antes."""
+
+    def __init__(self, batch_fn: Callable[[List], Awaitable[List]], max_batch_size: int, max_wait_ms: float):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.items = 0
+        self._pending: List[Tuple[object, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_batch_size], self._pending[self.max_batch_size:]
+            self.batches += 1
+            self.items += len(batch)
+            asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[object, asyncio.Future]]):
+        try:
+            results = await self.batch_fn([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.items / self.batches if self.batches else 0.0
+
+class LLMLimiter:
+    """Backpressure do LLM: no máximo max_concurrency gerações ao mesmo tempo e
+    no máximo max_waiting esperando; além disso o request é recusado."""
+
+    def __init__(self, max_concurrency: int, max_waiting: int):
+        self.max_waiting = max_waiting
+        self.waiting = 0
+        self.active = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def __aenter__(self):
+        if self._semaphore.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise Overloaded()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.active -= 1
+        self._semaphore.release()
+
+class RAGService:
+    """Mesmo caminho do chat (embedding -> busca -> prompt -> LLM), compartilhado por
+    todos os requests: embeddings e buscas de requests concorrentes vão em batches.
+    A geração passa pelo LLMRouter de cada backend (failover e hedge entre os endpoints),
+    numa thread do `llm_executor`."""
+
+    def __init__(self, vector_store: VectorStore, openai_client: AsyncOpenAI,
+                 llm_routers: Dict[str, LLMRouter], search_executor: ThreadPoolExecutor,
+                 llm_executor: ThreadPoolExecutor = None):
+        self.vector_store = vector_store
+        self.openai_client = openai_client
+        self.llm_routers = llm_routers
+        self.search_executor = search_executor
+        self.llm_executor = llm_executor or ThreadPoolExecutor(max_workers=settings.SERVICE_LLM_CONCURRENCY,
+                                                               thread_name_prefix="llm")
+        self.query_cache = QueryEmbeddingCache(settings.QUERY_EMBEDDING_CACHE_SIZE)
+        self.answer_cache = None
+        if settings.ANSWER_CACHE_ENABLED:
+            self.answer_cache = SemanticAnswerCache(
+                settings.ANSWER_CACHE_THRESHOLD, settings.ANSWER_CACHE_TTL_SECONDS,
+                settings.ANSWER_CACHE_MAX_ENTRIES, IndexVersion(settings.MANIFEST_PATH)
+            )
+        self.embed_batcher = MicroBatcher(self._embed_batch, settings.SERVICE_EMBED_BATCH_SIZE,
+                                          settings.SERVICE_BATCH_WAIT_MS)
+        self.search_batcher = MicroBatcher(self._search_batch, settings.SERVICE_SEARCH_BATCH_SIZE,
+                                           settings.SERVICE_BATCH_WAIT_MS)
+        self.llm_limiter = LLMLimiter(settings.SERVICE_LLM_CONCURRENCY, settings.SERVICE_LLM_MAX_WAITING)
+        self.requests = 0
+        self.in_flight = 0
+
+    async def _embed_batch(self, queries: List[str]) -> List[List[float]]:
+        unique = list(dict.fromkeys(queries))
+        response = await self.openai_client.embeddings.create(
+            input=unique, model=settings.EMBEDDING_MODEL, dimensions=settings.EMBEDDING_DIM
+        )
+        by_query = {unique[data.index]: data.embedding for data in response.data}
+        return [by_query[query] for query in queries]
+
+    async def _search_batch(self, items: List[Tuple[List[float], int]]) -> List[List[Dict]]:
+        top_k = max(k for _, k in items)
+        results = await asyncio.get_running_loop().run_in_executor(
+            self.search_executor, search_many, self.vector_store, [embedding for embedding, _ in items], top_k
+        )
+        return [docs[:k] for docs, (_, k) in zip(results, items)]
+
+    async def embed(self, query: str) -> List[float]:
+        embedding = self.query_cache.get(query)
+        if embedding is None:
+            embedding = await self.embed_batcher.submit(query)
+            self.query_cache.put(query, embedding)
+        return embedding
+
+    async def retrieve(self, query: str, top_k: int) -> Tuple[List[float], List[Dict], Dict]:
+        """Embedding + busca. Retorna (embedding, docs, tempos em ms)."""
+        start = time.perf_counter()
+        embedding = await self.embed(query)
+        embedded = time.perf_counter()
+        docs = await self.search_batcher.submit((embedding, top_k))
+        timings = {"embed_ms": (embedded - start) * 1000, "search_ms": (time.perf_counter() - embedded) * 1000}
+        return embedding, docs, timings
+
+    async def generate(self, query: str, docs: List[Dict], backend: str,
+                       on_text: Callable[[str], None] = None) -> Tuple[str, GenerationStats]:
+        module = chat_vm if backend == "vm" else chat
+        loop = asyncio.get_running_loop()
+        # Os pedaços de texto chegam na thread do router e são repassados para o event loop
+        emit = (lambda text: loop.call_soon_threadsafe(on_text, text)) if on_text is not None else None
+        async with self.llm_limiter:
+            content, reasoning, stats = await loop.run_in_executor(self.llm_executor, functools.partial(
+                self.llm_routers[backend].stream_chat_completion,
+                on_text=emit, on_reasoning=emit if backend == "vm" else None,
+                **module.generation_params(query, docs)
+            ))
+        # Como no chat_vm, servidores com reasoning parser podem responder só no reasoning_content
+        return content or reasoning, stats
+
+    async def answer(self, query: str, top_k: int, backend: str, generate: bool = True,
+                     on_sources: Callable[[List[Dict]], Awaitable[None]] = None,
+                     on_text: Callable[[str], None] = None) -> Dict:
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            embedding, docs, timings = await self.retrieve(query, top_k)
+            result = {"query": query, "sources": [public_source(doc) for doc in docs], "timings": timings}
+            if on_sources is not None:
+                await on_sources(result["sources"])
+            if not generate or not docs:
+                return result
+
+            cached = self.answer_cache.lookup(embedding, docs) if self.answer_cache is not None else None
+            if cached is not None:
+                if on_text is not None:
+                    on_text(cached.answer)
+                result.update({"answer": cached.answer, "cached": True})
+                return result
+
+            start = time.perf_counter()
+            answer, stats = await self.generate(query, docs, backend, on_text)
+            timings["generate_ms"] = (time.perf_counter() - start) * 1000
+            if self.answer_cache is not None and answer:
+                self.answer_cache.put(query, embedding, docs, answer)
+            result.update({"answer": answer, "cached": False, "generation": stats.to_dict()})
+            return result
+        finally:
+            self.in_flight -= 1
+
+    def stats(self) -> Dict:
+        return {
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "embed_batches": self.embed_batcher.batches,
+            "embed_mean_batch": self.embed_batcher.mean_batch_size,
+            "search_batches": self.search_batcher.batches,
+            "search_mean_batch": self.search_batcher.mean_batch_size,
+            "rerank_queries": rerank_stats["queries"],
+            "rerank_mean_ms": rerank_stats["total_ms"] / rerank_stats["queries"] if rerank_stats["queries"] else 0.0,
+            "llm_active": self.llm_limiter.active,
+            "llm_waiting": self.llm_limiter.waiting,
+            "llm_rejected": self.llm_limiter.rejected,
+            "llm_routers": {backend: router.stats() for backend, router in self.llm_routers.items()},
+            "query_cache": {"hits": self.query_cache.hits, "misses": self.query_cache.misses},
+            "answer_cache": self.answer_cache.stats() if self.answer_cache is not None else None,
+        }
+
+def public_source(doc: Dict) -> Dict:
+    """Fonte retornada para o cliente (sem o texto do chunk)."""
+    return {key: doc[key] for key in ("file_name", "page_number", "chunk_id", "score")}
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               500: "Internal Server Error", 503: "Service Unavailable"}
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict, bytes]]:
+    """Lê um request HTTP/1.1. Retorna None quando o cliente fechou a conexão."""
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return method, path.split("?", 1)[0], headers, body
+
+async def send_json(writer: asyncio.StreamWriter, status: int, body: Dict, headers: Dict = None):
+    payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+    head = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}", "Content-Type: application/json",
+            f"Content-Length: {len(payload)}"]
+    head += [f"{key}: {value}" for key, value in (headers or {}).items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + payload)
+    await writer.drain()
+
+class EventStream:
+    """Resposta em Server-Sent Events (chunked), para o texto ir chegando no cliente."""
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+
+    async def start(self):
+        self.writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                          b"Cache-Control: no-cache\r\nTransfer-Encoding: chunked\r\n\r\n")
+        await self.writer.drain()
+
+    def send(self, event: str, data):
+        payload = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+        self.writer.write(f"{len(payload):x}\r\n".encode("latin-1") + payload + b"\r\n")
+
+    async def close(self):
+        self.writer.write(b"0\r\n\r\n")
+        await self.writer.drain()
+
+async def handle_query(service: RAGService, writer: asyncio.StreamWriter, body: Dict):
+    query = str(body.get("query", "")).strip()
+    if not query:
+        await send_json(writer, 400, {"error": "missing 'query'"})
+        return
+    top_k = body.get("top_k", settings.RETRIEVAL_TOP_K)
+    if isinstance(top_k, bool) or not isinstance(top_k, int) or not 1 <= top_k <= settings.SERVICE_MAX_TOP_K:
+        await send_json(writer, 400, {"error": f"'top_k' must be an integer from 1 to {settings.SERVICE_MAX_TOP_K}"})
+        return
+    backend = body.get("backend", settings.SERVICE_CHAT_BACKEND)
+    if backend not in service.llm_routers:
+        await send_json(writer, 400, {"error": f"unknown backend '{backend}'"})
+        return
+    generate = bool(body.get("generate", True))
+
+    if not body.get("stream"):
+        try:
+            result = await service.answer(query, top_k, backend, generate)
+        except Overloaded:
+            await send_json(writer, 503, {"error": "LLM backend overloaded, retry later"}, {"Retry-After": "1"})
+            return
+        await send_json(writer, 200, result)
+        return
+
+    stream = EventStream(writer)
+    await stream.start()
+
+    async def on_sources(sources):
+        stream.send("sources", sources)
+        await writer.drain()
+
+    try:
+        result = await service.answer(query, top_k, backend, generate, on_sources=on_sources,
+                                      on_text=lambda text: stream.send("token", text))
+        result.pop("sources", None)
+        stream.send("done", result)
+    except Overloaded:
+        stream.send("error", {"error": "LLM backend overloaded, retry later"})
+    except ConnectionError:
+        raise
+    except Exception as e:
+        # Os headers 200 já foram enviados: o erro vai como evento e o stream é fechado normalmente
+        print(f"Error in streamed query: {e}")
+        stream.send("error", {"error": str(e)})
+    await stream.close()
+
+async def handle_connection(service: RAGService, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            request = await read_request(reader)
+            if request is None:
+                break
+            method, path, headers, raw_body = request
+            try:
+                if path == "/health" and method == "GET":
+                    await send_json(writer, 200, {"status": "ok", "vectors": service.vector_store.count()})
+                elif path == "/stats" and method == "GET":
+                    await send_json(writer, 200, service.stats())
+                elif path == "/query":
+                    if method != "POST":
+                        await send_json(writer, 405, {"error": "use POST"})
+                    else:
+                        body = json.loads(raw_body or b"{}")
+                        if isinstance(body, dict):
+                            await handle_query(service, writer, body)
+                        else:
+                            await send_json(writer, 400, {"error": "body must be a JSON object"})
+                else:
+                    await send_json(writer, 404, {"error": f"unknown path {path}"})
+            except json.JSONDecodeError:
+                await send_json(writer, 400, {"error": "invalid JSON body"})
+            except ConnectionError:
+                raise
+            except Exception as e:
+                print(f"Error handling {method} {path}: {e}")
+                await send_json(writer, 500, {"error": str(e)})
+            if headers.get("connection", "").lower() == "close":
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+def create_service(vector_store: VectorStore = None) -> RAGService:
+    """Clients compartilhados (pool de conexões HTTP) e o vector store já carregado."""
+    if vector_store is None:
+        vector_store = get_vector_store()
+        vector_store.connect()
+        if not vector_store.exists():
+            raise RuntimeError(f"collection '{settings.COLLECTION_NAME}' not found, run the vectorizer first")
+        vector_store.load()
+
+    def async_client(base_url: str) -> AsyncOpenAI:
+        return AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=base_url,
+            http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+                max_connections=settings.SERVICE_HTTP_CONNECTIONS,
+                max_keepalive_connections=settings.SERVICE_HTTP_CONNECTIONS,
+            )),
+        )
+
+    openai_client = async_client(settings.OPENAI_BASE_URL)
+    # Os mesmos routers do chat e do chat_vm (CHAT_ENDPOINTS / VM_ENDPOINTS)
+    llm_routers = {backend: router for backend in ("openai", "vm")
+                   if (router := create_backend_router(backend)) is not None}
+    search_executor = ThreadPoolExecutor(max_workers=settings.SERVICE_SEARCH_WORKERS, thread_name_prefix="search")
+    return RAGService(vector_store, openai_client, llm_routers, search_executor)
+
+async def serve(service: RAGService, host: str, port: int) -> asyncio.AbstractServer:
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(service, reader, writer), host, port
+    )
+    return server
+
+def main():
+    """Sobe o serviço HTTP de perguntas."""
+    parser = argparse.ArgumentParser(description="Concurrent RAG query service")
+    parser.add_argument("--host", default=settings.SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVICE_PORT)
+    args = parser.parse_args()
+
+    async def run():
+        service = create_service()
+        server = await serve(service, args.host, args.port)
+        print(f"✅ RAG service listening on http://{args.host}:{args.port} "
+              f"(backends: {', '.join(service.llm_routers)})")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print("Goodbye!")
+
+if __name__ == "__main__":
+    main()
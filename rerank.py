@@ -0,0 +1,55 @@
+from typing import Dict, List
+
+import numpy as np
+
+# Métodos de reranking depois da busca
+RERANK_METHODS = ["none", "mmr", "file_cap"]
+
+def mmr(query: np.ndarray, vectors: np.ndarray, top_k: int, lambda_mult: float = 0.5) -> List[int]:
+    """Maximal Marginal Relevance: escolhe um a um o candidato com maior
+    lambda * sim(query) - (1 - lambda) * max sim(já escolhidos). Retorna os índices escolhidos."""
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+    selected = [int(np.argmax(relevance))]
+    # Maior similaridade de cada candidato com os já escolhidos
+    redundancy = similarity[selected[0]].copy()
+    available = np.ones(len(vectors), dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < min(top_k, len(vectors)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return selected
+
+def file_cap(docs: List[Dict], top_k: int, max_per_file: int) -> List[int]:
+    """Os top_k mais relevantes com no máximo max_per_file chunks de cada arquivo
+    (se não completar top_k, preenche com os que sobraram)."""
+    selected, skipped, per_file = [], [], {}
+    for i, doc in enumerate(docs):
+        if per_file.get(doc["file_name"], 0) < max_per_file:
+            per_file[doc["file_name"]] = per_file.get(doc["file_name"], 0) + 1
+            selected.append(i)
+        else:
+            skipped.append(i)
+        if len(selected) == top_k:
+            return selected
+    return selected + skipped[:top_k - len(selected)]
+
+def rerank(query_embedding: List[float], docs: List[Dict], top_k: int, method: str,
+           lambda_mult: float = 0.5, max_per_file: int = 2) -> List[Dict]:
+    """Escolhe os top_k finais entre os candidatos (ordenados por score).
+    Para "mmr" os docs precisam do campo "vector"."""
+    if method == "none" or len(docs) <= top_k:
+        return docs[:top_k]
+    if method == "mmr":
+        query = np.asarray(query_embedding, dtype=np.float32)
+        vectors = np.stack([np.asarray(doc["vector"], dtype=np.float32) for doc in docs])
+        order = mmr(query, vectors, top_k, lambda_mult)
+    elif method == "file_cap":
+        order = file_cap(docs, top_k, max_per_file)
+    else:
+        raise ValueError(f"Unknown rerank method: {method}")
+    return [docs[i] for i in order]
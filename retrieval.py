@@ -0,0 +1,133 @@
+import fnmatch
+import shlex
+import time
+from typing import Dict, List, Optional
+
+from config import settings
+from dedup import load_references
+from index_manifest import IndexManifest
+from rerank import rerank
+from tracing import span
+from vector_store import SearchScope, VectorStore
+
+# Campos retornados pela busca para montar o contexto e as fontes
+SEARCH_FIELDS = ["text", "file_name", "page_number", "chunk_id"]
+
+# Tempo gasto no reranking (acumulado no processo)
+rerank_stats = {"queries": 0, "total_ms": 0.0}
+
+def hits_to_docs(hits: List[Dict]) -> List[Dict]:
+    """Converte os resultados do vector store nos documentos usados pelo chat."""
+    return [
+        {
+            "text": hit["text"],
+            "file_name": hit["file_name"],
+            "page_number": hit["page_number"],
+            "chunk_id": hit["chunk_id"],
+            "score": hit["score"]
+        }
+        for hit in hits
+    ]
+
+def attach_references(results: List[List[Dict]]) -> List[List[Dict]]:
+    """Com a deduplicação, cada documento ganha "references": as outras ocorrências
+    (file_name, page_number, chunk_id) do mesmo texto, que não foram guardadas de novo."""
+    if not settings.DEDUP_ENABLED:
+        return results
+    occurrences = [(doc["file_name"], doc["page_number"], doc["chunk_id"]) for docs in results for doc in docs]
+    references = load_references(settings.DEDUP_INDEX_PATH, occurrences)
+    for docs in results:
+        for doc in docs:
+            doc["references"] = references.get((doc["file_name"], doc["page_number"], doc["chunk_id"]), [])
+    return results
+
+def resolve_scope(patterns: List[str], indexed_files: List[str]) -> List[str]:
+    """Arquivos do escopo: nomes exatos ou padrões (ex: "contrato_*", "*2024*.pdf")
+    comparados com os arquivos indexados."""
+    file_names = set()
+    for pattern in patterns:
+        if any(char in pattern for char in "*?["):
+            file_names.update(fnmatch.filter(indexed_files, pattern))
+        else:
+            file_names.add(pattern)
+    return sorted(file_names)
+
+def scope_command(command: str, scope: SearchScope) -> SearchScope:
+    """Comandos do chat: "/scope <arquivos ou padrões>" e "/filter <expressão do Milvus>"
+    (ex: /filter page_number <= 10). "clear" remove a parte do escopo, sem argumento
+    mostra o escopo atual. Retorna o novo escopo."""
+    name, _, argument = command.partition(" ")
+    argument = argument.strip()
+    file_names, expr = scope.file_names, scope.expr
+    if name == "/scope":
+        if argument == "clear":
+            file_names = None
+        elif argument:
+            indexed_files = IndexManifest(settings.MANIFEST_PATH).load().indexed_files()
+            file_names = resolve_scope(shlex.split(argument), indexed_files)
+            if not file_names:
+                print(f"No indexed files match {argument}\n")
+                return scope
+    elif argument == "clear":
+        expr = None
+    elif argument:
+        if settings.VECTOR_STORE != "milvus":
+            print("Filter expressions are only supported by the Milvus vector store\n")
+            return scope
+        expr = argument
+
+    scope = SearchScope(file_names, expr)
+    print(f"Search scope: {scope}")
+    if scope.file_names is not None:
+        shown = scope.file_names[:10]
+        print("  " + ", ".join(shown) + (f" (+{len(scope.file_names) - len(shown)} more)"
+                                         if len(scope.file_names) > len(shown) else ""))
+    print()
+    return scope
+
+def timed_search(vector_store: VectorStore, query_embeddings: List[List[float]], top_k: int,
+                 output_fields: List[str], scope: Optional[SearchScope] = None,
+                 timings: Dict = None) -> List[List[Dict]]:
+    """vector_store.search com o tempo em timings["search_ms"]. Com um escopo (e
+    settings.SCOPE_COMPARE_UNSCOPED) a mesma busca sem escopo é medida em timings["unscoped_search_ms"]."""
+    scoped = scope is not None and scope.active
+    start = time.perf_counter()
+    with span("vector_store.search", items=len(query_embeddings), top_k=top_k, scoped=scoped):
+        results = vector_store.search(query_embeddings, top_k=top_k, output_fields=output_fields, scope=scope)
+    if timings is not None:
+        timings["search_ms"] = timings.get("search_ms", 0.0) + (time.perf_counter() - start) * 1000
+        if scoped and settings.SCOPE_COMPARE_UNSCOPED:
+            start = time.perf_counter()
+            vector_store.search(query_embeddings, top_k=top_k, output_fields=output_fields)
+            timings["unscoped_search_ms"] = (timings.get("unscoped_search_ms", 0.0)
+                                             + (time.perf_counter() - start) * 1000)
+    return results
+
+def search_many(vector_store: VectorStore, query_embeddings: List[List[float]], top_k: int,
+                timings: Dict = None, scope: Optional[SearchScope] = None) -> List[List[Dict]]:
+    """Busca de várias perguntas numa única chamada ao vector store (multi-vector search).
+    Com settings.RERANK_METHOD, busca RERANK_CANDIDATES candidatos e escolhe os top_k
+    mais diversos; o tempo do reranking vai em timings["rerank_ms"].
+    Com `scope`, só entre os chunks dos arquivos / do filtro do escopo."""
+    if not query_embeddings:
+        return []
+    method = settings.RERANK_METHOD
+    if method == "none":
+        results = timed_search(vector_store, query_embeddings, top_k, SEARCH_FIELDS, scope, timings)
+        return attach_references([hits_to_docs(hits) for hits in results])
+
+    output_fields = SEARCH_FIELDS + (["vector"] if method == "mmr" else [])
+    candidates = max(top_k, settings.RERANK_CANDIDATES)
+    results = timed_search(vector_store, query_embeddings, candidates, output_fields, scope, timings)
+    start = time.perf_counter()
+    with span("rerank", items=len(query_embeddings), method=method):
+        reranked = [
+            hits_to_docs(rerank(embedding, hits, top_k, method, settings.MMR_LAMBDA, settings.RERANK_MAX_PER_FILE))
+            for embedding, hits in zip(query_embeddings, results)
+        ]
+    elapsed = (time.perf_counter() - start) * 1000
+    rerank_stats["queries"] += len(query_embeddings)
+    rerank_stats["total_ms"] += elapsed
+    if timings is not None:
+        timings["rerank_ms"] = timings.get("rerank_ms", 0.0) + elapsed
+    return attach_references(reranked)
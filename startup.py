@@ -0,0 +1,76 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Início dos imports do chat (este módulo é importado antes dos outros módulos do projeto)
+IMPORT_START = time.perf_counter()
+
+# Um passo da inicialização: nome (para o relatório) e a função
+Step = Tuple[str, Callable[[], None]]
+
+class StartupTimer:
+    """Tempos da inicialização: quando o prompt ficou pronto e quanto levou cada passo."""
+
+    def __init__(self):
+        self.start = IMPORT_START
+        self.prompt_ready: Optional[float] = None
+        self.steps: Dict[str, float] = {}
+        self.waited = 0.0
+
+    def mark_prompt_ready(self):
+        self.prompt_ready = time.perf_counter() - self.start
+
+    def __str__(self) -> str:
+        parts = [f"prompt ready in {self.prompt_ready:.2f}s"] if self.prompt_ready is not None else []
+        parts += [f"{name} {seconds:.2f}s" for name, seconds in self.steps.items()]
+        parts.append(f"first query waited {self.waited:.2f}s")
+        return "Startup: " + ", ".join(parts)
+
+class BackgroundWarmup:
+    """Roda a inicialização pesada (imports, load da coleção, primeira request) em threads
+    enquanto o usuário digita. Cada tarefa é uma lista de passos em sequência; as tarefas
+    rodam em paralelo. wait() só bloqueia se algum passo ainda não terminou."""
+
+    def __init__(self, tasks: List[List[Step]], timer: StartupTimer = None):
+        self.tasks = tasks
+        self.timer = timer or StartupTimer()
+        self.error: Optional[Exception] = None
+        self.failed_step: Optional[str] = None
+        self.reported = False
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> "BackgroundWarmup":
+        for steps in self.tasks:
+            thread = threading.Thread(target=self._run, args=(steps,), daemon=True, name="warmup")
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def _run(self, steps: List[Step]):
+        for name, step in steps:
+            start = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                self.error, self.failed_step = e, name
+                return
+            self.timer.steps[name] = time.perf_counter() - start
+
+    @property
+    def done(self) -> bool:
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def wait(self) -> bool:
+        """Espera a inicialização terminar (na primeira vez imprime os tempos).
+        Retorna False se algum passo falhou."""
+        if not self.done:
+            pending = [name for name, _ in sum(self.tasks, []) if name not in self.timer.steps]
+            print(f"Waiting for startup ({', '.join(pending)})...")
+        start = time.perf_counter()
+        for thread in self._threads:
+            thread.join()
+        self.timer.waited += time.perf_counter() - start
+        if self.error is None and not self.reported:
+            self.reported = True
+            print(self.timer)
+        return self.error is None
@@ -0,0 +1,98 @@
+import time
+from typing import Callable, Optional, Tuple
+
+from utils import count_tokens
+
+class GenerationStats:
+    """Tempos de uma resposta gerada com streaming.
+    ttft = tempo até o primeiro token (o que o usuário sente como latência)."""
+
+    def __init__(self):
+        self.ttft: Optional[float] = None
+        self.total_seconds = 0.0
+        self.completion_tokens = 0
+        self.reasoning_tokens = 0
+        # Tokens do prompt e quantos deles vieram do prefix cache do servidor (None se ele não informa)
+        self.prompt_tokens: Optional[int] = None
+        self.cached_tokens: Optional[int] = None
+        # Endpoint que respondeu (quando passa pelo llm_router)
+        self.endpoint: Optional[str] = None
+
+    @property
+    def tokens_per_second(self) -> float:
+        """Velocidade de geração depois do primeiro token."""
+        generating = self.total_seconds - (self.ttft or 0.0)
+        tokens = self.completion_tokens + self.reasoning_tokens
+        return tokens / generating if generating > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "ttft": self.ttft,
+            "total_seconds": self.total_seconds,
+            "completion_tokens": self.completion_tokens,
+            "reasoning_tokens": self.reasoning_tokens,
+            "tokens_per_second": self.tokens_per_second,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "endpoint": self.endpoint,
+        }
+
+    def __str__(self) -> str:
+        ttft = f"{self.ttft:.2f}s" if self.ttft is not None else "-"
+        return (f"TTFT {ttft} | {self.completion_tokens + self.reasoning_tokens} tokens "
+                f"in {self.total_seconds:.1f}s | {self.tokens_per_second:.1f} tokens/s"
+                + (f" | {self.endpoint}" if self.endpoint else ""))
+
+def print_stream(text: str):
+    """Callback padrão: imprime o pedaço de texto sem quebrar linha."""
+    print(text, end="", flush=True)
+
+class StreamCollector:
+    """Junta os chunks de um stream do chat.completions, repassando cada pedaço
+    de texto para os callbacks e medindo os tempos."""
+
+    def __init__(self, on_text: Callable[[str], None] = None, on_reasoning: Callable[[str], None] = None):
+        self.on_text = on_text
+        self.on_reasoning = on_reasoning
+        self.stats = GenerationStats()
+        self.content, self.reasoning = [], []
+        self.usage = None
+        self.start = time.perf_counter()
+
+    def add(self, chunk):
+        if chunk.usage is not None:
+            self.usage = chunk.usage
+        if not chunk.choices:
+            return
+        delta = chunk.choices[0].delta
+        text = delta.content
+        reasoning_text = getattr(delta, "reasoning_content", None)
+        if (text or reasoning_text) and self.stats.ttft is None:
+            self.stats.ttft = time.perf_counter() - self.start
+        if reasoning_text:
+            self.reasoning.append(reasoning_text)
+            if self.on_reasoning is not None:
+                self.on_reasoning(reasoning_text)
+        if text:
+            self.content.append(text)
+            if self.on_text is not None:
+                self.on_text(text)
+
+    def finish(self, model: str) -> Tuple[str, str, GenerationStats]:
+        stats = self.stats
+        stats.total_seconds = time.perf_counter() - self.start
+        content, reasoning = "".join(self.content), "".join(self.reasoning)
+        if self.usage is not None:
+            stats.prompt_tokens = self.usage.prompt_tokens
+            # OpenAI, vLLM e SGLang informam o prefix cache em prompt_tokens_details.cached_tokens
+            details = getattr(self.usage, "prompt_tokens_details", None)
+            stats.cached_tokens = getattr(details, "cached_tokens", None) if details is not None else None
+        if self.usage is not None and self.usage.completion_tokens:
+            # O usage do servidor já inclui os tokens de reasoning
+            stats.completion_tokens = self.usage.completion_tokens
+        else:
+            stats.completion_tokens, stats.reasoning_tokens = [
+                n_tokens if text else 0
+                for text, n_tokens in zip([content, reasoning], count_tokens([content, reasoning], model))
+            ]
+        return content, reasoning, stats
@@ -0,0 +1,69 @@
+import pytest
+
+from config import settings
+from fake_openai import fake_embedding, start_fake_server
+from vector_store import NumpyVectorStore
+
+# Dimensão pequena: os testes rodam o caminho real com vetores do servidor fake
+DIM = 16
+
+WORDS = ["contrato", "prazo", "pagamento", "cláusula", "empresa", "relatório", "receita", "multa", "rescisão", "valor"]
+
+def chunk_text(i: int) -> str:
+    return " ".join(WORDS[(i * 7 + j * 3) % len(WORDS)] for j in range(40)) + f" trecho {i}"
+
+@pytest.fixture
+def fake_openai():
+    """Servidor fake (embeddings e chat) numa porta livre."""
+    server, url = start_fake_server(dim=DIM, answer_tokens=20)
+    yield server, url
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def rag_settings(tmp_path, monkeypatch, fake_openai):
+    """Settings apontando para o servidor fake e para arquivos em tmp_path (desfeito no fim do teste)."""
+    _, url = fake_openai
+    for name, value in {
+        "OPENAI_BASE_URL": url,
+        "OPENAI_API_KEY": "fake",
+        "CHAT_ENDPOINTS": [],
+        "VM_ENDPOINTS": [],
+        "LOCAL_VM_ADDRESS": url,
+        "VM_ADDRESS": None,
+        "EMBEDDING_DIM": DIM,
+        "VECTOR_STORE": "numpy",
+        "VECTOR_QUANTIZATION": "none",
+        "NUMPY_STORE_DIR": str(tmp_path / "vector_store"),
+        "NUMPY_IVF_NLIST": 0,
+        "INDEX_TUNING_PATH": str(tmp_path / "index_tuning.json"),
+        "MANIFEST_PATH": str(tmp_path / "index_manifest.json"),
+        "PDF_DIRECTORY": str(tmp_path / "pdfs"),
+        "DEDUP_ENABLED": False,
+        "CHUNK_STORE_ENABLED": False,
+        "EMBEDDING_CACHE_ENABLED": False,
+        "ANSWER_CACHE_ENABLED": False,
+        "RERANK_METHOD": "none",
+        "TRACING_ENABLED": False,
+        "LLM_HEDGE_ENABLED": False,
+    }.items():
+        monkeypatch.setattr(settings, name, value)
+    return fake_openai
+
+@pytest.fixture
+def vector_store(rag_settings):
+    """Vector store numpy com 30 chunks de 3 arquivos, com os embeddings do servidor fake."""
+    store = NumpyVectorStore()
+    store.setup()
+    store.insert([
+        {
+            "vector": fake_embedding(chunk_text(i), DIM).tolist(),
+            "text": chunk_text(i),
+            "file_name": f"doc_{i % 3}.pdf",
+            "page_number": i // 3 + 1,
+            "chunk_id": f"{i:032x}_0",
+        }
+        for i in range(30)
+    ])
+    store.flush()
+    return store
@@ -0,0 +1,82 @@
+import pytest
+
+import chat
+import chat_session
+import chat_vm
+from vector_store import SearchScope
+
+QUESTIONS = [
+    "qual o prazo do contrato?",
+    "e a multa por rescisão?",
+    "quem paga o relatório anual?",
+    "qual o valor da cláusula de pagamento?",
+]
+
+@pytest.fixture(params=[chat, chat_vm], ids=["openai", "vm"])
+def module(request, vector_store):
+    module = request.param
+    assert module.initialize_connections()
+    yield module
+    module.backend.llm_router.close()
+
+def test_message_order(module):
+    docs = module.backend.search_similar_documents(QUESTIONS[0], top_k=3)
+    passages = module.context_passages(docs)
+    history = [{"role": "user", "content": "Pergunta: antes?\n\nResposta:"}, {"role": "assistant", "content": "sim"}]
+
+    messages = module.build_messages(QUESTIONS[1], passages, history)
+
+    assert [message["role"] for message in messages] == ["system", "user", "assistant", "user"]
+    # Instruções fixas no system; o contexto vai com a pergunta na última mensagem
+    assert messages[0]["content"] == module.SYSTEM_PROMPT
+    assert messages[1:3] == history
+    assert docs[0]["text"] in messages[-1]["content"]
+    assert messages[-1]["content"].endswith(f"Pergunta: {QUESTIONS[1]}\n\nResposta:")
+    assert not any(doc["text"] in messages[0]["content"] for doc in docs)
+
+def test_prefix_grows_across_turns(module, capsys):
+    conversation = module.new_conversation()
+    turns = [chat_session.answer_question(module.backend, question, SearchScope(), conversation)
+             for question in QUESTIONS]
+
+    assert all(turn is not None for turn in turns)
+    # Primeira pergunta: nada no prefix cache do servidor fake (só o system repetiria)
+    assert turns[0]["cached_tokens"] == 0
+    # A cada turno o system + histórico (que é prefixo do prompt seguinte) cresce
+    cached = [turn["cached_tokens"] for turn in turns]
+    shared = [turn["shared_prefix_tokens"] for turn in turns]
+    assert cached[1:] == sorted(cached[1:]) and len(set(cached[1:])) == len(cached) - 1
+    assert shared[1:] == sorted(shared[1:]) and len(set(shared[1:])) == len(shared) - 1
+    assert cached[1] > 0 and shared[1] > 0
+    stats = conversation.stats()
+    assert stats["turns"] == len(QUESTIONS)
+    assert stats["cached_tokens"] == sum(cached)
+    assert "Sources:" in capsys.readouterr().out
+
+def test_chat_loop_commands(module, monkeypatch, capsys):
+    inputs = iter(["qual o prazo?", "/stats", "/reset", "", "quit"])
+    monkeypatch.setattr("builtins.input", lambda prompt="": next(inputs))
+
+    module.chat_loop()
+
+    out = capsys.readouterr().out
+    assert "Sources:" in out
+    assert "LLM router:" in out and "Conversation: 1 turns" in out
+    assert out.count("✅ New conversation") == 1
+    assert out.rstrip().endswith("Goodbye!")
+
+@pytest.mark.parametrize("module", [chat, chat_vm], ids=["openai", "vm"])
+def test_background_startup(module, vector_store, rag_settings, monkeypatch, capsys):
+    from config import settings
+    monkeypatch.setattr(settings, "STARTUP_WARMUP_EMBEDDING", True)
+    inputs = iter(["qual o prazo?", "quit"])
+    monkeypatch.setattr("builtins.input", lambda prompt="": next(inputs))
+
+    # Clients, warmup e load da coleção em background; a primeira pergunta espera por eles
+    module.main()
+    module.backend.llm_router.close()
+
+    assert "Sources:" in capsys.readouterr().out
+    server, _ = rag_settings
+    # warmup + pergunta (embeddings) e a resposta
+    assert server.RequestHandlerClass.state.requests >= 3
@@ -0,0 +1,85 @@
+import json
+
+import numpy as np
+import pytest
+
+from chunk_store import ChunkStore
+
+def rows(n: int, start: int = 0):
+    return [{"chunk_id": f"{i:032x}_0", "text": f"trecho {i} do contrato " * (i % 7 + 1)} for i in range(start, start + n)]
+
+def has_zstandard() -> bool:
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+@pytest.mark.parametrize("compression", ["zlib", "none",
+                                         pytest.param("zstd", marks=pytest.mark.skipif(not has_zstandard(),
+                                                                                       reason="zstandard not installed"))])
+def test_round_trip_and_reopen(tmp_path, compression):
+    store = ChunkStore(tmp_path / "store", compression, block_bytes=256).open()
+    store.put_many(rows(50))
+    store.put_many(rows(10, start=45))
+    expected = {row["chunk_id"]: row["text"] for row in rows(55)}
+    assert store.get_many(list(expected) + ["missing"]) == list(expected.values()) + [None]
+    store.close()
+
+    assert json.loads((tmp_path / "store" / "info.json").read_text())["compression"] == compression
+    reopened = ChunkStore(tmp_path / "store", compression).open()
+    assert reopened.count() == 55
+    assert reopened.get_many(list(expected)) == list(expected.values())
+
+def test_appends_merge_into_the_sorted_index(tmp_path):
+    store = ChunkStore(tmp_path / "store", "none").open()
+    reader = ChunkStore(tmp_path / "store", "none").open()
+    # Lotes com chaves intercaladas e chunks repetidos entre lotes
+    for start in (40, 0, 90, 20, 60):
+        store.put_many(rows(30, start=start))
+
+    assert store.count() == 120
+    keys = store._index["key"]
+    assert (store._sorted_keys == keys[store._order]).all()
+    assert (store._sorted_keys == np.sort(keys)).all()
+    expected = {row["chunk_id"]: row["text"] for row in rows(120)}
+    assert store.get_many(list(expected)) == list(expected.values())
+    # Outro processo acha as linhas novas relendo o índice
+    assert reader.get_many(list(expected)) == list(expected.values())
+    assert (reader._sorted_keys == store._sorted_keys).all()
+
+def test_codec_mismatch_fails(tmp_path):
+    ChunkStore(tmp_path / "store", "zlib").open().put_many(rows(5))
+    with pytest.raises(ValueError, match="compression 'zlib'"):
+        ChunkStore(tmp_path / "store", "none").open()
+
+def test_missing_header_with_data_fails(tmp_path):
+    ChunkStore(tmp_path / "store", "zlib").open().put_many(rows(5))
+    (tmp_path / "store" / "info.json").unlink()
+    with pytest.raises(ValueError, match="info.json"):
+        ChunkStore(tmp_path / "store", "zlib").open()
+
+def test_clear_rebuilds_with_configured_codec(tmp_path, monkeypatch):
+    from config import settings
+    ChunkStore(tmp_path / "store", "none").open().put_many(rows(5))
+    monkeypatch.setattr(settings, "CHUNK_STORE_COMPRESSION", "zlib")
+
+    store = ChunkStore(tmp_path / "store").clear()
+
+    assert store.count() == 0
+    assert json.loads((tmp_path / "store" / "info.json").read_text())["compression"] == "zlib"
+
+def test_zstd_without_zstandard_fails(tmp_path, monkeypatch):
+    import builtins
+    real_import = builtins.__import__
+
+    def fake_import(name, *args, **kwargs):
+        if name == "zstandard":
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "__import__", fake_import)
+    with pytest.raises(ImportError, match="zstandard"):
+        ChunkStore(tmp_path / "store", "zstd").open()
+    # Nada é criado com um codec que não dá para usar
+    assert not (tmp_path / "store").exists()
@@ -0,0 +1,91 @@
+import pytest
+
+import vectorizer
+from config import settings
+from dedup import load_references
+from utils import generate_doc_id
+
+WORDS = ["contrato", "prazo", "pagamento", "cláusula", "empresa", "relatório", "receita", "multa", "rescisão", "valor"]
+
+def paragraph(seed: int, n_words: int = 120) -> str:
+    return " ".join(WORDS[(seed * 7 + j * 3 + j // 10) % len(WORDS)] + str(j % 13) for j in range(n_words))
+
+HEADER = paragraph(1)
+OTHER = paragraph(2)
+
+def chunk(file_name: str, page_number: int, text: str) -> dict:
+    return {"text": text, "file_name": file_name, "page_number": page_number,
+            "chunk_id": f"{generate_doc_id(text)}_0"}
+
+def stored(store) -> dict:
+    """(file_name, page_number) -> texto de cada chunk no vector store numpy (sem os removidos)."""
+    return {(row["file_name"], row["page_number"]): row["text"]
+            for row, deleted in zip(store.metadata, store.deleted) if not deleted}
+
+@pytest.fixture
+def ingest(rag_settings, tmp_path, monkeypatch):
+    """vectorizer com a deduplicação ligada, num vector store numpy vazio."""
+    monkeypatch.setattr(settings, "DEDUP_ENABLED", True)
+    monkeypatch.setattr(settings, "DEDUP_INDEX_PATH", str(tmp_path / "dedup_index.sqlite"))
+    # O global volta para None no fim: os outros testes do vectorizer rodam sem deduplicação
+    monkeypatch.setattr(vectorizer, "deduplicator", None)
+    vectorizer.initialize_connections()
+    vectorizer.setup_collection(drop_existing=True)
+    yield vectorizer
+    vectorizer.deduplicator.close()
+
+def test_exact_duplicate_is_a_reference(ingest):
+    ingest.flush_chunks([chunk("a.pdf", 1, HEADER), chunk("a.pdf", 2, OTHER)])
+    # Mesmo texto depois da normalização (espaços e maiúsculas)
+    copy = chunk("b.pdf", 1, "  " + HEADER.upper().replace(" ", "\n"))
+
+    assert ingest.flush_chunks([copy, chunk("b.pdf", 2, paragraph(3))]) == 1
+
+    assert set(stored(ingest.vector_store)) == {("a.pdf", 1), ("a.pdf", 2), ("b.pdf", 2)}
+    stats = ingest.deduplicator.stats()
+    assert (stats["exact"], stats["near"], stats["references"]) == (1, 0, 1)
+    references = load_references(settings.DEDUP_INDEX_PATH, [("a.pdf", 1, chunk("a.pdf", 1, HEADER)["chunk_id"])])
+    assert list(references.values()) == [[("b.pdf", 1, copy["chunk_id"])]]
+
+def test_near_duplicate_is_a_reference(ingest):
+    ingest.flush_chunks([chunk("a.pdf", 1, HEADER)])
+    words = HEADER.split()
+    words[60] = "revisado"
+    near = " ".join(words)
+
+    assert ingest.flush_chunks([chunk("b.pdf", 1, near), chunk("b.pdf", 2, OTHER)]) == 1
+
+    assert set(stored(ingest.vector_store)) == {("a.pdf", 1), ("b.pdf", 2)}
+    stats = ingest.deduplicator.stats()
+    assert (stats["exact"], stats["near"]) == (0, 1)
+    similarity = ingest.deduplicator._conn.execute("SELECT similarity FROM refs").fetchone()[0]
+    assert settings.DEDUP_THRESHOLD <= similarity < 1.0
+
+def test_removal_promotes_a_reference(ingest):
+    for file_name in ("a.pdf", "b.pdf", "c.pdf"):
+        ingest.flush_chunks([chunk(file_name, 1, HEADER), chunk(file_name, 2, paragraph(ord(file_name[0])))])
+    assert set(stored(ingest.vector_store)) == {("a.pdf", 1), ("a.pdf", 2), ("b.pdf", 2), ("c.pdf", 2)}
+
+    # O arquivo do chunk guardado sai: a primeira referência (b.pdf) é inserida no lugar dele
+    ingest.delete_chunks("a.pdf")
+
+    store = ingest.vector_store
+    assert set(stored(store)) == {("b.pdf", 1), ("b.pdf", 2), ("c.pdf", 2)}
+    assert stored(store)[("b.pdf", 1)] == HEADER
+    assert store.count() == 3
+    # A outra referência continua valendo, agora para o chunk promovido
+    promoted = ("b.pdf", 1, chunk("b.pdf", 1, HEADER)["chunk_id"])
+    assert list(load_references(settings.DEDUP_INDEX_PATH, [promoted]).values()) == [[("c.pdf", 1, promoted[2])]]
+    # O promovido é achado pela busca com o embedding do texto
+    results = store.search([ingest.generate_embeddings([HEADER])[0]], 1, ["file_name", "page_number"])
+    assert (results[0][0]["file_name"], results[0][0]["page_number"]) == ("b.pdf", 1)
+
+    # Só o chunk (chunk_id, page_number) de b.pdf: c.pdf é promovido
+    ingest.delete_chunks("b.pdf", [(promoted[2], 1)])
+    assert set(stored(store)) == {("b.pdf", 2), ("c.pdf", 1), ("c.pdf", 2)}
+
+    # Sem referências o chunk sai do índice
+    ingest.delete_chunks("c.pdf")
+    assert set(stored(store)) == {("b.pdf", 2)}
+    assert ingest.deduplicator.stats()["unique_chunks"] == 1
+    assert ingest.deduplicator.stats()["references"] == 0
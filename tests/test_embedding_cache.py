@@ -0,0 +1,30 @@
+from embedding_cache import EmbeddingCache
+
+def stored_bytes(cache: EmbeddingCache) -> int:
+    return cache._conn.execute("SELECT COALESCE(SUM(length(vector)), 0) FROM embeddings").fetchone()[0]
+
+def test_running_total_tracks_inserts_replaces_and_evictions(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    # 4 bytes por float: cabem 10 vetores de 8 dimensões
+    cache = EmbeddingCache(path, max_bytes=10 * 8 * 4)
+
+    cache.put_many([f"texto {i}" for i in range(6)], [[float(i)] * 8 for i in range(6)], "model")
+    assert cache._total_bytes == stored_bytes(cache) == 6 * 8 * 4
+
+    # Substituídos (mesmo texto e modelo, outra dimensão) e repetidos no lote não contam duas vezes
+    cache.put_many(["texto 0", "texto 1", "texto 1"], [[0.0] * 4, [1.0] * 4, [1.0] * 4], "model")
+    assert cache._total_bytes == stored_bytes(cache) == 4 * 8 * 4 + 2 * 4 * 4
+    # Outro modelo é outra entrada
+    cache.put_many(["texto 0"], [[0.0] * 8], "other")
+    assert cache._total_bytes == stored_bytes(cache)
+
+    cache.put_many([f"novo {i}" for i in range(6)], [[float(i)] * 8 for i in range(6)], "model")
+    assert cache.evictions > 0
+    assert cache._total_bytes == stored_bytes(cache) <= cache.max_bytes
+    assert cache.get_many([f"novo {i}" for i in range(6)], "model").keys() == {f"novo {i}" for i in range(6)}
+    cache.close()
+
+    # Ao reabrir o total vem do disco
+    reopened = EmbeddingCache(path, max_bytes=10 * 8 * 4)
+    assert reopened._total_bytes == stored_bytes(reopened)
+    assert reopened.stats()["size_mb"] * 1024 * 1024 == reopened._total_bytes
@@ -0,0 +1,56 @@
+import numpy as np
+import openai
+import pytest
+
+from embedding_scheduler import EmbeddingScheduler
+from fake_openai import fake_embedding, start_fake_server
+
+DIM = 8
+
+@pytest.fixture
+def fake_server():
+    server, url = start_fake_server(rpm=1200, burst=4, dim=DIM)
+    yield server, url
+    server.shutdown()
+
+def make_scheduler(url: str, max_concurrency: int = 8) -> EmbeddingScheduler:
+    client = openai.OpenAI(api_key="fake", base_url=url)
+    # Um texto por request, para cada texto passar pelo limitador; com a quota bem pequena
+    # do servidor um request pode levar vários 429 seguidos
+    return EmbeddingScheduler(client, "text-embedding-3-large", max_concurrency=max_concurrency,
+                              max_batch_items=1, max_retries=50, dimensions=DIM)
+
+def record_limits(scheduler: EmbeddingScheduler) -> list:
+    limits = []
+    release = scheduler.limiter.release
+
+    def recording_release(*args, **kwargs):
+        release(*args, **kwargs)
+        limits.append(scheduler.limiter.limit)
+
+    scheduler.limiter.release = recording_release
+    return limits
+
+def test_concurrency_drops_on_429_and_recovers(fake_server):
+    server, url = fake_server
+    state = server.RequestHandlerClass.state
+    scheduler = make_scheduler(url)
+    limits = record_limits(scheduler)
+    texts = [f"texto {i}" for i in range(40)]
+
+    # Fase 1: o bucket do servidor tem 4 requests, o resto recebe 429 até reabastecer
+    embeddings = scheduler.embed(texts)
+    assert scheduler.rate_limited > 0
+    assert min(limits) < scheduler.limiter.max_concurrency
+    for text, embedding in zip(texts, embeddings):
+        np.testing.assert_allclose(embedding, fake_embedding(text, DIM), rtol=1e-6)
+
+    # Fase 2: sem limite no servidor o paralelismo volta ao máximo
+    state.rpm = 0
+    scheduler.embed([f"outro {i}" for i in range(100)])
+    assert scheduler.limiter.limit == scheduler.limiter.max_concurrency
+
+    # Cada tentativa (inclusive as que receberam 429) é contada uma vez
+    assert scheduler.requests == state.requests
+    assert scheduler.rate_limited == state.rate_limited
+    scheduler.shutdown()
@@ -0,0 +1,84 @@
+import time
+
+import openai
+import pytest
+
+from fake_openai import start_fake_server
+from llm_router import Endpoint, LLMRouter
+
+MESSAGES = [{"role": "user", "content": "qual o prazo do contrato?"}]
+
+@pytest.fixture
+def fake_servers():
+    """Inicia servidores fake com as opções dadas e fecha todos no fim do teste."""
+    servers = []
+
+    def start(**options):
+        server, url = start_fake_server(**options)
+        servers.append(server)
+        return server.RequestHandlerClass.state, url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def make_router(endpoints, **options) -> LLMRouter:
+    # Sem health check em background: só os requests mudam o estado dos endpoints
+    return LLMRouter([Endpoint(name, url, api_key="fake", model="fake") for name, url in endpoints],
+                     health_interval=0, **options)
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+def test_failover_to_next_endpoint(fake_servers):
+    broken, broken_url = fake_servers(error_rate=1.0)
+    good, good_url = fake_servers(answer_tokens=10)
+    # Sem amostras de TTFT os dois empatam e o primeiro da lista (o quebrado) é tentado antes
+    router = make_router([("broken", broken_url), ("good", good_url)])
+
+    content, _, stats = router.stream_chat_completion(messages=MESSAGES)
+
+    assert content
+    assert stats.endpoint == "good"
+    assert broken.errors == 1 and good.requests == 1
+    router_stats = router.stats()
+    assert router_stats["failovers"] == 1
+    assert router_stats["endpoints"]["broken"]["errors"] == 1
+    assert router_stats["endpoints"]["good"]["errors"] == 0
+    assert all(endpoint.in_flight == 0 for endpoint in router.endpoints)
+
+def test_all_endpoints_failing_raises(fake_servers):
+    _, first_url = fake_servers(error_rate=1.0)
+    _, second_url = fake_servers(error_rate=1.0)
+    router = make_router([("first", first_url), ("second", second_url)])
+
+    with pytest.raises(openai.InternalServerError):
+        router.stream_chat_completion(messages=MESSAGES)
+    assert router.stats()["failovers"] == 1
+    assert all(endpoint.in_flight == 0 for endpoint in router.endpoints)
+
+def test_hedge_won_by_faster_endpoint_and_loser_closed(fake_servers):
+    # O lento demora 1.5 s para começar e depois gera devagar; sem amostras o hedge sai depois de 1 s
+    slow, slow_url = fake_servers(latency=1.5, tokens_per_second=50, answer_tokens=200)
+    fast, fast_url = fake_servers(answer_tokens=10)
+    router = make_router([("slow", slow_url), ("fast", fast_url)], hedge=True, hedge_min_delay=0.05)
+
+    content, _, stats = router.stream_chat_completion(messages=MESSAGES)
+
+    assert content
+    assert stats.endpoint == "fast"
+    router_stats = router.stats()
+    assert router_stats["hedges_sent"] == 1
+    assert router_stats["endpoints"]["fast"]["hedges_won"] == 1
+    assert router_stats["endpoints"]["slow"]["hedges_won"] == 0
+    # O request que perdeu fecha o stream quando chega o primeiro token dele: o servidor lento
+    # vê a conexão fechada no meio da resposta e o endpoint volta a ter nada em andamento
+    assert wait_for(lambda: slow.cancelled == 1)
+    assert wait_for(lambda: all(endpoint.in_flight == 0 for endpoint in router.endpoints))
+    assert fast.cancelled == 0
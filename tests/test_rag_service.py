@@ -0,0 +1,118 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from config import settings
+from fake_openai import start_fake_server
+from rag_service import create_service, serve
+
+async def run_service(vector_store, requests):
+    """Sobe o serviço numa porta livre e roda `requests(client)` contra ele."""
+    service = create_service(vector_store)
+    server = await serve(service, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=30) as client:
+            return await requests(client)
+    finally:
+        server.close()
+        await server.wait_closed()
+
+async def read_events(response: httpx.Response):
+    events = []
+    async for block in _blocks(response):
+        event = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((event["event"], json.loads(event["data"])))
+    return events
+
+async def _blocks(response: httpx.Response):
+    buffer = ""
+    async for text in response.aiter_text():
+        buffer += text
+        while "\n\n" in buffer:
+            block, buffer = buffer.split("\n\n", 1)
+            yield block
+
+def test_query(vector_store):
+    async def requests(client):
+        return await client.post("/query", json={"query": "qual o prazo do contrato?", "top_k": 4})
+
+    response = asyncio.run(run_service(vector_store, requests))
+    assert response.status_code == 200
+    result = response.json()
+    assert len(result["sources"]) == 4
+    assert result["answer"]
+    assert result["generation"]["endpoint"] == "openai"
+
+def test_query_stream(vector_store):
+    async def requests(client):
+        async with client.stream("POST", "/query", json={"query": "qual o prazo?", "stream": True}) as response:
+            return response.status_code, await read_events(response)
+
+    status, events = asyncio.run(run_service(vector_store, requests))
+    assert status == 200
+    names = [name for name, _ in events]
+    assert names[0] == "sources" and names[-1] == "done"
+    assert names.count("token") > 0
+    assert "".join(data for name, data in events if name == "token") == events[-1][1]["answer"]
+
+def test_stream_error_is_an_event(vector_store, monkeypatch):
+    # O LLM (outro servidor fake) só responde 500; os embeddings continuam funcionando
+    broken, broken_url = start_fake_server(error_rate=1.0)
+    monkeypatch.setattr(settings, "CHAT_ENDPOINTS", [{"name": "broken", "base_url": broken_url}])
+
+    async def requests(client):
+        async with client.stream("POST", "/query", json={"query": "qual o prazo?", "stream": True}) as response:
+            events = await read_events(response)
+        # A conexão continua válida depois do erro (o stream foi fechado direito)
+        health = await client.get("/health")
+        return response.status_code, events, health.status_code
+
+    try:
+        status, events, health_status = asyncio.run(run_service(vector_store, requests))
+    finally:
+        broken.shutdown()
+        broken.server_close()
+    assert status == 200
+    assert [name for name, _ in events] == ["sources", "error"]
+    assert health_status == 200
+
+@pytest.mark.parametrize("top_k", ["abc", 0, -1, 2.5, True, 10 ** 6])
+def test_invalid_top_k(vector_store, top_k):
+    async def requests(client):
+        return await client.post("/query", json={"query": "qual o prazo?", "top_k": top_k})
+
+    response = asyncio.run(run_service(vector_store, requests))
+    assert response.status_code == 400
+
+@pytest.mark.parametrize("body", [b'["qual o prazo?"]', b'"qual o prazo?"', b"3", b"null"])
+def test_body_not_an_object(vector_store, body):
+    async def requests(client):
+        response = await client.post("/query", content=body, headers={"Content-Type": "application/json"})
+        # A conexão continua servindo depois do erro
+        return response, await client.get("/health")
+
+    response, health = asyncio.run(run_service(vector_store, requests))
+    assert response.status_code == 400
+    assert response.json() == {"error": "body must be a JSON object"}
+    assert health.status_code == 200
+
+def test_overload_returns_503(vector_store, rag_settings, monkeypatch):
+    server, _ = rag_settings
+    # Uma geração por vez e nenhuma na fila; a resposta do fake leva ~0.4 s
+    server.RequestHandlerClass.state.tokens_per_second = 50
+    monkeypatch.setattr(settings, "SERVICE_LLM_CONCURRENCY", 1)
+    monkeypatch.setattr(settings, "SERVICE_LLM_MAX_WAITING", 0)
+
+    async def requests(client):
+        return await asyncio.gather(*[
+            client.post("/query", json={"query": f"pergunta {i}?"}) for i in range(4)
+        ])
+
+    responses = asyncio.run(run_service(vector_store, requests))
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses[0] == 200
+    assert 503 in statuses
+    assert all(response.headers.get("retry-after") == "1" for response in responses if response.status_code == 503)
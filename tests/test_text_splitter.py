@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+langchain_splitters = pytest.importorskip("langchain_text_splitters")
+
+from benchmark import generate_pdfs
+from text_splitter import get_splitter, token_length_function
+from utils import split_texts
+
+CHUNK_SIZE = 600
+CHUNK_OVERLAP = 150
+
+def reference(chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP, length_function=len):
+    """O splitter do langchain que o RecursiveTextSplitter substitui (mesmos separadores)."""
+    return langchain_splitters.RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=length_function,
+    )
+
+@pytest.fixture(scope="module")
+def pdf_pages(tmp_path_factory):
+    """Texto das páginas de PDFs sintéticos, extraído como no vectorizer."""
+    import fitz
+    directory = tmp_path_factory.mktemp("pdfs")
+    generate_pdfs(directory, n_pdfs=2, pages_per_pdf=5, seed=7)
+    pages = []
+    for path in sorted(directory.glob("*.pdf")):
+        with fitz.open(path) as doc:
+            pages.extend(page.get_text() for page in doc)
+    return pages
+
+def random_text(rng: random.Random) -> str:
+    words = ["contrato", "prazo", "pagamento", "a", "de", "cláusula", "x" * rng.randint(1, 80), "relatório"]
+    separators = [" ", " ", " ", "\n", "\n\n", "\n\n\n\n", "  "]
+    return "".join(rng.choice(words) + rng.choice(separators) for _ in range(rng.randint(0, 400)))
+
+EDGE_CASES = {
+    "empty": "",
+    "only_spaces": "   \n\n  ",
+    "word_longer_than_chunk": "a" * 1500,
+    "long_word_between_words": "início " + "b" * 1300 + " fim do texto",
+    "paragraph_runs": "primeiro parágrafo\n\n\n\n\n\nsegundo\n\n\n\nterceiro " * 40,
+    "lines_only": "\n".join(f"linha {i} com algum texto" for i in range(200)),
+    "no_separators_at_all": "".join(chr(ord("a") + i % 26) for i in range(2000)),
+}
+
+def test_pdf_pages_match_langchain(pdf_pages):
+    splitter = get_splitter(CHUNK_SIZE, CHUNK_OVERLAP)
+    expected = reference()
+    assert pdf_pages
+    for text in pdf_pages:
+        assert splitter.split_text(text) == expected.split_text(text)
+
+@pytest.mark.parametrize("name", EDGE_CASES)
+def test_edge_cases_match_langchain(name):
+    text = EDGE_CASES[name]
+    assert get_splitter(CHUNK_SIZE, CHUNK_OVERLAP).split_text(text) == reference().split_text(text)
+
+@pytest.mark.parametrize("chunk_size, chunk_overlap", [(600, 150), (100, 0), (50, 50), (10, 3)])
+def test_random_texts_match_langchain(chunk_size, chunk_overlap):
+    rng = random.Random(chunk_size * 1000 + chunk_overlap)
+    splitter = get_splitter(chunk_size, chunk_overlap)
+    expected = reference(chunk_size, chunk_overlap)
+    for _ in range(50):
+        text = random_text(rng)
+        assert splitter.split_text(text) == expected.split_text(text)
+
+def test_token_mode_matches_langchain(pdf_pages):
+    # Sem rede o tiktoken não baixa o vocabulário e a contagem vira a estimativa por caracteres;
+    # nos dois casos o langchain recebe a mesma função de tamanho
+    splitter = get_splitter(150, 40, "text-embedding-3-large")
+    expected = reference(150, 40, token_length_function("text-embedding-3-large"))
+    rng = random.Random(0)
+    for text in pdf_pages + list(EDGE_CASES.values()) + [random_text(rng) for _ in range(50)]:
+        assert splitter.split_text(text) == expected.split_text(text)
+
+def test_split_texts_is_split_text_per_text(pdf_pages):
+    texts = pdf_pages + list(EDGE_CASES.values())
+    splitter = get_splitter(CHUNK_SIZE, CHUNK_OVERLAP)
+    assert splitter.split_texts(texts) == [splitter.split_text(text) for text in texts]
+    assert split_texts(texts) == [reference().split_text(text) for text in texts]
+    assert split_texts([]) == []
+
+def test_invalid_sizes():
+    with pytest.raises(ValueError):
+        get_splitter(0, 0)
+    with pytest.raises(ValueError):
+        get_splitter(100, 150)
@@ -0,0 +1,101 @@
+import shutil
+import sys
+from collections import Counter
+
+import pytest
+
+import vectorizer
+from benchmark import generate_pdfs
+from config import settings
+from index_manifest import IndexManifest
+
+def indexed_files(store) -> Counter:
+    """Chunks no vector store numpy por arquivo (sem os removidos)."""
+    return Counter(row["file_name"] for row, deleted in zip(store.metadata, store.deleted) if not deleted)
+
+@pytest.fixture
+def pdfs(rag_settings, tmp_path):
+    """Três PDFs sintéticos no PDF_DIRECTORY e outros dois (outro conteúdo) para trocar/adicionar."""
+    generate_pdfs(tmp_path / "pdfs", n_pdfs=3, pages_per_pdf=2, seed=1)
+    generate_pdfs(tmp_path / "other", n_pdfs=2, pages_per_pdf=2, seed=2)
+    return tmp_path / "pdfs", tmp_path / "other"
+
+@pytest.mark.parametrize("pipeline", [False, True], ids=["serial", "pipeline"])
+def test_incremental_add_change_remove(pdfs, monkeypatch, pipeline):
+    pdf_dir, other = pdfs
+    monkeypatch.setattr(settings, "PIPELINE_ENABLED", pipeline)
+    monkeypatch.setattr(settings, "PIPELINE_EXTRACT_WORKERS", 1)
+    vectorizer.initialize_connections()
+    vectorizer.setup_collection(drop_existing=True)
+    manifest = IndexManifest(settings.MANIFEST_PATH).load()
+
+    vectorizer.process_all_pdfs(manifest)
+    first = indexed_files(vectorizer.vector_store)
+    assert set(first) == {"synthetic_000.pdf", "synthetic_001.pdf", "synthetic_002.pdf"}
+    assert sum(first.values()) == vectorizer.vector_store.count()
+
+    # Sem mudanças nada é inserido de novo
+    assert vectorizer.process_all_pdfs(manifest) == 0
+    assert indexed_files(vectorizer.vector_store) == first
+
+    # Um PDF muda, um é removido e um novo aparece
+    shutil.copy(other / "synthetic_000.pdf", pdf_dir / "synthetic_001.pdf")
+    (pdf_dir / "synthetic_002.pdf").unlink()
+    shutil.copy(other / "synthetic_001.pdf", pdf_dir / "synthetic_003.pdf")
+    inserted = vectorizer.process_all_pdfs(manifest)
+
+    store = vectorizer.vector_store
+    current = indexed_files(store)
+    assert set(current) == {"synthetic_000.pdf", "synthetic_001.pdf", "synthetic_003.pdf"}
+    assert current["synthetic_000.pdf"] == first["synthetic_000.pdf"]
+    assert inserted == current["synthetic_001.pdf"] + current["synthetic_003.pdf"]
+    # Os chunks no store são exatamente os do manifesto (os antigos do PDF alterado saíram)
+    reloaded = IndexManifest(settings.MANIFEST_PATH).load()
+    for file_name in current:
+        keys = {(row["chunk_id"], row["page_number"])
+                for row, deleted in zip(store.metadata, store.deleted)
+                if not deleted and row["file_name"] == file_name}
+        assert keys == reloaded.get_chunk_keys(file_name)
+    assert sorted(reloaded.indexed_files()) == sorted(current)
+
+def run_main(monkeypatch, *args):
+    # main() sobrescreve estes settings com os argumentos; o monkeypatch desfaz no fim do teste
+    for name in ("PIPELINE_ENABLED", "PIPELINE_EXTRACT_WORKERS", "PIPELINE_EMBED_WORKERS", "INSERT_BATCH_SIZE"):
+        monkeypatch.setattr(settings, name, getattr(settings, name))
+    monkeypatch.setattr(sys, "argv", ["vectorizer", "--serial", *args])
+    vectorizer.main()
+
+def test_changed_settings_force_full_rebuild(pdfs, monkeypatch, capsys):
+    run_main(monkeypatch)
+    manifest = IndexManifest(settings.MANIFEST_PATH).load()
+    assert manifest.settings == vectorizer.index_settings()
+    chunks = vectorizer.vector_store.count()
+
+    run_main(monkeypatch)
+    assert "Incremental re-index" in capsys.readouterr().out
+
+    # Chunks menores: os antigos não podem continuar no índice junto com os novos
+    monkeypatch.setattr(settings, "CHUNK_SIZE", settings.CHUNK_SIZE // 2)
+    monkeypatch.setattr(settings, "CHUNK_OVERLAP", settings.CHUNK_OVERLAP // 2)
+    run_main(monkeypatch)
+
+    out = capsys.readouterr().out
+    assert "Index settings changed since the last run (CHUNK_SIZE, CHUNK_OVERLAP)" in out
+    assert "Full re-index" in out
+    store = vectorizer.vector_store
+    assert store.count() > chunks
+    manifest = IndexManifest(settings.MANIFEST_PATH).load()
+    assert manifest.settings["CHUNK_SIZE"] == settings.CHUNK_SIZE
+    assert sum(len(manifest.get_chunk_keys(file_name)) for file_name in manifest.indexed_files()) == store.count()
+
+def test_manifest_without_settings_forces_full_rebuild(pdfs, monkeypatch, capsys):
+    run_main(monkeypatch)
+    # Manifesto de uma versão anterior, sem os parâmetros do índice
+    manifest = IndexManifest(settings.MANIFEST_PATH).load()
+    manifest.settings = {}
+    manifest.save()
+
+    run_main(monkeypatch)
+
+    assert "Index settings changed since the last run" in capsys.readouterr().out
+    assert IndexManifest(settings.MANIFEST_PATH).load().settings == vectorizer.index_settings()
@@ -0,0 +1,107 @@
+import functools
+from typing import Callable, List, Optional
+
+# Mesmos separadores do split_text original (parágrafo, linha, palavra, caractere)
+DEFAULT_SEPARATORS = ["\n\n", "\n", " ", ""]
+
+class RecursiveTextSplitter:
+    """Splitter recursivo com a mesma semântica do RecursiveCharacterTextSplitter do
+    langchain (separador no início do pedaço, strip dos chunks, overlap pelo fim do
+    chunk anterior), gerando os mesmos chunks, mas sem regex e sem o import do langchain.
+    `length_function` mede o tamanho (caracteres por padrão, ou tokens)."""
+
+    def __init__(self, chunk_size: int, chunk_overlap: int, separators: List[str] = None,
+                 length_function: Callable[[str], int] = len):
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size must be > 0, got {chunk_size}")
+        if not 0 <= chunk_overlap <= chunk_size:
+            raise ValueError(f"chunk_overlap must be between 0 and chunk_size, got {chunk_overlap}")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = separators or DEFAULT_SEPARATORS
+        self.length_function = length_function
+
+    @staticmethod
+    def _split_keeping_separator(text: str, separator: str) -> List[str]:
+        """Divide pelo separador, que fica no início de cada pedaço (menos o primeiro)."""
+        if not separator:
+            return list(text)
+        first, *rest = text.split(separator)
+        return [piece for piece in [first, *(separator + part for part in rest)] if piece]
+
+    def _merge(self, splits: List[str]) -> List[str]:
+        """Junta os pedaços em chunks de até chunk_size, repetindo o fim do chunk
+        anterior (até chunk_overlap) no início do próximo."""
+        # Os pedaços são unidos com "", mas, como no langchain, cada junção soma length_function("")
+        # (0 com len e com o tiktoken, 1 com a estimativa por caracteres)
+        join = self.length_function("")
+        chunks = []
+        current: List[str] = []
+        lengths: List[int] = []
+        total = 0
+        for piece in splits:
+            length = self.length_function(piece)
+            if current and total + length + join > self.chunk_size:
+                chunk = "".join(current).strip()
+                if chunk:
+                    chunks.append(chunk)
+                while total > self.chunk_overlap or (
+                        total + length + (join if current else 0) > self.chunk_size and total > 0):
+                    total -= lengths.pop(0) + (join if len(current) > 1 else 0)
+                    current.pop(0)
+            current.append(piece)
+            lengths.append(length)
+            total += length + (join if len(current) > 1 else 0)
+        chunk = "".join(current).strip()
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def _split(self, text: str, separators: List[str]) -> List[str]:
+        # Primeiro separador que aparece no texto; os seguintes ficam para os pedaços grandes
+        separator, remaining = separators[-1], []
+        for i, candidate in enumerate(separators):
+            if candidate == "":
+                separator = candidate
+                break
+            if candidate in text:
+                separator, remaining = candidate, separators[i + 1:]
+                break
+
+        chunks, small = [], []
+        for piece in self._split_keeping_separator(text, separator):
+            if self.length_function(piece) < self.chunk_size:
+                small.append(piece)
+                continue
+            if small:
+                chunks.extend(self._merge(small))
+                small = []
+            if remaining:
+                chunks.extend(self._split(piece, remaining))
+            else:
+                chunks.append(piece)
+        if small:
+            chunks.extend(self._merge(small))
+        return chunks
+
+    def split_text(self, text: str) -> List[str]:
+        return self._split(text, self.separators)
+
+    def split_texts(self, texts: List[str]) -> List[List[str]]:
+        """Batch: os chunks de cada texto (ex: todas as páginas de um intervalo) numa chamada."""
+        return [self._split(text, self.separators) for text in texts]
+
+def token_length_function(model: str) -> Callable[[str], int]:
+    """Tamanho em tokens (tiktoken). Sem o vocabulário, estima ~4 caracteres por token."""
+    from utils import get_encoding  # utils importa este módulo
+    encoding = get_encoding(model)
+    if encoding is None:
+        return lambda text: len(text) // 4 + 1
+    return lambda text: len(encoding.encode_ordinary(text))
+
+@functools.lru_cache(maxsize=None)
+def get_splitter(chunk_size: int, chunk_overlap: int, token_model: Optional[str] = None) -> RecursiveTextSplitter:
+    """Splitter reutilizado entre as páginas. Com token_model, chunk_size e
+    chunk_overlap são contados em tokens."""
+    length_function = token_length_function(token_model) if token_model else len
+    return RecursiveTextSplitter(chunk_size, chunk_overlap, length_function=length_function)
@@ -0,0 +1,267 @@
+import argparse
+import atexit
+import contextvars
+import functools
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from config import settings
+
+# Atributos numéricos somados por etapa (viram counters no arquivo do Prometheus)
+COUNTED_ATTRS = ["tokens", "items", "bytes", "prompt_tokens", "cached_tokens"]
+
+# Quantis do summary de duração
+QUANTILES = [0.5, 0.95, 0.99]
+
+# Span atual (para ligar as etapas de uma pergunta ao span da pergunta)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+class Span:
+    """Uma etapa medida. Use `set()` para anotar tokens, itens, bytes etc."""
+
+    def __init__(self, recorder: "TraceRecorder", name: str, attrs: Dict):
+        self.recorder = recorder
+        self.name = name
+        self.attrs = attrs
+        self.span_id = uuid.uuid4().hex[:16]
+        parent = _current_span.get()
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.wall_start = 0.0
+        self.start = 0.0
+        self.duration = 0.0
+        self._token = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.recorder.record(self)
+        return False
+
+class NoopSpan:
+    """Span quando o tracing está desligado: não mede nem grava nada."""
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self) -> "NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NOOP_SPAN = NoopSpan()
+
+class StageStats:
+    """Durações (últimas `max_samples`, para os quantis) e totais de uma etapa."""
+
+    def __init__(self, max_samples: int):
+        self.durations = deque(maxlen=max_samples)
+        self.count = 0
+        self.total_seconds = 0.0
+        self.errors = 0
+        self.counters = {attr: 0 for attr in COUNTED_ATTRS}
+
+    def add(self, duration: float, attrs: Dict):
+        self.durations.append(duration)
+        self.count += 1
+        self.total_seconds += duration
+        if "error" in attrs:
+            self.errors += 1
+        for attr in COUNTED_ATTRS:
+            value = attrs.get(attr)
+            if isinstance(value, (int, float)):
+                self.counters[attr] += value
+
+    def quantiles(self) -> Dict[float, float]:
+        ordered = sorted(self.durations)
+        if not ordered:
+            return {q: 0.0 for q in QUANTILES}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in QUANTILES}
+
+class TraceRecorder:
+    """Grava cada span como uma linha JSON (append, funciona com vários processos)
+    e guarda as estatísticas por etapa deste processo para o arquivo do Prometheus."""
+
+    def __init__(self, log_path: Optional[str], metrics_path: Optional[str], max_samples: int = 10000):
+        self.log_path = log_path
+        self.metrics_path = metrics_path
+        self.max_samples = max_samples
+        self.stages: Dict[str, StageStats] = {}
+        self._lock = threading.Lock()
+        self._log = None
+        self._pid = os.getpid()
+
+    def _check_fork(self):
+        # Num processo filho (process pool do ingest) começa do zero: lock, arquivo e estatísticas próprios
+        if self._pid != os.getpid():
+            self._lock = threading.Lock()
+            self._log = None
+            self.stages = {}
+            self._pid = os.getpid()
+
+    def record(self, span: Span):
+        entry = {
+            "name": span.name,
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_id": span.parent_id,
+            "start": round(span.wall_start, 6),
+            "duration_ms": round(span.duration * 1000, 3),
+            "pid": os.getpid(),
+            "thread": threading.current_thread().name,
+            **span.attrs,
+        }
+        self._check_fork()
+        with self._lock:
+            stats = self.stages.get(span.name)
+            if stats is None:
+                stats = self.stages[span.name] = StageStats(self.max_samples)
+            stats.add(span.duration, span.attrs)
+            if self.log_path:
+                if self._log is None:
+                    self._log = open(self.log_path, "a", encoding="utf-8", buffering=1)
+                self._log.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+
+    def export_prometheus(self, path: str = None):
+        """Escreve o arquivo para o textfile collector do node_exporter (troca atômica).
+        Só o processo principal escreve; os spans dos filhos ficam no log JSON."""
+        path = path or self.metrics_path
+        if not path or not self.stages or multiprocessing.parent_process() is not None:
+            return
+        with self._lock:
+            text = render_prometheus(self.stages)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def close(self):
+        self.export_prometheus()
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+def render_prometheus(stages: Dict[str, StageStats]) -> str:
+    """Summary de duração (p50/p95/p99, soma e contagem) e counters por etapa."""
+    lines = [
+        "# HELP rag_stage_duration_seconds Duration of each RAG stage",
+        "# TYPE rag_stage_duration_seconds summary",
+    ]
+    for name, stats in sorted(stages.items()):
+        for q, value in stats.quantiles().items():
+            lines.append(f'rag_stage_duration_seconds{{stage="{name}",quantile="{q}"}} {value:.6f}')
+        lines.append(f'rag_stage_duration_seconds_sum{{stage="{name}"}} {stats.total_seconds:.6f}')
+        lines.append(f'rag_stage_duration_seconds_count{{stage="{name}"}} {stats.count}')
+    lines += ["# HELP rag_stage_errors_total Stage runs that raised an exception",
+              "# TYPE rag_stage_errors_total counter"]
+    lines += [f'rag_stage_errors_total{{stage="{name}"}} {stats.errors}' for name, stats in sorted(stages.items())]
+    for attr in COUNTED_ATTRS:
+        lines += [f"# HELP rag_stage_{attr}_total Total {attr} processed by each stage",
+                  f"# TYPE rag_stage_{attr}_total counter"]
+        lines += [f'rag_stage_{attr}_total{{stage="{name}"}} {stats.counters[attr]}'
+                  for name, stats in sorted(stages.items()) if stats.counters[attr]]
+    return "\n".join(lines) + "\n"
+
+_recorder: Optional[TraceRecorder] = None
+_recorder_lock = threading.Lock()
+
+def get_recorder() -> TraceRecorder:
+    global _recorder
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                metrics_path = settings.METRICS_PATH.format(program=Path(sys.argv[0]).stem or "python")
+                _recorder = TraceRecorder(settings.TRACE_LOG_PATH, metrics_path, settings.TRACE_MAX_SAMPLES)
+                atexit.register(_recorder.close)
+    return _recorder
+
+def span(name: str, **attrs):
+    """Mede uma etapa: `with span("search", items=3) as s: ...; s.set(tokens=...)`.
+    Com TRACING_ENABLED desligado retorna um span que não faz nada."""
+    if not settings.TRACING_ENABLED:
+        return NOOP_SPAN
+    return Span(get_recorder(), name, attrs)
+
+def current_span():
+    """Span aberto no contexto atual (para anotar de dentro de uma função com @traced)."""
+    return _current_span.get() or NOOP_SPAN
+
+def traced(name: str):
+    """Decorator: a função inteira vira um span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def export_metrics():
+    """Atualiza o arquivo do Prometheus com o que foi medido até agora neste processo."""
+    if settings.TRACING_ENABLED:
+        get_recorder().export_prometheus()
+
+def read_spans(paths: Iterable[str]) -> Iterable[Dict]:
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Linha incompleta (processo morreu escrevendo)
+
+def summarize(spans: Iterable[Dict], max_samples: int) -> Dict[str, StageStats]:
+    stages: Dict[str, StageStats] = {}
+    for entry in spans:
+        stats = stages.get(entry["name"])
+        if stats is None:
+            stats = stages[entry["name"]] = StageStats(max_samples)
+        stats.add(entry["duration_ms"] / 1000, entry)
+    return stages
+
+def main():
+    """Resumo por etapa (p50/p95/p99) a partir do log JSON, incluindo os spans dos
+    processos do ingest, e opcionalmente o arquivo do Prometheus."""
+    parser = argparse.ArgumentParser(description="Per-stage timings from the trace log")
+    parser.add_argument("logs", nargs="*", default=[settings.TRACE_LOG_PATH], help="JSON trace logs")
+    parser.add_argument("--prometheus", help="Also write a Prometheus textfile to this path")
+    args = parser.parse_args()
+
+    missing = [path for path in args.logs if not Path(path).exists()]
+    if missing:
+        print(f"Trace log not found: {', '.join(missing)} (run with TRACING_ENABLED=true)")
+        return
+
+    stages = summarize(read_spans(args.logs), max_samples=1_000_000)
+    print(f"{'stage':<28}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'total s':>10}  totals")
+    for name, stats in sorted(stages.items(), key=lambda item: -item[1].total_seconds):
+        q = stats.quantiles()
+        totals = ", ".join(f"{attr}={value:.0f}" for attr, value in stats.counters.items() if value)
+        print(f"{name:<28}{stats.count:>8}{q[0.5] * 1000:>10.1f}{q[0.95] * 1000:>10.1f}{q[0.99] * 1000:>10.1f}"
+              f"{stats.total_seconds:>10.2f}  {totals}")
+    if args.prometheus:
+        Path(args.prometheus).write_text(render_prometheus(stages), encoding="utf-8")
+        print(f"✅ Prometheus metrics written to {args.prometheus}")
+
+if __name__ == "__main__":
+    main()
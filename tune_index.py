@@ -0,0 +1,169 @@
+import argparse
+import json
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import settings
+from vector_store import IVF_INDEX_TYPES, VectorStore, get_vector_store
+
+# Valores testados para o parâmetro de busca de cada tipo de índice (do mais barato para o mais caro)
+SWEEPS = {
+    "nprobe": [1, 2, 4, 8, 16, 32, 64, 128, 256, 512],
+    "ef": [16, 32, 64, 128, 256, 512],
+    "search_list": [20, 50, 100, 200, 400],
+}
+
+def sweep_param(index_type: str) -> Optional[str]:
+    """Parâmetro de busca que controla recall x latência no índice."""
+    if index_type in IVF_INDEX_TYPES or index_type == "IVF":
+        return "nprobe"
+    if index_type == "HNSW":
+        return "ef"
+    if index_type == "DISKANN":
+        return "search_list"
+    return None
+
+def sample_queries(vector_store: VectorStore, n_queries: int, noise: float = 0.05) -> np.ndarray:
+    """Queries sintéticas: vetores da coleção com um pouco de ruído (normalizados de novo),
+    para não serem idênticos ao vetor guardado."""
+    rng = np.random.default_rng(0)
+    reservoir, seen = [], 0
+    for _, block in vector_store.iter_vectors():
+        for vector in block:
+            # Reservoir sampling, a coleção pode não caber na memória
+            if len(reservoir) < n_queries:
+                reservoir.append(vector)
+            else:
+                j = rng.integers(0, seen + 1)
+                if j < n_queries:
+                    reservoir[j] = vector
+            seen += 1
+    if not reservoir:
+        return np.zeros((0, settings.EMBEDDING_DIM), dtype=np.float32)
+
+    queries = np.stack(reservoir).astype(np.float32)
+    queries += rng.standard_normal(queries.shape).astype(np.float32) * noise / np.sqrt(queries.shape[1])
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+def embed_questions(path: str, n_queries: int) -> np.ndarray:
+    """Embeddings de perguntas reais (uma por linha no arquivo)."""
+    from openai import OpenAI
+
+    with open(path, "r", encoding="utf-8") as f:
+        questions = [line.strip() for line in f if line.strip()][:n_queries]
+    client = OpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL)
+    response = client.embeddings.create(input=questions, model=settings.EMBEDDING_MODEL,
+                                        dimensions=settings.EMBEDDING_DIM)
+    return np.array([data.embedding for data in sorted(response.data, key=lambda d: d.index)],
+                    dtype=np.float32)
+
+def exact_ground_truth(vector_store: VectorStore, queries: np.ndarray, top_k: int) -> List[set]:
+    """Ids dos top_k exatos (inner product) de cada query, lendo a coleção em blocos."""
+    best_ids = np.zeros((len(queries), 0), dtype=np.int64)
+    best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+    for ids, block in vector_store.iter_vectors():
+        scores = np.concatenate([best_scores, queries @ np.asarray(block, dtype=np.float32).T], axis=1)
+        all_ids = np.concatenate([best_ids, np.broadcast_to(ids, (len(queries), len(ids)))], axis=1)
+        keep = np.argpartition(-scores, min(top_k, scores.shape[1]) - 1, axis=1)[:, :top_k]
+        best_scores = np.take_along_axis(scores, keep, axis=1)
+        best_ids = np.take_along_axis(all_ids, keep, axis=1)
+    return [set(ids.tolist()) for ids in best_ids]
+
+def measure(vector_store: VectorStore, queries: np.ndarray, truth: List[set], top_k: int,
+            search_params: Optional[Dict]) -> Dict:
+    """Recall@k e latência (uma query por vez, como no chat) com os parâmetros de busca."""
+    latencies, recalls = [], []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        hits = vector_store.search([query.tolist()], top_k, output_fields=[], search_params=search_params)[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len({hit["id"] for hit in hits} & expected) / max(len(expected), 1))
+    return {
+        "recall": float(np.mean(recalls)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+def tune(vector_store: VectorStore, queries: np.ndarray, top_k: int, target_recall: float) -> Optional[Dict]:
+    """Testa os valores do parâmetro de busca e retorna o mais barato que chega no recall alvo."""
+    index_type = vector_store.index_type
+    param = sweep_param(index_type)
+    truth = exact_ground_truth(vector_store, queries, top_k)
+
+    print(f"Index {index_type}, {vector_store.count()} vectors, {len(queries)} queries, "
+          f"target recall@{top_k} >= {target_recall}")
+    print(f"{'params':>22} {'recall':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    if param is None:
+        result = measure(vector_store, queries, truth, top_k, None)
+        print(f"{'(exact search)':>22} {result['recall']:>8.3f} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+        print("Nothing to tune for this index type")
+        return None
+
+    values = [value for value in SWEEPS[param] if param != "ef" or value >= top_k]
+    if param == "nprobe":
+        nlist = len(vector_store.centroids) if index_type == "IVF" else \
+            vector_store.current_index_params().get("nlist", max(values))
+        values = [value for value in values if value < nlist] + [nlist]
+
+    chosen = None
+    for value in values:
+        search_params = {param: value}
+        result = measure(vector_store, queries, truth, top_k, search_params)
+        print(f"{json.dumps(search_params):>22} {result['recall']:>8.3f} "
+              f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+        if result["recall"] >= target_recall:
+            chosen = {"search_params": search_params, **result}
+            break
+
+    if chosen is None:
+        print(f"⚠️ No {param} reached recall {target_recall}, consider a different index type or more nlist/M")
+    return chosen
+
+def main():
+    """Mede recall x latência do índice e salva os parâmetros de busca em settings.INDEX_TUNING_PATH."""
+    parser = argparse.ArgumentParser(description="Tune ANN search params (nprobe / ef / search_list)")
+    parser.add_argument("--queries", type=int, default=200, help="Number of sampled queries")
+    parser.add_argument("--questions", help="File with one question per line (embedded instead of sampling)")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--dry-run", action="store_true", help="Only report, don't write the tuning file")
+    args = parser.parse_args()
+
+    vector_store = get_vector_store()
+    vector_store.connect()
+    if not vector_store.exists():
+        print("Collection not found, run the vectorizer first")
+        return
+    vector_store.load()
+
+    if args.questions:
+        queries = embed_questions(args.questions, args.queries)
+    else:
+        queries = sample_queries(vector_store, args.queries)
+    if not len(queries):
+        print("Collection is empty, run the vectorizer first")
+        return
+
+    chosen = tune(vector_store, queries, args.top_k, args.target_recall)
+    if chosen is None or args.dry_run:
+        return
+
+    tuning = {
+        "backend": settings.VECTOR_STORE,
+        "index_type": vector_store.index_type,
+        "top_k": args.top_k,
+        "target_recall": args.target_recall,
+        "n_vectors": vector_store.count(),
+        "tuned_at": datetime.now(timezone.utc).isoformat(),
+        **chosen,
+    }
+    with open(settings.INDEX_TUNING_PATH, "w", encoding="utf-8") as f:
+        json.dump(tuning, f, indent=2)
+    print(f"✅ Saved {chosen['search_params']} (recall {chosen['recall']:.3f}, "
+          f"p99 {chosen['p99_ms']:.2f} ms) to {settings.INDEX_TUNING_PATH}")
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,91 @@
 import hashlib
-import fitz  # PyMuPDF
+import functools
 from pathlib import Path
-from typing import List, Dict
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-
-def extract_text_from_pdf(pdf_path: str) -> List[Dict]:
-    """Extrai o texto de um PDF e retorna uma lista de dicionários com o conteúdo de cada página."""
-    doc = fitz.open(pdf_path)
-    pages = []
-    
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        text = page.get_text("text").strip()
-        if text:  # Only include pages with text
-            pages.append({
-                "page_number": page_num + 1,
-                "content": text,
-                "file_name": Path(pdf_path).name
-            })
-    
-    doc.close()
-    return pages
-
-def split_text(text: str, chunk_size: int = 600, overlap: int = 150) -> List[str]:
-    """Vai dividir o texto em pedaços menores com base no tamanho do chunk e na sobreposição."""
-    splitter = RecursiveCharacterTextSplitter(
-        separators=["\n\n", "\n", " ", ""],
-        chunk_size=chunk_size,
-        chunk_overlap=overlap,
-    )
-    return splitter.split_text(text)
+from typing import TYPE_CHECKING, List, Dict, Iterator, Optional
+from text_splitter import get_splitter
+from tracing import span
+
+# fitz (PyMuPDF) e tiktoken são importados só quando usados, o chat não precisa deles para abrir
+if TYPE_CHECKING:
+    import tiktoken
+
+def extract_text_from_pdf(pdf_path: str, start_page: int = 0, end_page: Optional[int] = None) -> Iterator[Dict]:
+    """Extrai o texto de um PDF página por página (generator), com um dicionário para cada página.
+    Só uma página fica em memória por vez. start_page/end_page (base 0, end exclusivo)
+    permitem extrair só um intervalo de páginas."""
+    import fitz  # PyMuPDF
+    with fitz.open(pdf_path) as doc:
+        end_page = len(doc) if end_page is None else min(end_page, len(doc))
+        for page_num in range(start_page, end_page):
+            with span("pdf.extract_page", file=Path(pdf_path).name, page=page_num + 1) as page_span:
+                page = doc[page_num]
+                text = page.get_text("text").strip()
+                page_span.set(bytes=len(text.encode("utf-8")))
+            if text:  # Only include pages with text
+                yield {
+                    "page_number": page_num + 1,
+                    "content": text,
+                    "file_name": Path(pdf_path).name
+                }
+
+def count_pdf_pages(pdf_path: str) -> int:
+    """Número de páginas do PDF."""
+    import fitz
+    with fitz.open(pdf_path) as doc:
+        return len(doc)
+
+def split_text(text: str, chunk_size: int = 600, overlap: int = 150, token_model: Optional[str] = None) -> List[str]:
+    """Vai dividir o texto em pedaços menores com base no tamanho do chunk e na sobreposição.
+    Com token_model, chunk_size e overlap são contados em tokens em vez de caracteres."""
+    with span("split_text", bytes=len(text)) as split_span:
+        chunks = get_splitter(chunk_size, overlap, token_model).split_text(text)
+        split_span.set(items=len(chunks))
+    return chunks
+
+def split_texts(texts: List[str], chunk_size: int = 600, overlap: int = 150,
+                token_model: Optional[str] = None) -> List[List[str]]:
+    """split_text em lote (ex: todas as páginas de um intervalo), com o mesmo splitter."""
+    with span("split_text", bytes=sum(len(text) for text in texts)) as split_span:
+        chunks = get_splitter(chunk_size, overlap, token_model).split_texts(texts)
+        split_span.set(items=sum(len(page_chunks) for page_chunks in chunks))
+    return chunks
 
 def generate_doc_id(text: str) -> str:
     """Gera ids para cada chunk."""
     return hashlib.md5(text.encode("utf-8")).hexdigest()
 
+def generate_file_hash(file_path: str) -> str:
+    """Gera o hash do conteúdo de um arquivo, mesmo hash (md5) do generate_doc_id."""
+    md5 = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
 def clean_text(text: str) -> str:
     """Limpa o texto removendo caracteres especiais e espaços extras."""
     # Remove extra whitespace
     text = " ".join(text.split())
     return text.strip()
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str) -> Optional["tiktoken.Encoding"]:
+    """Encoding do tiktoken para o modelo. Retorna None se não der para carregar
+    (o tiktoken baixa o vocabulário na primeira vez, então sem rede pode falhar)."""
+    import tiktoken
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            # Modelo desconhecido pelo tiktoken (ex: modelos locais da VM)
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"Could not load tiktoken encoding for {model} ({e}), estimating tokens from length")
+        return None
+
+def count_tokens(texts: List[str], model: str) -> List[int]:
+    """Conta os tokens de cada texto. Sem encoding disponível, estima ~4 caracteres por token."""
+    encoding = get_encoding(model)
+    if encoding is None:
+        return [len(text) // 4 + 1 for text in texts]
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
@@ -0,0 +1,783 @@
+import json
+import math
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from chunk_store import ChunkStore
+from config import settings
+from quantization import quantize, coarse_scores
+
+# Campos de metadados guardados junto com cada vetor
+METADATA_FIELDS = ["text", "file_name", "page_number", "chunk_id"]
+
+# Índices do Milvus com partições (nlist / nprobe)
+IVF_INDEX_TYPES = ("IVF_FLAT", "IVF_SQ8", "IVF_PQ")
+
+# No Milvus o índice é construído por segmento (~1 GB), então o nlist depende das linhas por segmento
+MILVUS_SEGMENT_BYTES = 1024 * 1024 * 1024
+
+def to_float32(vector) -> np.ndarray:
+    """Vetor retornado pelo Milvus (lista, ou bytes no FLOAT16_VECTOR) como float32."""
+    if isinstance(vector, bytes):
+        return np.frombuffer(vector, dtype=np.float16).astype(np.float32)
+    return np.asarray(vector, dtype=np.float32)
+
+def auto_nlist(n_rows: int) -> int:
+    """nlist recomendado para IVF: ~4 * sqrt(n), entre 16 e 65536."""
+    return max(16, min(65536, int(4 * math.sqrt(max(n_rows, 1)))))
+
+def default_index_params(index_type: str, n_rows: int, dim: int) -> Dict:
+    """Parâmetros de construção do índice para o tipo e o tamanho da coleção."""
+    if index_type in IVF_INDEX_TYPES:
+        segment_rows = MILVUS_SEGMENT_BYTES // (dim * 4)
+        params = {"nlist": auto_nlist(min(n_rows, segment_rows))}
+        if index_type == "IVF_PQ":
+            params.update({"m": dim // 8, "nbits": 8})
+        return params
+    if index_type == "HNSW":
+        return {"M": 16, "efConstruction": 200}
+    return {}
+
+def default_search_params(index_type: str, index_params: Dict) -> Dict:
+    """Parâmetros de busca padrão (quando não há um resultado do tune_index)."""
+    if index_type in IVF_INDEX_TYPES:
+        return {"nprobe": max(10, index_params.get("nlist", 1024) // 32)}
+    if index_type == "HNSW":
+        return {"ef": 64}
+    if index_type == "DISKANN":
+        return {"search_list": 100}
+    return {}
+
+def load_tuned_search_params(backend: str, index_type: str) -> Optional[Dict]:
+    """Parâmetros de busca salvos pelo tune_index, se foram medidos para este backend/índice."""
+    path = Path(settings.INDEX_TUNING_PATH)
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        tuning = json.load(f)
+    if tuning.get("backend") == backend and tuning.get("index_type") == index_type:
+        return tuning["search_params"]
+    return None
+
+class SearchScope:
+    """Escopo de uma busca: só os chunks de alguns arquivos (file_names) e/ou uma expressão
+    de filtro do Milvus (ex: "page_number <= 10"). Com o file_name como partition key o
+    Milvus só olha as partições desses arquivos; no numpy só as linhas deles são comparadas."""
+
+    def __init__(self, file_names: Optional[List[str]] = None, expr: Optional[str] = None):
+        self.file_names = sorted(set(file_names)) if file_names else None
+        self.expr = expr or None
+
+    @property
+    def active(self) -> bool:
+        return self.file_names is not None or self.expr is not None
+
+    def milvus_expr(self) -> str:
+        parts = []
+        if self.file_names is not None:
+            parts.append(f"file_name in {json.dumps(self.file_names, ensure_ascii=False)}")
+        if self.expr is not None:
+            parts.append(f"({self.expr})")
+        return " and ".join(parts)
+
+    def __str__(self) -> str:
+        parts = []
+        if self.file_names is not None:
+            parts.append(f"{len(self.file_names)} file(s)")
+        if self.expr is not None:
+            parts.append(f"filter '{self.expr}'")
+        return ", ".join(parts) or "all documents"
+
+class VectorStore(ABC):
+    """Interface comum para onde os embeddings dos chunks ficam guardados.
+    Cada linha tem: vector, text, file_name, page_number, chunk_id.
+    Os resultados da busca são dicionários com os output_fields, "id" e "score" (IP)."""
+
+    @abstractmethod
+    def connect(self):
+        """Conecta (ou abre) o backend."""
+
+    @abstractmethod
+    def exists(self) -> bool:
+        """Se a coleção já foi criada."""
+
+    @abstractmethod
+    def setup(self, drop_existing: bool = True):
+        """Cria a coleção. Com drop_existing=False reaproveita a que já existe."""
+
+    @abstractmethod
+    def load(self):
+        """Deixa a coleção pronta para busca."""
+
+    @abstractmethod
+    def insert(self, rows: List[Dict]):
+        """Insere as linhas (vector + metadados)."""
+
+    @abstractmethod
+    def delete(self, file_name: str, chunk_keys: Optional[List[Tuple[str, int]]] = None):
+        """Remove os chunks (chunk_id, page_number) de um arquivo, ou o arquivo inteiro."""
+
+    @abstractmethod
+    def search(self, vectors: List[List[float]], top_k: int, output_fields: List[str],
+               search_params: Dict = None, scope: Optional[SearchScope] = None) -> List[List[Dict]]:
+        """Busca os top_k mais similares (inner product) para cada vetor.
+        search_params sobrescreve os parâmetros de busca do índice (ex: {"nprobe": 16}).
+        Com `scope`, só entre os chunks do escopo.
+        Com "vector" em output_fields, o vetor de cada resultado vem como np.ndarray float32."""
+
+    @abstractmethod
+    def count(self) -> int:
+        """Número de chunks na coleção."""
+
+    def flush(self):
+        """Persiste o que foi inserido/removido."""
+
+    def build_index(self):
+        """Constrói o índice de busca depois do ingest (se o backend precisar)."""
+
+    @abstractmethod
+    def iter_vectors(self, batch_size: int = 10000) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Percorre a coleção em blocos (ids, vetores (n, dim) float32). Os ids são os
+        mesmos que aparecem em "id" nos resultados da busca."""
+
+    def text_in_store(self) -> bool:
+        """Se o texto dos chunks fica no próprio vector store (e não no chunk store local)."""
+        return True
+
+    @abstractmethod
+    def iter_texts(self, batch_size: int = 10000) -> Iterator[List[Dict]]:
+        """Percorre a coleção em blocos de {"chunk_id", "text"}."""
+
+class MilvusVectorStore(VectorStore):
+    """Backend Milvus (coleção settings.COLLECTION_NAME, índice MILVUS_INDEX_TYPE com IP).
+    Com VECTOR_QUANTIZATION = "float16" o campo vector é FLOAT16_VECTOR (metade da memória).
+    Com MILVUS_PARTITION_KEY o campo (file_name) é a partition key da coleção: as buscas
+    filtradas por ele só olham as partições dos valores filtrados.
+    Com CHUNK_STORE_ENABLED a coleção é criada sem o campo text: o Milvus guarda só o vetor
+    e os metadados, e o texto dos resultados vem do chunk store local pelo chunk_id."""
+
+    def __init__(self, collection_name: str = None):
+        self.collection_name = collection_name or settings.COLLECTION_NAME
+        self.collection = None
+        self.quantization = settings.VECTOR_QUANTIZATION
+        if self.quantization not in ("none", "float16"):
+            raise ValueError(f"Quantization '{self.quantization}' with rescoring is only supported by "
+                             "the numpy vector store, Milvus supports 'none' or 'float16'")
+        self.vector_dtype = np.float16 if self.quantization == "float16" else np.float32
+        self.index_type = settings.MILVUS_INDEX_TYPE
+        self.search_params = None
+        self.chunk_store: Optional[ChunkStore] = None
+
+    def _index_params(self, n_rows: int) -> Dict:
+        params = default_index_params(self.index_type, n_rows, settings.EMBEDDING_DIM)
+        params.update(settings.MILVUS_INDEX_PARAMS)
+        return {"index_type": self.index_type, "metric_type": "IP", "params": params}
+
+    def current_index_params(self) -> Dict:
+        """Parâmetros do índice que está criado na coleção."""
+        params = self.collection.index().params.get("params", {})
+        return json.loads(params) if isinstance(params, str) else params
+
+    def connect(self):
+        # pymilvus só é importado quando o Milvus é usado (o import leva ~0.4s)
+        from pymilvus import connections
+        connections.connect("default", host=settings.MILVUS_HOST, port=settings.MILVUS_PORT)
+        print("✅ Connected to Milvus")
+
+    def exists(self) -> bool:
+        from pymilvus import utility
+        return utility.has_collection(self.collection_name)
+
+    def setup(self, drop_existing: bool = True):
+        from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, utility
+        if self.exists() and not drop_existing:
+            self.load()
+            print(f"✅ Using existing collection '{self.collection_name}'")
+            return
+
+        if self.exists():
+            print(f"Collection '{self.collection_name}' already exists - dropping it...")
+            utility.drop_collection(self.collection_name)
+            print(f"✅ Collection '{self.collection_name}' dropped successfully")
+
+        print(f"Creating new collection '{self.collection_name}'")
+        partition_key = settings.MILVUS_PARTITION_KEY
+        if partition_key not in ("", "file_name"):
+            raise ValueError(f"Unsupported partition key '{partition_key}' (use 'file_name' or '')")
+        fields = [
+            FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
+            FieldSchema(name="vector", dim=settings.EMBEDDING_DIM,
+                        dtype=DataType.FLOAT16_VECTOR if self.quantization == "float16" else DataType.FLOAT_VECTOR),
+            # Com o chunk store o texto fica fora do Milvus
+            *([] if settings.CHUNK_STORE_ENABLED else [FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=65535)]),
+            FieldSchema(name="file_name", dtype=DataType.VARCHAR, max_length=512,
+                        is_partition_key=partition_key == "file_name"),
+            FieldSchema(name="page_number", dtype=DataType.INT64),
+            FieldSchema(name="chunk_id", dtype=DataType.VARCHAR, max_length=512),
+        ]
+
+        schema = CollectionSchema(fields=fields, description="PDF document embeddings")
+        if partition_key:
+            self.collection = Collection(self.collection_name, schema, num_partitions=settings.MILVUS_NUM_PARTITIONS)
+        else:
+            self.collection = Collection(self.collection_name, schema)
+
+        # Index (a coleção ainda está vazia, o nlist é ajustado no build_index depois do ingest)
+        index_params = self._index_params(n_rows=0)
+        self.collection.create_index(field_name="vector", index_params=index_params)
+        print(f"✅ Collection '{self.collection_name}' created successfully ({self.index_type} index"
+              + (f", partition key {partition_key}" if partition_key else "")
+              + (", text in the local chunk store)" if settings.CHUNK_STORE_ENABLED else ")"))
+        self.chunk_store = None
+        if settings.CHUNK_STORE_ENABLED:
+            # clear() não lê o store antigo: funciona mesmo se ele foi escrito com outro codec
+            self.chunk_store = ChunkStore().clear()
+
+        # Load collection
+        self.load()
+
+    def load(self):
+        from pymilvus import Collection
+        self.collection = Collection(self.collection_name)
+        self.collection.load()
+        if not self.text_in_store() and self.chunk_store is None:
+            self.chunk_store = ChunkStore().open()
+        self.index_type = self.collection.index().params.get("index_type", self.index_type)
+        self.search_params = (load_tuned_search_params("milvus", self.index_type)
+                              or default_search_params(self.index_type, self.current_index_params()))
+
+    def build_index(self):
+        """Recria o índice IVF quando o nlist atual está muito longe do tamanho da coleção."""
+        if self.index_type not in IVF_INDEX_TYPES or "nlist" in settings.MILVUS_INDEX_PARAMS:
+            return
+        wanted = self._index_params(self.collection.num_entities)
+        current_nlist = self.current_index_params().get("nlist", 0)
+        if current_nlist and 0.5 <= wanted["params"]["nlist"] / current_nlist <= 2:
+            return
+
+        print(f"Rebuilding {self.index_type} index: nlist {current_nlist} -> {wanted['params']['nlist']}")
+        self.collection.release()
+        self.collection.drop_index()
+        self.collection.create_index(field_name="vector", index_params=wanted)
+        self.load()
+
+    def text_in_store(self) -> bool:
+        return any(field.name == "text" for field in self.collection.schema.fields)
+
+    def insert(self, rows: List[Dict]):
+        if self.chunk_store is not None:
+            # O texto vai antes para o chunk store: todo chunk_id no Milvus tem o texto no disco
+            self.chunk_store.put_many(rows)
+            rows = [{key: value for key, value in row.items() if key != "text"} for row in rows]
+        if self.quantization == "float16":
+            rows = [{**row, "vector": np.asarray(row["vector"], dtype=np.float16)} for row in rows]
+        self.collection.insert(rows)
+
+    def delete(self, file_name: str, chunk_keys: Optional[List[Tuple[str, int]]] = None):
+        file_expr = f"file_name == {json.dumps(file_name)}"
+        if chunk_keys is None:
+            self.collection.delete(file_expr)
+            return
+
+        # Agrupa por página, o mesmo chunk_id pode aparecer em páginas diferentes
+        by_page = {}
+        for chunk_id, page_number in chunk_keys:
+            by_page.setdefault(page_number, []).append(chunk_id)
+
+        page_exprs = [
+            f"(page_number == {page_number} and chunk_id in {json.dumps(sorted(chunk_ids))})"
+            for page_number, chunk_ids in sorted(by_page.items())
+        ]
+        if page_exprs:
+            self.collection.delete(f"{file_expr} and ({' or '.join(page_exprs)})")
+
+    def search(self, vectors: List[List[float]], top_k: int, output_fields: List[str],
+               search_params: Dict = None, scope: Optional[SearchScope] = None) -> List[List[Dict]]:
+        search_params = {"metric_type": "IP", "params": search_params or self.search_params}
+        # Sem o campo text na coleção, o texto vem do chunk store pelo chunk_id
+        text_from_store = self.chunk_store is not None and "text" in output_fields
+        milvus_fields = output_fields
+        if text_from_store:
+            milvus_fields = [field for field in output_fields if field != "text"]
+            if "chunk_id" not in milvus_fields:
+                milvus_fields.append("chunk_id")
+
+        results = self.collection.search(
+            data=[np.asarray(vector, dtype=self.vector_dtype) for vector in vectors],
+            anns_field="vector",
+            param=search_params,
+            limit=top_k,
+            expr=scope.milvus_expr() if scope is not None and scope.active else None,
+            output_fields=milvus_fields
+        )
+
+        rows = [
+            [
+                {**{field: hit.entity.get(field) for field in milvus_fields}, "id": hit.id, "score": hit.score}
+                for hit in hits
+            ]
+            for hits in results
+        ]
+        if text_from_store:
+            texts = iter(self.chunk_store.get_many([hit["chunk_id"] for hits in rows for hit in hits]))
+            for hits in rows:
+                for hit in hits:
+                    hit["text"] = next(texts) or ""
+                    if "chunk_id" not in output_fields:
+                        del hit["chunk_id"]
+        if "vector" in output_fields:
+            for hits in rows:
+                for hit in hits:
+                    hit["vector"] = to_float32(hit["vector"])
+        return rows
+
+    def count(self) -> int:
+        return self.collection.num_entities
+
+    def flush(self):
+        self.collection.flush()
+
+    def iter_vectors(self, batch_size: int = 10000) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        iterator = self.collection.query_iterator(batch_size=batch_size, expr="", output_fields=["id", "vector"])
+        try:
+            while True:
+                batch = iterator.next()
+                if not batch:
+                    break
+                yield np.array([row["id"] for row in batch]), np.stack([to_float32(row["vector"]) for row in batch])
+        finally:
+            iterator.close()
+
+    def iter_texts(self, batch_size: int = 10000) -> Iterator[List[Dict]]:
+        if not self.text_in_store():
+            raise ValueError(f"Collection '{self.collection_name}' keeps its text in the chunk store")
+        iterator = self.collection.query_iterator(batch_size=batch_size, expr="", output_fields=["chunk_id", "text"])
+        try:
+            while True:
+                batch = iterator.next()
+                if not batch:
+                    break
+                yield [{"chunk_id": row["chunk_id"], "text": row["text"]} for row in batch]
+        finally:
+            iterator.close()
+
+class NumpyVectorStore(VectorStore):
+    """Backend embutido, sem serviço: os vetores ficam numa matriz float32/float16
+    memory-mapped (vectors.bin) e os metadados num JSONL (meta.jsonl).
+    A busca é um produto interno vetorizado com top-k por argpartition, em blocos
+    para não copiar a matriz inteira. Com ivf_nlist > 0 os vetores são particionados
+    por k-means e a busca só olha as ivf_nprobe partições mais próximas.
+
+    Com quantization (float16, int8 ou binary) uma cópia compacta dos vetores (codes.bin)
+    é usada na primeira passada, e os rescore_candidates melhores são reordenados com
+    o score exato dos vetores completos, que ficam no disco.
+
+    As buscas com escopo de arquivos fazem busca exata só nas linhas desses arquivos
+    (o equivalente à partition key do Milvus). Expressões de filtro não são suportadas."""
+
+    # Linhas por bloco na busca exata
+    SEARCH_BLOCK_ROWS = 65536
+
+    def __init__(self, path: str = None, dtype: str = None, ivf_nlist: int = None, ivf_nprobe: int = None,
+                 quantization: str = None, rescore_candidates: int = None):
+        self.path = Path(path or settings.NUMPY_STORE_DIR)
+        self.dtype = np.dtype(dtype or settings.NUMPY_STORE_DTYPE)
+        self.quantization = quantization or settings.VECTOR_QUANTIZATION
+        self.rescore_candidates = rescore_candidates or settings.RESCORE_CANDIDATES
+        self.ivf_nlist = settings.NUMPY_IVF_NLIST if ivf_nlist is None else ivf_nlist
+        tuned = load_tuned_search_params("numpy", "IVF")
+        self.ivf_nprobe = ivf_nprobe or (tuned or {}).get("nprobe") or settings.NUMPY_IVF_NPROBE
+        self.dim = settings.EMBEDDING_DIM
+        self.metadata: List[Dict] = []
+        self.deleted = np.zeros(0, dtype=bool)
+        self.centroids = None
+        self.assignments = None
+        self._lists = None
+        self._file_rows = None
+        self._vectors = None
+        self._codes = None
+        self._lock = threading.RLock()
+
+    @property
+    def vectors_path(self) -> Path:
+        return self.path / "vectors.bin"
+
+    @property
+    def metadata_path(self) -> Path:
+        return self.path / "meta.jsonl"
+
+    @property
+    def codes_path(self) -> Path:
+        return self.path / "codes.bin"
+
+    @property
+    def scales_path(self) -> Path:
+        return self.path / "scales.bin"
+
+    @property
+    def deleted_path(self) -> Path:
+        return self.path / "deleted.npy"
+
+    @property
+    def ivf_path(self) -> Path:
+        return self.path / "ivf.npz"
+
+    @property
+    def info_path(self) -> Path:
+        return self.path / "store.json"
+
+    @property
+    def index_type(self) -> str:
+        return "IVF" if self.centroids is not None else "FLAT"
+
+    def connect(self):
+        print(f"✅ Using embedded vector store at '{self.path}'")
+
+    def exists(self) -> bool:
+        return self.info_path.exists()
+
+    def setup(self, drop_existing: bool = True):
+        if self.exists() and not drop_existing:
+            self.load()
+            print(f"✅ Using existing vector store '{self.path}'")
+            return
+
+        if self.path.exists():
+            print(f"Vector store '{self.path}' already exists - dropping it...")
+            shutil.rmtree(self.path)
+
+        self.path.mkdir(parents=True)
+        with open(self.info_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "dtype": self.dtype.name, "quantization": self.quantization}, f)
+        self.vectors_path.touch()
+        self.metadata_path.touch()
+        self.codes_path.touch()
+        self.scales_path.touch()
+        self.load()
+        print(f"✅ Vector store '{self.path}' created successfully")
+
+    def load(self):
+        with self._lock:
+            with open(self.info_path, "r", encoding="utf-8") as f:
+                info = json.load(f)
+            self.dim = info["dim"]
+            self.dtype = np.dtype(info["dtype"])
+            self.quantization = info.get("quantization", "none")
+
+            self.metadata = []
+            with open(self.metadata_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self.metadata.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break  # Última linha incompleta
+
+            # Se o processo caiu no meio de um insert, considera só as linhas completas
+            row_bytes = self.dim * self.dtype.itemsize
+            n_rows = min(len(self.metadata), self.vectors_path.stat().st_size // row_bytes)
+            if self.quantization != "none":
+                code_dtype, code_width = self._code_layout()
+                n_rows = min(n_rows, self.codes_path.stat().st_size // (code_width * code_dtype.itemsize))
+            self.metadata = self.metadata[:n_rows]
+
+            self.deleted = np.zeros(n_rows, dtype=bool)
+            if self.deleted_path.exists():
+                saved = np.load(self.deleted_path)[:n_rows]
+                self.deleted[:len(saved)] = saved
+
+            self.centroids, self.assignments, self._lists = None, None, None
+            self._file_rows = None
+            if self.ivf_path.exists():
+                ivf = np.load(self.ivf_path)
+                if len(ivf["assignments"]) == n_rows:
+                    self.centroids, self.assignments = ivf["centroids"], ivf["assignments"]
+            self._vectors = None
+            self._codes = None
+
+    def _matrix(self) -> np.ndarray:
+        """Matriz (n, dim) memory-mapped, reaberta depois de cada insert."""
+        if self._vectors is None or len(self._vectors) != len(self.metadata):
+            if not self.metadata:
+                return np.zeros((0, self.dim), dtype=self.dtype)
+            self._vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode="r",
+                                      shape=(len(self.metadata), self.dim))
+        return self._vectors
+
+    def _code_layout(self) -> Tuple[np.dtype, int]:
+        """dtype e largura de cada linha do codes.bin."""
+        if self.quantization == "binary":
+            return np.dtype(np.uint8), (self.dim + 7) // 8
+        return np.dtype({"float16": np.float16, "int8": np.int8}[self.quantization]), self.dim
+
+    def _compact_codes(self) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Vetores compactos (e scales do int8) memory-mapped."""
+        n_rows = len(self.metadata)
+        if self._codes is None or len(self._codes[0]) != n_rows:
+            code_dtype, code_width = self._code_layout()
+            if not n_rows:
+                return np.zeros((0, code_width), dtype=code_dtype), np.zeros(0, dtype=np.float32)
+            codes = np.memmap(self.codes_path, dtype=code_dtype, mode="r", shape=(n_rows, code_width))
+            scales = None
+            if self.quantization == "int8":
+                scales = np.memmap(self.scales_path, dtype=np.float32, mode="r", shape=(n_rows,))
+            self._codes = (codes, scales)
+        return self._codes
+
+    def _coarse_scores(self, rows, queries: np.ndarray) -> np.ndarray:
+        """Scores (n, n_queries) das linhas `rows` (slice ou índices): exatos sem
+        quantização, aproximados pelos vetores compactos com quantização."""
+        if self.quantization == "none":
+            return np.asarray(self._matrix()[rows], dtype=np.float32) @ queries.T
+        codes, scales = self._compact_codes()
+        return coarse_scores(codes[rows], scales[rows] if scales is not None else None,
+                             queries, self.quantization)
+
+    def insert(self, rows: List[Dict]):
+        vectors = np.asarray([row["vector"] for row in rows], dtype=self.dtype)
+        with self._lock:
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            if self.quantization != "none":
+                codes, scales = quantize(vectors, self.quantization)
+                with open(self.codes_path, "ab") as f:
+                    f.write(codes.tobytes())
+                if scales is not None:
+                    with open(self.scales_path, "ab") as f:
+                        f.write(scales.tobytes())
+            with open(self.metadata_path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps({field: row[field] for field in METADATA_FIELDS}) + "\n")
+
+            self.metadata.extend({field: row[field] for field in METADATA_FIELDS} for row in rows)
+            self.deleted = np.concatenate([self.deleted, np.zeros(len(rows), dtype=bool)])
+            if self.centroids is not None:
+                assignments = self._assign(vectors.astype(np.float32))
+                self.assignments = np.concatenate([self.assignments, assignments])
+
+    def delete(self, file_name: str, chunk_keys: Optional[List[Tuple[str, int]]] = None):
+        keys = set(chunk_keys) if chunk_keys is not None else None
+        with self._lock:
+            for i, row in enumerate(self.metadata):
+                if row["file_name"] != file_name:
+                    continue
+                if keys is None or (row["chunk_id"], row["page_number"]) in keys:
+                    self.deleted[i] = True
+            np.save(self.deleted_path, self.deleted)
+
+    def iter_vectors(self, batch_size: int = 10000) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        matrix = self._matrix()
+        for start in range(0, len(matrix), batch_size):
+            block = np.asarray(matrix[start:start + batch_size], dtype=np.float32)
+            alive = ~self.deleted[start:start + len(block)]
+            yield np.arange(start, start + len(block))[alive], block[alive]
+
+    def iter_texts(self, batch_size: int = 10000) -> Iterator[List[Dict]]:
+        rows = [{"chunk_id": row["chunk_id"], "text": row["text"]}
+                for row, deleted in zip(self.metadata, self.deleted) if not deleted]
+        for start in range(0, len(rows), batch_size):
+            yield rows[start:start + batch_size]
+
+    def count(self) -> int:
+        return int(len(self.metadata) - self.deleted.sum())
+
+    def flush(self):
+        with self._lock:
+            # Muitas linhas removidas deixam a busca mais lenta, reescreve sem elas
+            if self.deleted.sum() > len(self.deleted) // 4:
+                self.compact()
+            np.save(self.deleted_path, self.deleted)
+            if self.centroids is not None:
+                np.savez(self.ivf_path, centroids=self.centroids, assignments=self.assignments)
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        """Partição IVF (centróide com maior IP) de cada vetor."""
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def build_index(self, iterations: int = 10, sample_size: int = 100_000):
+        """Particiona os vetores com k-means (IP em vetores normalizados) para a busca IVF."""
+        if not self.ivf_nlist:
+            return
+        with self._lock:
+            matrix = self._matrix()
+            # nlist < 0: calculado pelo tamanho da coleção
+            nlist = auto_nlist(len(matrix)) if self.ivf_nlist < 0 else self.ivf_nlist
+            if len(matrix) < nlist * 4:
+                print(f"Too few vectors ({len(matrix)}) for IVF with nlist={nlist}, using exact search")
+                return
+
+            rng = np.random.default_rng(0)
+            sample = matrix[np.sort(rng.choice(len(matrix), min(sample_size, len(matrix)), replace=False))]
+            sample = sample.astype(np.float32)
+            centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+            for _ in range(iterations):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                for c in range(nlist):
+                    members = sample[labels == c]
+                    if len(members):
+                        centroid = members.mean(axis=0)
+                        centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+
+            self.centroids = centroids
+            self._lists = None
+            self.assignments = np.concatenate([
+                self._assign(np.asarray(matrix[i:i + self.SEARCH_BLOCK_ROWS], dtype=np.float32))
+                for i in range(0, len(matrix), self.SEARCH_BLOCK_ROWS)
+            ])
+            np.savez(self.ivf_path, centroids=self.centroids, assignments=self.assignments)
+            print(f"✅ IVF index built with {nlist} partitions")
+
+    def compact(self):
+        """Reescreve os arquivos sem as linhas removidas."""
+        with self._lock:
+            keep = np.flatnonzero(~self.deleted)
+            if len(keep) == len(self.metadata):
+                return
+            arrays = [(self._matrix(), self.vectors_path)]
+            if self.quantization != "none":
+                codes, scales = self._compact_codes()
+                arrays.append((codes, self.codes_path))
+                if scales is not None:
+                    arrays.append((scales, self.scales_path))
+            
+            for array, path in arrays:
+                tmp_path = path.with_suffix(".tmp")
+                with open(tmp_path, "wb") as f:
+                    for i in range(0, len(keep), self.SEARCH_BLOCK_ROWS):
+                        f.write(np.ascontiguousarray(array[keep[i:i + self.SEARCH_BLOCK_ROWS]]).tobytes())
+                os.replace(tmp_path, path)
+            self._vectors = None
+            self._codes = None
+
+            self.metadata = [self.metadata[i] for i in keep]
+            self._file_rows = None
+            with open(self.metadata_path, "w", encoding="utf-8") as f:
+                for row in self.metadata:
+                    f.write(json.dumps(row) + "\n")
+
+            self.deleted = np.zeros(len(keep), dtype=bool)
+            np.save(self.deleted_path, self.deleted)
+            if self.assignments is not None:
+                self.assignments = self.assignments[keep]
+                self._lists = None
+                np.savez(self.ivf_path, centroids=self.centroids, assignments=self.assignments)
+
+    def _top_k(self, rows: np.ndarray, scores: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k (linhas, scores) de um vetor de scores, ordenado do maior para o menor."""
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            rows, scores = rows[best], scores[best]
+        order = np.argsort(-scores)
+        return rows[order], scores[order]
+
+    def _search_exact(self, queries: np.ndarray, top_k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        n_rows = len(self.metadata)
+        best = [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in queries]
+        for start in range(0, n_rows, self.SEARCH_BLOCK_ROWS):
+            end = min(start + self.SEARCH_BLOCK_ROWS, n_rows)
+            scores = self._coarse_scores(slice(start, end), queries)
+            scores[self.deleted[start:end]] = -np.inf
+            rows = np.arange(start, end)
+            for q in range(len(queries)):
+                block_rows, block_scores = self._top_k(rows, scores[:, q], top_k)
+                best[q] = self._top_k(np.concatenate([best[q][0], block_rows]),
+                                      np.concatenate([best[q][1], block_scores]), top_k)
+        return best
+
+    def _inverted_lists(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Linhas ordenadas por partição + offsets de cada partição (recalculado depois de inserts)."""
+        if self._lists is None or len(self._lists[0]) != len(self.assignments):
+            order = np.argsort(self.assignments, kind="stable")
+            offsets = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+            self._lists = (order, offsets)
+        return self._lists
+
+    def _search_ivf(self, queries: np.ndarray, top_k: int, nprobe: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        order, offsets = self._inverted_lists()
+        nprobe = min(nprobe, len(self.centroids))
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        results = []
+        for query, query_probes in zip(queries, probes):
+            rows = np.sort(np.concatenate([order[offsets[p]:offsets[p + 1]] for p in query_probes]))
+            rows = rows[~self.deleted[rows]]
+            scores = self._coarse_scores(rows, query[None, :])[:, 0]
+            results.append(self._top_k(rows, scores, top_k))
+        return results
+
+    def _rows_of_files(self, file_names: List[str]) -> np.ndarray:
+        """Linhas (não removidas) dos arquivos, pelo índice file_name -> linhas
+        (recalculado depois de inserts e da compactação)."""
+        if self._file_rows is None or self._file_rows[0] != len(self.metadata):
+            by_file: Dict[str, List[int]] = {}
+            for i, row in enumerate(self.metadata):
+                by_file.setdefault(row["file_name"], []).append(i)
+            self._file_rows = (len(self.metadata), {name: np.asarray(rows) for name, rows in by_file.items()})
+        parts = [self._file_rows[1][name] for name in file_names if name in self._file_rows[1]]
+        rows = np.sort(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+        return rows[~self.deleted[rows]]
+
+    def _search_rows(self, rows: np.ndarray, queries: np.ndarray, top_k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Busca exata restrita às linhas `rows` (escopo da busca)."""
+        best = [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in queries]
+        for start in range(0, len(rows), self.SEARCH_BLOCK_ROWS):
+            block_rows = rows[start:start + self.SEARCH_BLOCK_ROWS]
+            scores = self._coarse_scores(block_rows, queries)
+            for q in range(len(queries)):
+                top_rows, top_scores = self._top_k(block_rows, scores[:, q], top_k)
+                best[q] = self._top_k(np.concatenate([best[q][0], top_rows]),
+                                      np.concatenate([best[q][1], top_scores]), top_k)
+        return best
+
+    def _rescore(self, rows: np.ndarray, query: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Segundo estágio: score exato dos candidatos com os vetores completos do disco."""
+        scores = np.asarray(self._matrix()[rows], dtype=np.float32) @ query
+        return self._top_k(rows, scores, top_k)
+
+    def search(self, vectors: List[List[float]], top_k: int, output_fields: List[str],
+               search_params: Dict = None, scope: Optional[SearchScope] = None) -> List[List[Dict]]:
+        if scope is not None and scope.expr is not None:
+            raise ValueError("Filter expressions are only supported by the Milvus vector store")
+        queries = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            # Com quantização a primeira passada pega mais candidatos para o rescoring
+            n_candidates = top_k if self.quantization == "none" else max(top_k, self.rescore_candidates)
+            if scope is not None and scope.file_names is not None:
+                matches = self._search_rows(self._rows_of_files(scope.file_names), queries, n_candidates)
+            elif self.centroids is not None:
+                nprobe = (search_params or {}).get("nprobe", self.ivf_nprobe)
+                matches = self._search_ivf(queries, n_candidates, nprobe)
+            else:
+                matches = self._search_exact(queries, n_candidates)
+            
+            if self.quantization != "none":
+                matches = [self._rescore(rows[np.isfinite(scores)], query, top_k)
+                           for (rows, scores), query in zip(matches, queries)]
+
+            # O vetor não fica nos metadados, vem da matriz
+            fields = [field for field in output_fields if field != "vector"]
+            with_vectors = len(fields) != len(output_fields)
+            results = []
+            for rows, scores in matches:
+                rows, scores = rows[np.isfinite(scores)], scores[np.isfinite(scores)]
+                vectors = np.asarray(self._matrix()[rows], dtype=np.float32) if with_vectors else None
+                results.append([
+                    {**{field: self.metadata[row][field] for field in fields},
+                     **({"vector": vectors[i]} if with_vectors else {}),
+                     "id": int(row), "score": float(score)}
+                    for i, (row, score) in enumerate(zip(rows, scores))
+                ])
+            return results
+
+def get_vector_store(backend: str = None) -> VectorStore:
+    """Cria o backend configurado em settings.VECTOR_STORE ("milvus" ou "numpy")."""
+    backend = backend or settings.VECTOR_STORE
+    if backend == "milvus":
+        return MilvusVectorStore()
+    if backend == "numpy":
+        return NumpyVectorStore()
+    raise ValueError(f"Unknown vector store backend: {backend}")
@@ -1,143 +1,279 @@
 import os
-import time
+import argparse
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Iterator, Optional, Tuple
 from openai import OpenAI
-from pymilvus import (
-    connections, Collection, CollectionSchema, FieldSchema, 
-    DataType, MilvusClient, utility
-)
 from config import settings
-from utils import extract_text_from_pdf, split_text, generate_doc_id, clean_text
+from utils import extract_text_from_pdf, split_texts, generate_doc_id, generate_file_hash, clean_text
+from index_manifest import IndexManifest
+from dedup import ChunkDeduplicator, format_stats as format_dedup_stats
+from embedding_cache import EmbeddingCache
+from embedding_scheduler import EmbeddingScheduler
+from ingest_pipeline import IngestPipeline
+from tracing import current_span, export_metrics, span, traced
+from vector_store import get_vector_store
+
+# Páginas divididas por chamada do splitter (split_texts)
+SPLIT_BATCH_PAGES = 32
 
 # Global variables
 client = None
-milvus_client = None
-collection = None
+vector_store = None
+embedding_cache = None
+embedding_scheduler = None
+deduplicator = None
 
 def initialize_connections():
-    """OPENAI e Milvus connections"""
-    global client, milvus_client
-    
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
-    milvus_client = MilvusClient(settings.MILVUS_URI)
-    
-    # Milvus
-    connections.connect("default", host=settings.MILVUS_HOST, port=settings.MILVUS_PORT)
-    print("✅ Connected to Milvus")
-
-def setup_collection():
-    """Cria ou recria a coleção no Milvus. (Dropa se já existir para poder inserir novos dados)"""
-    global collection
-    
-    if utility.has_collection(settings.COLLECTION_NAME):
-        print(f"Collection '{settings.COLLECTION_NAME}' already exists - dropping it...")
-        utility.drop_collection(settings.COLLECTION_NAME)
-        print(f"✅ Collection '{settings.COLLECTION_NAME}' dropped successfully")
-    
-    print(f"Creating new collection '{settings.COLLECTION_NAME}'")
-    fields = [
-        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
-        FieldSchema(name="vector", dtype=DataType.FLOAT_VECTOR, dim=settings.EMBEDDING_DIM),
-        FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=65535),
-        FieldSchema(name="file_name", dtype=DataType.VARCHAR, max_length=512),
-        FieldSchema(name="page_number", dtype=DataType.INT64),
-        FieldSchema(name="chunk_id", dtype=DataType.VARCHAR, max_length=512),
-    ]
+    """OPENAI e vector store (Milvus ou embutido) connections"""
+    global client, vector_store, embedding_cache, embedding_scheduler, deduplicator
     
-    schema = CollectionSchema(fields=fields, description="PDF document embeddings")
-    collection = Collection(settings.COLLECTION_NAME, schema)
+    client = OpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL)
     
-    # Index
-    index_params = {
-        "index_type": "IVF_FLAT",
-        "metric_type": "IP",
-        "params": {"nlist": 1024}
-    }
-    collection.create_index(field_name="vector", index_params=index_params)
-    print(f"✅ Collection '{settings.COLLECTION_NAME}' created successfully")
+    embedding_scheduler = EmbeddingScheduler(
+        client,
+        settings.EMBEDDING_MODEL,
+        max_concurrency=settings.EMBEDDING_CONCURRENCY,
+        max_batch_tokens=settings.EMBEDDING_MAX_BATCH_TOKENS,
+        max_batch_items=settings.EMBEDDING_MAX_BATCH_ITEMS,
+        max_retries=settings.EMBEDDING_MAX_RETRIES,
+        dimensions=settings.EMBEDDING_DIM,
+    )
+    
+    # Cache de embeddings
+    if settings.EMBEDDING_CACHE_ENABLED:
+        embedding_cache = EmbeddingCache(
+            settings.EMBEDDING_CACHE_PATH,
+            max_bytes=settings.EMBEDDING_CACHE_MAX_MB * 1024 * 1024
+        )
+    
+    # Índice dos chunks guardados (deduplicação)
+    if settings.DEDUP_ENABLED:
+        deduplicator = ChunkDeduplicator(
+            settings.DEDUP_INDEX_PATH,
+            threshold=settings.DEDUP_THRESHOLD,
+            num_perm=settings.DEDUP_NUM_PERM,
+            bands=settings.DEDUP_BANDS,
+            shingle_words=settings.DEDUP_SHINGLE_WORDS,
+            dim=settings.EMBEDDING_DIM,
+            model=settings.EMBEDDING_MODEL,
+        )
     
-    # Load collection
-    collection.load()
+    # Milvus ou vector store embutido
+    vector_store = get_vector_store()
+    vector_store.connect()
+
+def setup_collection(drop_existing: bool = True):
+    """Cria ou recria a coleção no vector store. (Dropa se já existir para poder inserir novos dados)
+    Com drop_existing=False a coleção existente é reaproveitada (modo incremental)."""
+    vector_store.setup(drop_existing)
+    if drop_existing and deduplicator is not None:
+        deduplicator.clear()
 
 def generate_embeddings(texts: List[str]) -> List[List[float]]:
     """Embeddings são gerados usando o modelo text-embedding-3-large do OpenAI.
-    Eles são usados para representar o texto em um espaço vetorial."""
-    embeddings = []
-    batch_size = 100  # Processa em batches para evitar limites do OpenAI API
+    Eles são usados para representar o texto em um espaço vetorial.
+    Os textos que já estão no cache de embeddings não vão para a API e o resto é
+    enviado em paralelo pelo embedding_scheduler."""
+    # Vetores com dimensão reduzida ficam separados no cache
+    cache_model = settings.EMBEDDING_MODEL
+    if settings.EMBEDDING_DIM != settings.EMBEDDING_MODEL_DIM:
+        cache_model = f"{settings.EMBEDDING_MODEL}:{settings.EMBEDDING_DIM}"
     
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i + batch_size]
-        print(f"Generating embeddings for batch {i//batch_size + 1}/{(len(texts)-1)//batch_size + 1}")
+    with span("embeddings", items=len(texts)) as embeddings_span:
+        cached = {}
+        if embedding_cache is not None:
+            with span("embedding_cache.get", items=len(texts)):
+                cached = embedding_cache.get_many(texts, cache_model)
         
-        response = client.embeddings.create(
-            input=batch,
-            model="text-embedding-3-large"
-        )
+        # Só os textos que não estão no cache (sem repetir) vão para a API
+        missing = list(dict.fromkeys(text for text in texts if text not in cached))
+        embeddings_span.set(cache_hits=len(texts) - len(missing))
+        if cached:
+            print(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} to generate")
+        
+        def on_batch(batch, batch_embeddings):
+            # Salva a cada batch, assim uma falha no meio não perde o que já foi pago
+            if embedding_cache is not None:
+                embedding_cache.put_many(batch, batch_embeddings, cache_model)
         
-        batch_embeddings = [data.embedding for data in response.data]
-        embeddings.extend(batch_embeddings)
+        if missing:
+            embeddings = embedding_scheduler.embed(missing, on_batch=on_batch)
+            cached.update(zip(missing, embeddings))
         
-        # Delay para evitar o hitting API rate limits
-        time.sleep(0.5)
+        return [cached[text] for text in texts]
+
+def chunk_params() -> Tuple[int, int, Optional[str]]:
+    """chunk_size, overlap e o modelo do tiktoken (None quando o tamanho é em caracteres)."""
+    if settings.CHUNK_UNIT == "tokens":
+        return settings.CHUNK_SIZE_TOKENS, settings.CHUNK_OVERLAP_TOKENS, settings.EMBEDDING_MODEL
+    return settings.CHUNK_SIZE, settings.CHUNK_OVERLAP, None
+
+def index_settings() -> Dict:
+    """Parâmetros que geram os chunks e os vetores. Guardados no manifesto: se mudarem,
+    os chunks já indexados não batem com os novos e o índice precisa ser recriado."""
+    return {
+        "CHUNK_UNIT": settings.CHUNK_UNIT,
+        "CHUNK_SIZE": settings.CHUNK_SIZE,
+        "CHUNK_OVERLAP": settings.CHUNK_OVERLAP,
+        "CHUNK_SIZE_TOKENS": settings.CHUNK_SIZE_TOKENS,
+        "CHUNK_OVERLAP_TOKENS": settings.CHUNK_OVERLAP_TOKENS,
+        "EMBEDDING_MODEL": settings.EMBEDDING_MODEL,
+        "EMBEDDING_DIM": settings.EMBEDDING_DIM,
+        "VECTOR_QUANTIZATION": settings.VECTOR_QUANTIZATION,
+    }
+
+def changed_settings(manifest: IndexManifest) -> List[str]:
+    """Parâmetros do índice diferentes dos que geraram o manifesto (todos, num manifesto antigo sem eles)."""
+    current = index_settings()
+    return [name for name, value in current.items() if manifest.settings.get(name) != value]
+
+def split_pages(pages: List[Dict]) -> Iterator[Dict]:
+    """Chunks de um grupo de páginas (uma chamada do splitter para o grupo), com os metadados."""
+    texts = split_texts([clean_text(page["content"]) for page in pages], *chunk_params())
+    for page, page_chunks in zip(pages, texts):
+        for chunk_idx, chunk in enumerate(page_chunks):
+            yield {
+                "text": chunk,
+                "file_name": page["file_name"],
+                "page_number": page["page_number"],
+                "chunk_id": f"{generate_doc_id(page['content'])}_{chunk_idx}"
+            }
+
+def iter_chunks(pdf_path: str, start_page: int = 0, end_page: int = None) -> Iterator[Dict]:
+    """Extrai o texto do PDF e divide em chunks (generator), com os metadados de cada chunk.
+    start_page/end_page limitam o intervalo de páginas. As páginas são divididas em grupos de
+    SPLIT_BATCH_PAGES (a memória fica limitada a um grupo)."""
+    pages = []
+    for page in extract_text_from_pdf(pdf_path, start_page, end_page):
+        pages.append(page)
+        if len(pages) >= SPLIT_BATCH_PAGES:
+            yield from split_pages(pages)
+            pages = []
+    if pages:
+        yield from split_pages(pages)
+
+def build_chunks(pdf_path: str, start_page: int = 0, end_page: int = None) -> List[Dict]:
+    """Lista com os chunks de um intervalo de páginas (usado pelo process pool do pipeline)."""
+    with span("ingest.extract", file=Path(pdf_path).name, start_page=start_page, end_page=end_page) as extract_span:
+        chunks = list(iter_chunks(pdf_path, start_page, end_page))
+        extract_span.set(items=len(chunks))
+    return chunks
+
+def dedup_chunks(chunks: List[Dict]) -> List[Dict]:
+    """Tira os chunks que já estão guardados (iguais ou quase iguais), antes dos embeddings."""
+    if deduplicator is None or not chunks:
+        return chunks
+    with span("dedup", items=len(chunks)) as dedup_span:
+        unique = deduplicator.filter(chunks)
+        dedup_span.set(duplicates=len(chunks) - len(unique))
+    return unique
+
+def insert_chunks(rows: List[Dict]):
+    """Insere no vector store as linhas (vector, text, file_name, page_number, chunk_id)."""
+    with span("vector_store.insert", items=len(rows),
+              bytes=sum(len(row["text"]) for row in rows) + len(rows) * settings.EMBEDDING_DIM * 4):
+        vector_store.insert(rows)
+
+def delete_chunks(file_name: str, chunk_keys=None):
+    """Remove do vector store os chunks de um arquivo. Sem chunk_keys remove o arquivo inteiro.
+    Com a deduplicação, chunks que outros arquivos referenciam são inseridos de novo no nome deles."""
+    promoted = deduplicator.remove(file_name, chunk_keys) if deduplicator is not None else []
+    with span("vector_store.delete", file=file_name, items=len(chunk_keys) if chunk_keys else None):
+        vector_store.delete(file_name, chunk_keys)
+    if promoted:
+        print(f"Re-inserting {len(promoted)} chunks referenced by other files")
+        embeddings = generate_embeddings([chunk["text"] for chunk in promoted])
+        insert_chunks([{**chunk, "vector": embedding} for chunk, embedding in zip(promoted, embeddings)])
+    if deduplicator is not None:
+        deduplicator.commit()
+
+@traced("ingest.batch")
+def flush_chunks(chunks: List[Dict], manifest: IndexManifest = None) -> int:
+    """Gera os embeddings de um batch de chunks, insere no Milvus e registra o checkpoint."""
+    current_span().set(items=len(chunks))
+    chunks = dedup_chunks(chunks)
+    if not chunks:
+        return 0
+    print(f"Generating embeddings for {len(chunks)} chunks...")
+    embeddings = generate_embeddings([chunk["text"] for chunk in chunks])
+    
+    # Prepara os dados para a inserção no Milvus
+    data_to_insert = [
+        {**chunk, "vector": embedding}
+        for chunk, embedding in zip(chunks, embeddings)
+    ]
+    
+    # Insere no Milvus
+    print(f"Inserting {len(data_to_insert)} chunks into the vector store...")
+    insert_chunks(data_to_insert)
     
-    return embeddings
+    if manifest is not None:
+        manifest.record_inserted(
+            chunks[0]["file_name"], [(chunk["chunk_id"], chunk["page_number"]) for chunk in chunks]
+        )
+    return len(data_to_insert)
 
-def process_pdf(pdf_path: str) -> int:
-    """Processa um unico PDF, extrai texto, divide em chunks, gera embeddings e insere no Milvus."""
+@traced("ingest.pdf")
+def process_pdf(pdf_path: str, manifest: IndexManifest = None) -> int:
+    """Processa um unico PDF, extrai texto, divide em chunks, gera embeddings e insere no Milvus.
+    As páginas são lidas em streaming e os chunks vão para o Milvus em batches de
+    INSERT_BATCH_SIZE, então a memória não cresce com o tamanho do PDF.
+    Com um manifesto, só os chunks novos são inseridos e os que sumiram do PDF são removidos;
+    se uma execução anterior caiu no meio deste PDF, continua de onde parou."""
     print(f"Processing PDF: {pdf_path}")
+    file_name = Path(pdf_path).name
+    current_span().set(file=file_name)
     
-    # Extrai texto do PDF
-    pages = extract_text_from_pdf(pdf_path)
-    if not pages:
-        print(f"No text found in {pdf_path}")
-        return 0
+    file_hash = None
+    old_keys = set()
+    if manifest is not None:
+        file_hash = generate_file_hash(pdf_path)
+        if manifest.get_hash(file_name) == file_hash and file_name not in manifest.pending:
+            print(f"Unchanged, skipping {pdf_path}")
+            return 0
+        old_keys = manifest.get_chunk_keys(file_name)
+        if file_name in manifest.pending:
+            print(f"Resuming {pdf_path} ({len(manifest.pending[file_name])} chunks already inserted)")
     
-    # Processa paginas em chunks
-    all_chunks = []
-    all_metadata = []
-    
-    for page in pages:
-        text = clean_text(page["content"])
-        chunks = split_text(text, settings.CHUNK_SIZE, settings.CHUNK_OVERLAP)
+    # Só precisamos de embeddings para os chunks que ainda não estão no Milvus
+    new_keys = set()
+    batch = []
+    inserted = 0
+    for chunk in iter_chunks(pdf_path):
+        key = (chunk["chunk_id"], chunk["page_number"])
+        new_keys.add(key)
+        if key in old_keys:
+            continue
         
-        for chunk_idx, chunk in enumerate(chunks):
-            chunk_id = f"{generate_doc_id(page['content'])}_{chunk_idx}"
-            all_chunks.append(chunk)
-            all_metadata.append({
-                "file_name": page["file_name"],
-                "page_number": page["page_number"],
-                "chunk_id": chunk_id
-            })
+        batch.append(chunk)
+        if len(batch) >= settings.INSERT_BATCH_SIZE:
+            inserted += flush_chunks(batch, manifest)
+            batch = []
     
-    if not all_chunks:
+    if batch:
+        inserted += flush_chunks(batch, manifest)
+    
+    if not new_keys:
         print(f"No valid chunks found in {pdf_path}")
-        return 0
     
-    # embeddings
-    print(f"Generating embeddings for {len(all_chunks)} chunks...")
-    embeddings = generate_embeddings(all_chunks)
+    # Remove os chunks antigos que não existem mais no PDF
+    stale_keys = old_keys - new_keys
+    if stale_keys:
+        print(f"Deleting {len(stale_keys)} stale chunks from the vector store...")
+        delete_chunks(file_name, stale_keys)
     
-    # Prepara os dados para a inserção no Milvus
-    data_to_insert = []
-    for i, (chunk, embedding, metadata) in enumerate(zip(all_chunks, embeddings, all_metadata)):
-        data_to_insert.append({
-            "vector": embedding,
-            "text": chunk,
-            "file_name": metadata["file_name"],
-            "page_number": metadata["page_number"],
-            "chunk_id": metadata["chunk_id"]
-        })
+    if manifest is not None:
+        manifest.update(file_name, file_hash, new_keys)
+        manifest.save()
     
-    # Insere no Milvus
-    print(f"Inserting {len(data_to_insert)} chunks into Milvus...")
-    collection.insert(data_to_insert)
-    
-    print(f"Successfully processed {pdf_path} - {len(data_to_insert)} chunks inserted")
-    return len(data_to_insert)
+    print(f"Successfully processed {pdf_path} - {inserted} chunks inserted")
+    current_span().set(items=inserted)
+    return inserted
 
-def process_all_pdfs() -> int:
-    """Processa todos os PDFs no diretório configurado."""
+@traced("ingest.all")
+def process_all_pdfs(manifest: IndexManifest = None) -> int:
+    """Processa todos os PDFs no diretório configurado.
+    Com um manifesto, os PDFs que foram removidos do diretório também são removidos do Milvus."""
     pdf_dir = Path(settings.PDF_DIRECTORY)
     if not pdf_dir.exists():
         print(f"Creating PDF directory: {pdf_dir}")
@@ -146,31 +282,104 @@ def process_all_pdfs() -> int:
         return 0
     
     pdf_files = list(pdf_dir.glob("*.pdf"))
+    
+    if manifest is not None:
+        current_files = {pdf_file.name for pdf_file in pdf_files}
+        for file_name in manifest.indexed_files():
+            if file_name not in current_files:
+                print(f"Removing deleted PDF from the vector store: {file_name}")
+                delete_chunks(file_name)
+                manifest.remove(file_name)
+                manifest.save()
+    
     if not pdf_files:
         print(f"No PDF files found in {pdf_dir}")
         return 0
     
-    total_chunks = 0
-    for pdf_file in pdf_files:
-        chunks = process_pdf(str(pdf_file))
-        total_chunks += chunks
+    if settings.PIPELINE_ENABLED:
+        pipeline = IngestPipeline(
+            build_chunks, generate_embeddings, insert_chunks, delete_chunks, manifest,
+            dedup_fn=dedup_chunks if deduplicator is not None else None,
+            extract_workers=settings.PIPELINE_EXTRACT_WORKERS,
+            embed_workers=settings.PIPELINE_EMBED_WORKERS,
+            insert_batch_size=settings.INSERT_BATCH_SIZE,
+            queue_size=settings.PIPELINE_QUEUE_SIZE,
+            pages_per_task=settings.PIPELINE_PAGES_PER_TASK,
+        )
+        total_chunks = pipeline.run([str(pdf_file) for pdf_file in pdf_files])
+    else:
+        total_chunks = 0
+        for pdf_file in pdf_files:
+            chunks = process_pdf(str(pdf_file), manifest)
+            total_chunks += chunks
     
     print(f"\nProcessing complete! Total chunks inserted: {total_chunks}")
     return total_chunks
 
 def main():
     """Main function."""
+    parser = argparse.ArgumentParser(description="Local PDF Vectorizer")
+    parser.add_argument("--full", action="store_true",
+                        help="Drop the collection and re-index every PDF")
+    parser.add_argument("--serial", action="store_true",
+                        help="Process one PDF at a time instead of the pipelined ingest")
+    parser.add_argument("--extract-workers", type=int, default=settings.PIPELINE_EXTRACT_WORKERS,
+                        help="Processes for PDF extraction and chunking")
+    parser.add_argument("--embed-workers", type=int, default=settings.PIPELINE_EMBED_WORKERS,
+                        help="Threads sending chunks to the embeddings stage")
+    parser.add_argument("--insert-batch-size", type=int, default=settings.INSERT_BATCH_SIZE,
+                        help="Chunks per embeddings + Milvus insert batch")
+    args = parser.parse_args()
+    
+    settings.PIPELINE_ENABLED = not args.serial
+    settings.PIPELINE_EXTRACT_WORKERS = args.extract_workers
+    settings.PIPELINE_EMBED_WORKERS = args.embed_workers
+    settings.INSERT_BATCH_SIZE = args.insert_batch_size
+    
     print("Starting Local PDF Vectorizer")
     print("=" * 50)
     
     # Initialize connections
     initialize_connections()
     
-    # Setup collection (drops existing if present)
-    setup_collection()
+    # Sem manifesto ou sem coleção não sabemos o que já está indexado, então recria tudo
+    manifest = IndexManifest(settings.MANIFEST_PATH).load()
+    full_rebuild = args.full or not manifest.exists() or not vector_store.exists()
+    # Chunks ou vetores gerados com outros parâmetros não podem ser misturados com os novos
+    changed = changed_settings(manifest) if not full_rebuild else []
+    if changed:
+        print(f"Index settings changed since the last run ({', '.join(changed)}), re-indexing everything")
+        full_rebuild = True
+    if full_rebuild:
+        print("Full re-index (dropping existing collection)")
+        manifest.clear()
+        manifest.settings = index_settings()
+        manifest.save()
+    else:
+        print("Incremental re-index (only new or changed PDFs)")
+    
+    # Setup collection (drops existing on full re-index)
+    setup_collection(drop_existing=full_rebuild)
     
     # Process all PDFs
-    process_all_pdfs()
+    process_all_pdfs(manifest)
+    with span("vector_store.flush"):
+        vector_store.flush()
+    with span("vector_store.build_index"):
+        vector_store.build_index()
+    export_metrics()
+    
+    print(f"Embedding API: {embedding_scheduler.requests} requests, "
+          f"{embedding_scheduler.rate_limited} rate limited")
+    
+    if embedding_cache is not None:
+        stats = embedding_cache.stats()
+        print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate']:.0%} hit rate), {stats['evictions']} evicted, "
+              f"{stats['entries']} entries / {stats['size_mb']:.1f} MB")
+    
+    if deduplicator is not None:
+        print(format_dedup_stats(deduplicator.stats()))
 
 if __name__ == "__main__":
     main()